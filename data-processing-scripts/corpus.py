@@ -0,0 +1,245 @@
+import os
+import re
+import sys
+import json
+import shutil
+import threading
+import pandas as pd
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfTransformer, TfidfVectorizer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'parliament-search', 'src'))
+from speech_store import SpeechStore, STORE_DIR_NAME
+
+#Shared representation of the speeches for the analysis steps (3 to 7).
+#preprocess.py writes every speech as token ids (corpus/tokens/): the vocabulary, one flat uint32 array
+#with the ids of all the speeches (ids.bin, memory-mapped) and the offset where every speech starts, in the order of the speech store.
+#The term counts are built straight from these arrays, without parsing any text. The speech TF-IDF,
+#the group models (party, year, member), the yearly trends and LSI are all derived from these counts
+
+SPEECH_STORE_DIR = f"parliament-search/public/{STORE_DIR_NAME}"
+
+# State kept between runs for the incremental mode (see pipeline.py --incremental). Not served by the API
+CORPUS_STATE_DIR = "parliament-search/public/corpus"
+TOKENS_DIR = os.path.join(CORPUS_STATE_DIR, 'tokens')
+# Speeches added by preprocess.py --incremental, not yet processed by pipeline.py
+PENDING_FILE = os.path.join(CORPUS_STATE_DIR, 'pending.json')
+FINGERPRINTS_FILE = os.path.join(CORPUS_STATE_DIR, 'row_fingerprints.npy')
+LSI_MODEL_FILE = os.path.join(CORPUS_STATE_DIR, 'lsi_model.joblib')
+LSI_COMPONENTS_FILE = os.path.join(CORPUS_STATE_DIR, 'lsi_components.npy')
+LSI_VECTORS_FILE = os.path.join(CORPUS_STATE_DIR, 'lsi_vectors.npy')
+KMEANS_MODEL_FILE = os.path.join(CORPUS_STATE_DIR, 'kmeans_model.joblib')
+CLUSTERS_FILE = os.path.join(CORPUS_STATE_DIR, 'clusters.npy')
+SENTIMENTS_FILE = os.path.join(CORPUS_STATE_DIR, 'sentiments.npy')
+STATE_FILE = os.path.join(CORPUS_STATE_DIR, 'state.json')
+
+# The default token_pattern of CountVectorizer/TfidfVectorizer, so the terms are the ones they would find
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+def tfidf_vectorizer_from(vocabulary, idf):
+    """A fitted TfidfVectorizer (default settings) with the given vocabulary and idf weights."""
+    vectorizer = TfidfVectorizer()
+    vectorizer.vocabulary_ = vocabulary
+    vectorizer.idf_ = idf
+    return vectorizer
+
+
+def load_token_vocabulary(tokens_dir=TOKENS_DIR):
+    try:
+        with open(os.path.join(tokens_dir, 'vocabulary.txt'), 'r', encoding='utf-8') as f:
+            return [line.rstrip('\n') for line in f]
+    except FileNotFoundError:
+        return []
+
+
+def save_token_vocabulary(vocabulary, tokens_dir=TOKENS_DIR):
+    os.makedirs(tokens_dir, exist_ok=True)
+    with open(os.path.join(tokens_dir, 'vocabulary.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(f"{token}\n" for token in vocabulary)
+
+
+class TokenCorpusWriter:
+    """Writes the token ids of the speeches in document order. Used by preprocess.py."""
+
+    def __init__(self, tokens_dir=TOKENS_DIR, append=False):
+        """With append=True new speeches are added after the ones already in tokens_dir."""
+        os.makedirs(tokens_dir, exist_ok=True)
+        self.tokens_dir = tokens_dir
+        self._offsets = np.load(os.path.join(tokens_dir, 'offsets.npy')).tolist() if append else [0]
+        self._ids_file = open(os.path.join(tokens_dir, 'ids.bin'), 'ab' if append else 'wb')
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def append_shard(self, ids_path, lengths):
+        """Speeches of another process: their uint32 ids back to back in ids_path and the number of ids of each."""
+        with open(ids_path, 'rb') as f:
+            shutil.copyfileobj(f, self._ids_file, 1 << 20)
+        for length in lengths:
+            self._offsets.append(self._offsets[-1] + length)
+
+    def close(self):
+        self._ids_file.close()
+        np.save(os.path.join(self.tokens_dir, 'offsets.npy'), np.array(self._offsets, dtype=np.int64))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TokenCorpus:
+
+    def __init__(self, tokens_dir=TOKENS_DIR):
+        self.vocabulary = np.array(load_token_vocabulary(tokens_dir), dtype=object)
+        self.offsets = np.load(os.path.join(tokens_dir, 'offsets.npy'))
+        ids_path = os.path.join(tokens_dir, 'ids.bin')
+        # Memory-mapped like the speech store; numpy cannot map an empty file
+        if os.path.getsize(ids_path) > 0:
+            self.ids = np.memmap(ids_path, dtype=np.uint32, mode='r')
+        else:
+            self.ids = np.zeros(0, dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def term_counts(self):
+        """
+        (sorted terms, speeches x terms float64 count matrix), the same matrix CountVectorizer(dtype=np.float64)
+        gives for the clean texts of the speeches: only the terms that occur, in sorted order, and every row
+        stored in the order CountVectorizer leaves it (terms by first occurrence in the corpus).
+        """
+        n_terms = len(self.vocabulary)
+        ids = np.array(self.ids, dtype=np.int32)
+        present, first_seen = np.unique(ids, return_index=True)
+
+        # Sorts ids in place, row by row
+        counts = csr_matrix((np.ones(len(ids)), ids, self.offsets), shape=(len(self), n_terms))
+        counts.sum_duplicates()
+
+        order = present[np.argsort(self.vocabulary[present], kind='stable')]
+        column = np.full(n_terms, -1, dtype=np.int32)
+        column[order] = np.arange(len(order), dtype=np.int32)
+        first_seen_rank = np.zeros(n_terms, dtype=np.int64)
+        first_seen_rank[present] = first_seen
+
+        rows = np.repeat(np.arange(len(self)), np.diff(counts.indptr))
+        stored_order = np.lexsort((first_seen_rank[counts.indices], rows))
+        counts = csr_matrix((counts.data[stored_order], column[counts.indices[stored_order]], counts.indptr),
+                            shape=(len(self), len(order)))
+        return self.vocabulary[order], counts
+
+
+def store_metadata(store):
+    # Metadata columns as pd.read_csv gives them for a csv: empty values are missing
+    return pd.DataFrame({
+        col: pd.Series(store.column_values(col)).replace('', np.nan) for col in store.columns
+    })
+
+
+class Corpus:
+
+    def __init__(self, df, tokens):
+        # Metadata of every speech, in the order of the speech store and the token ids. Do not modify in place
+        self.df = df.reset_index(drop=True)
+        self.tokens = tokens
+        self._terms = None
+        self._counts = None
+        # Stages of pipeline.py may ask for the counts from several threads at once
+        self._counts_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.df)
+
+    def term_counts(self):
+        """(sorted terms, speeches x terms count matrix), computed on first use."""
+        with self._counts_lock:
+            if self._counts is None:
+                print("Counting terms of every speech...")
+                self._terms, self._counts = self.tokens.term_counts()
+        return self._terms, self._counts
+
+    def speech_tfidf(self, min_df=1):
+        """
+        Same vectorizer and matrix as TfidfVectorizer(min_df=min_df).fit_transform(speeches),
+        without tokenizing the speeches again.
+        """
+        terms, counts = self.term_counts()
+
+        if min_df > 1:
+            kept = np.flatnonzero(np.bincount(counts.indices, minlength=counts.shape[1]) >= min_df)
+            counts = counts[:, kept]
+            terms = terms[kept]
+        vocabulary = {term: i for i, term in enumerate(terms)}
+
+        transformer = TfidfTransformer()
+        tfidf_matrix = transformer.fit_transform(counts)
+        return tfidf_vectorizer_from(vocabulary, transformer.idf_), tfidf_matrix
+
+    def group_tfidf(self, keys):
+        """
+        TF-IDF of groups of speeches, one document per distinct key (sorted, missing keys left out).
+        Same vocabulary, idf and values as TfidfVectorizer on the concatenated speeches of every group:
+        the counts of a group are the sum of the counts of its speeches, a (groups x speeches) indicator
+        times the shared term counts. Every row is stored in term order (TfidfVectorizer keeps the order
+        of first occurrence), so equal scores of a row come in term order.
+        Returns (vectorizer, groups x terms matrix, group keys).
+        """
+        all_terms, counts = self.term_counts()
+
+        group_of_speech, group_keys = pd.factorize(pd.Series(keys).reset_index(drop=True), sort=True)
+        speeches = np.flatnonzero(group_of_speech >= 0)
+        indicator = csr_matrix(
+            (np.ones(len(speeches)), (group_of_speech[speeches], speeches)),
+            shape=(len(group_keys), counts.shape[0])
+        )
+        group_counts = indicator @ counts
+
+        # A fitted vectorizer only knows the terms of its own documents
+        present = np.flatnonzero(group_counts.getnnz(axis=0) > 0)
+        if len(present) < group_counts.shape[1]:
+            group_counts = group_counts[:, present]
+        terms = all_terms[present]
+
+        transformer = TfidfTransformer()
+        tfidf_matrix = transformer.fit_transform(group_counts)
+        # The product leaves the terms of a row in no particular order
+        tfidf_matrix.sort_indices()
+        vectorizer = tfidf_vectorizer_from({term: i for i, term in enumerate(terms)}, transformer.idf_)
+        return vectorizer, tfidf_matrix, group_keys
+
+
+def load_corpus(store_dir=SPEECH_STORE_DIR, tokens_dir=TOKENS_DIR):
+    print(f"Φόρτωση του {tokens_dir} και των metadata του {store_dir}...")
+    try:
+        store = SpeechStore(store_dir)
+        tokens = TokenCorpus(tokens_dir)
+    except FileNotFoundError as e:
+        print(f"Error: {e.filename} not found. Run preprocess.py first.")
+        return None
+
+    if len(store) != len(tokens):
+        print(f"Error: {len(store)} speeches in the speech store, {len(tokens)} in the token corpus.")
+        return None
+
+    print(f"{len(store)} ομιλίες φορτώθηκαν.")
+    return Corpus(store_metadata(store), tokens)
+
+
+def save_corpus_state(info, n_docs, state_file=STATE_FILE):
+    """Bookkeeping of the incremental mode (info) for a corpus of n_docs speeches."""
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump({**info, 'n_docs': n_docs}, f, indent=2)
+
+
+def load_corpus_state(state_file=STATE_FILE):
+    """The info saved by the last run, None if there is no state."""
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
@@ -1,93 +1,204 @@
 import pandas as pd
-from sklearn.cluster import KMeans
+import numpy as np
+import joblib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from scipy.sparse import csr_matrix
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import silhouette_score
 import os
+import sys
+
+from corpus import CORPUS_STATE_DIR, KMEANS_MODEL_FILE, CLUSTERS_FILE, LSI_VECTORS_FILE, SPEECH_STORE_DIR
+from lsi import SPEECH_MATRIX_FILE
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'parliament-search', 'src'))
+from speech_store import SpeechStore
+from cluster_index import build_cluster_index, CLUSTER_INDEX_DIR_NAME
 
 #STEP 6 of processing
 #Perform clustering on speeches that have similar topics (according to LSI)
-
-def perform_clustering_on_existing_topics(input_csv, n_clusters=5):
-    print(f"\nΈναρξη Clustering (K-Means) με {n_clusters} ομάδες")
-    
-    try:
-        df = pd.read_csv(input_csv)
-        print("Το αρχείο φορτώθηκε επιτυχώς.")
-    except FileNotFoundError:
-        print(f"Σφάλμα: Το αρχείο {input_csv} δεν βρέθηκε.")
+#The LSI vectors are read from the binary array of lsi.py (memory-mapped) and clustered with mini-batch
+#k-means (k-means++ init, stops when the inertia of the batches no longer improves). Only the cluster of
+#every speech and the mean topic weights of every cluster are written, the texts stay in the speech store.
+#The clusters also partition the speech TF-IDF matrix for the cluster-pruned search (see cluster_index.py)
+
+CLUSTERS_OUTPUT_FILE = 'parliament-search/public/clustering_results/speech_clusters.csv'
+CLUSTER_ANALYSIS_FILE = 'parliament-search/public/clustering_results/cluster_topic_analysis.csv'
+CLUSTER_INDEX_DIR = f'parliament-search/public/search_models/{CLUSTER_INDEX_DIR_NAME}'
+
+# Speeches per mini-batch, and per chunk when all the vectors are labelled
+BATCH_SIZE = 4096
+CHUNK_ROWS = 65536
+# Speeches the k sweep trains and scores on
+SWEEP_SAMPLE_SIZE = 20000
+
+def new_kmeans(n_clusters, seed=42):
+    return MiniBatchKMeans(n_clusters=n_clusters, init='k-means++', n_init=3, batch_size=BATCH_SIZE,
+                           max_no_improvement=10, compute_labels=False, random_state=seed)
+
+def predict_in_chunks(kmeans, vectors):
+    """Cluster of every row of vectors (may be memory-mapped) and the total inertia, a chunk of rows at a time."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    inertia = 0.0
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + CHUNK_ROWS], dtype=np.float32)
+        labels[start:start + len(chunk)] = kmeans.predict(chunk)
+        inertia += ((chunk - kmeans.cluster_centers_[labels[start:start + len(chunk)]]) ** 2).sum()
+    return labels, inertia
+
+def cluster_means(vectors, labels, n_clusters):
+    """(clusters x topics) mean LSI vector of every cluster, summed a chunk of rows at a time."""
+    sums = np.zeros((n_clusters, vectors.shape[1]))
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        chunk_labels = labels[start:start + CHUNK_ROWS]
+        indicator = csr_matrix((np.ones(len(chunk_labels)), (chunk_labels, np.arange(len(chunk_labels)))),
+                               shape=(n_clusters, len(chunk_labels)))
+        sums += indicator @ np.asarray(vectors[start:start + CHUNK_ROWS], dtype=np.float64)
+    sizes = np.bincount(labels, minlength=n_clusters)
+    return sums / np.maximum(sizes, 1)[:, None], sizes
+
+def save_cluster_outputs(vectors, labels, n_clusters):
+    # Speech id -> cluster, row i being speech i of the speech store
+    os.makedirs(os.path.dirname(CLUSTERS_OUTPUT_FILE), exist_ok=True)
+    pd.DataFrame({'speech_id': np.arange(len(labels)), 'Cluster_ID': labels}).to_csv(
+        CLUSTERS_OUTPUT_FILE, index=False, encoding='utf-8')
+
+    # Mean topic weights of every cluster (read by the Clustering tab of the web application)
+    means, sizes = cluster_means(vectors, labels, n_clusters)
+    topic_cols = [f'Topic_{i+1}' for i in range(vectors.shape[1])]
+    table = pd.DataFrame(means, columns=topic_cols)
+    table.index.name = 'Cluster_ID'
+    table[sizes > 0].to_csv(CLUSTER_ANALYSIS_FILE, encoding='utf-8-sig')
+    return sizes
+
+def score_n_clusters(sample, n_clusters):
+    kmeans = new_kmeans(n_clusters).fit(sample)
+    labels = kmeans.predict(sample)
+    silhouette = silhouette_score(sample, labels) if 1 < len(np.unique(labels)) < len(sample) else -1.0
+    return {'n_clusters': n_clusters, 'inertia': float(kmeans.inertia_), 'silhouette': float(silhouette)}
+
+def sweep_n_clusters(vectors, candidates, sample_size=SWEEP_SAMPLE_SIZE, n_jobs=None, seed=42):
+    """
+    Trains one model per candidate k on the same random sample, in parallel threads, and returns the k
+    with the best silhouette on that sample. The inertia of every k is printed too, for an elbow check.
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False))
+    sample = np.asarray(vectors[rows], dtype=np.float32)
+    candidates = [k for k in candidates if 1 < k < len(sample)]
+    if not candidates:
+        return None
+
+    print(f"Αναζήτηση αριθμού ομάδων {candidates} σε δείγμα {len(sample)} ομιλιών...")
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count() or 1) as executor:
+        scores = list(executor.map(lambda k: score_n_clusters(sample, k), candidates))
+
+    print(f"{'k':>6} {'inertia':>12} {'silhouette':>11}")
+    for score in scores:
+        print(f"{score['n_clusters']:>6} {score['inertia']:>12.3f} {score['silhouette']:>11.4f}")
+    return max(scores, key=lambda score: score['silhouette'])['n_clusters']
+
+def perform_clustering(vectors, n_clusters=100, sweep=None):
+    """
+    vectors: the (speeches x topics) LSI vectors of lsi.py, row i being speech i of the speech store.
+    sweep: optional list of candidate k, the best one on a sample is used instead of n_clusters.
+    """
+    if sweep:
+        n_clusters = sweep_n_clusters(vectors, sweep) or n_clusters
+    n_clusters = min(n_clusters, len(vectors))
+    print(f"\nΈναρξη Clustering (Mini-Batch K-Means) με {n_clusters} ομάδες")
+
+    if n_clusters == 0:
+        print("Σφάλμα: Δεν βρέθηκαν διανύσματα LSI.")
         return
 
-    topic_cols = [col for col in df.columns if col.startswith('Topic_')]
-    
-    if not topic_cols:
-        print("Σφάλμα: Δεν βρέθηκαν στήλες Topic_X στο αρχείο.")
-        return
-        
-    print(f"Θα χρησιμοποιηθούν {len(topic_cols)} στήλες για το clustering: {topic_cols}")
-    
-    X = df[topic_cols]
+    print(f"Ομαδοποίηση {len(vectors)} ομιλιών ({vectors.shape[1]} θέματα) σε {n_clusters} clusters...")
+    kmeans = new_kmeans(n_clusters).fit(vectors)
+    labels, inertia = predict_in_chunks(kmeans, vectors)
+    print(f"{kmeans.n_steps_} mini-batches, inertia {inertia:.3f}")
 
-    # K-Means
-    print(f"Ομαδοποίηση ομιλιών σε {n_clusters} clusters...")
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    
-    df['Cluster_ID'] = kmeans.fit_predict(X)
+    # Kept so that the incremental mode can assign new speeches to these centroids
+    os.makedirs(CORPUS_STATE_DIR, exist_ok=True)
+    joblib.dump(kmeans, KMEANS_MODEL_FILE)
+    np.save(CLUSTERS_FILE, labels)
 
+    sizes = save_cluster_outputs(vectors, labels, n_clusters)
     print("\nΚατανομή ομιλιών ανά ομάδα (Cluster ID):")
-    distribution = df['Cluster_ID'].value_counts().sort_index()
-    print(distribution)
-
-    # Save file
-    output_filename = 'parliament-search/public/clustering_results/speeches_with_clusters.csv'
-    df.to_csv(output_filename, index=False, encoding='utf-8-sig')
-    
-    print(f"\nΕπιτυχία! Το αρχείο με τις ομάδες αποθηκεύτηκε στο: {output_filename}")
-    
-   
-    print("\nΥπολογισμός χαρακτηριστικών κάθε ομάδας...")
-    cluster_means = df.groupby('Cluster_ID')[topic_cols].mean()
-    cluster_means.to_csv('parliament-search/public/clustering_results/cluster_topic_analysis.csv', encoding='utf-8-sig')
-    print("Αποθηκεύτηκε και η ανάλυση των ομάδων στο 'cluster_topic_analysis.csv'")
-
-
-def print_speeches_by_cluster(csv_path, target_cluster_id, save_to_file=False):
+    print(pd.Series(sizes, name='count').rename_axis('Cluster_ID'))
+
+    print(f"\nΕπιτυχία! Οι ομάδες αποθηκεύτηκαν στο: {CLUSTERS_OUTPUT_FILE}")
+    print(f"Αποθηκεύτηκε και η ανάλυση των ομάδων στο: {CLUSTER_ANALYSIS_FILE}")
+
+
+def assign_to_existing_clusters(first_doc):
+    """
+    Incremental mode: speeches from first_doc on (folded into the saved LSI vectors, see lsi.fold_in_speeches)
+    go to the nearest existing centroid. The cluster means are computed again over all the speeches.
+    """
+    kmeans = joblib.load(KMEANS_MODEL_FILE)
+    vectors = np.load(LSI_VECTORS_FILE, mmap_mode='r')
+    print(f"\nΑντιστοίχιση {len(vectors) - first_doc} νέων ομιλιών στις {kmeans.n_clusters} υπάρχουσες ομάδες...")
+
+    new_labels, _ = predict_in_chunks(kmeans, vectors[first_doc:])
+    labels = np.concatenate([np.load(CLUSTERS_FILE)[:first_doc], new_labels]).astype(np.int32)
+    np.save(CLUSTERS_FILE, labels)
+
+    save_cluster_outputs(vectors, labels, kmeans.n_clusters)
+    print(f"Ενημερώθηκαν τα {CLUSTERS_OUTPUT_FILE} και {CLUSTER_ANALYSIS_FILE}")
+
+
+def build_cluster_search_index():
+    # Rows of the speech matrix of tfidf.py are the speech ids, as are the saved clusters
+    print("\nΚατασκευή cluster index πάνω στον πίνακα TF-IDF των ομιλιών...")
+    kmeans = joblib.load(KMEANS_MODEL_FILE)
+    labels = np.load(CLUSTERS_FILE)
+    tfidf_matrix = joblib.load(SPEECH_MATRIX_FILE, mmap_mode='r')
+    if tfidf_matrix.shape[0] != len(labels):
+        print(f"Σφάλμα: {tfidf_matrix.shape[0]} γραμμές στον πίνακα TF-IDF, {len(labels)} ομιλίες με ομάδα.")
+        return
+    build_cluster_index(tfidf_matrix, labels, kmeans.cluster_centers_, CLUSTER_INDEX_DIR)
+
+
+def print_speeches_by_cluster(target_cluster_id, save_to_file=False):
     print(f"\n--- Αναζήτηση ομιλιών για το Cluster ID: {target_cluster_id} ---")
-    
+
     try:
-        df = pd.read_csv(csv_path)
+        labels = np.load(CLUSTERS_FILE)
     except FileNotFoundError:
-        print(f"Σφάλμα: Το αρχείο {csv_path} δεν βρέθηκε.")
+        print(f"Σφάλμα: Το αρχείο {CLUSTERS_FILE} δεν βρέθηκε. Έχεις τρέξει το clustering;")
         return
 
-    if 'Cluster_ID' not in df.columns:
-        print("Σφάλμα: Δεν βρέθηκε στήλη 'Cluster_ID'. Έχεις τρέξει το clustering;")
-        return
-    cluster_data = df[df['Cluster_ID'] == int(target_cluster_id)]
-    
+    cluster_data = np.flatnonzero(labels == int(target_cluster_id))
+    # Speech ids of the speech store, which holds the texts and the metadata
+    store = SpeechStore(SPEECH_STORE_DIR)
+
     count = len(cluster_data)
     print(f"Βρέθηκαν {count} ομιλίες στην ομάδα {target_cluster_id}.\n")
-    
+
     if count == 0:
         return
 
     if save_to_file:
         filename = f"cluster_{target_cluster_id}_speeches.txt"
         with open(filename, "w", encoding="utf-8") as f:
-            for i, (idx, row) in enumerate(cluster_data.iterrows()):
+            for i, idx in enumerate(cluster_data):
                 f.write(f"--- Ομιλία {i+1}/{count} ---\n")
-                f.write(f"Ομιλητής: {row['member_name']}\n")
-                f.write(f"Ημερομηνία: {row['sitting_date']}\n")
-                f.write(f"Κείμενο:\n{row['speech']}\n")
+                f.write(f"Ομιλητής: {store.value(idx, 'member_name')}\n")
+                f.write(f"Ημερομηνία: {store.value(idx, 'sitting_date')}\n")
+                f.write(f"Κείμενο:\n{store.text(idx)}\n")
                 f.write("\n" + "="*50 + "\n\n")
         print(f"Οι ομιλίες αποθηκεύτηκαν στο αρχείο: {filename}")
-        
+
     else:
-        for i, (idx, row) in enumerate(cluster_data.iterrows()):
+        for i, idx in enumerate(cluster_data):
             print(f"--- Ομιλία {i+1}/{count} ---")
-            print(f"Ομιλητής: {row.get('member_name', 'Άγνωστος')}") 
-            print(f"Ημερομηνία: {row.get('sitting_date', '-')}")
+            print(f"Ομιλητής: {store.value(idx, 'member_name') or 'Άγνωστος'}")
+            print(f"Ημερομηνία: {store.value(idx, 'sitting_date') or '-'}")
             print(f"Κείμενο:")
-            print(row['speech'])
+            print(store.text(idx))
             print("\n" + "="*50 + "\n")
-    counts = df['Cluster_ID'].value_counts()
+    counts = pd.Series(labels).value_counts()
 
     print("Οι 5 μεγαλύτερες ομάδες:")
     print(counts.head(5))
@@ -98,15 +209,25 @@ def print_speeches_by_cluster(csv_path, target_cluster_id, save_to_file=False):
     print(f"\nΠόσες ομάδες έχουν κάτω από 5 ομιλίες; {(counts < 5).sum()}")
 
 
-lsi_file = 'parliament-search/public/lsi_results/speech_vectors_lsi.csv' 
-
-# Choose n_clusters
-perform_clustering_on_existing_topics(lsi_file, n_clusters=100)
-
-# The file we just created
-speaches_with_clusters_file = "parliament-search/public/clustering_results/speeches_with_clusters.csv" 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mini-batch k-means on the LSI vectors of lsi.py")
+    parser.add_argument('--n-clusters', type=int, default=100)
+    parser.add_argument('--sweep', type=lambda value: [int(k) for k in value.split(',')], default=None,
+                        help="candidate numbers of clusters, e.g. 50,100,200: the best silhouette on a sample wins")
+    args = parser.parse_args()
 
-#OPTIONAL - Print and save to file all speeches of a specified cluster
-#print_speeches_by_cluster(speaches_with_clusters_file, target_cluster_id=27, save_to_file=True)    
+    # The LSI vectors of lsi.py, row i being speech i of the speech store
+    try:
+        vectors = np.load(LSI_VECTORS_FILE, mmap_mode='r')
+        print("Το αρχείο φορτώθηκε επιτυχώς.")
+    except FileNotFoundError:
+        print(f"Σφάλμα: Το αρχείο {LSI_VECTORS_FILE} δεν βρέθηκε.")
+        vectors = None
 
+    # Choose n_clusters
+    if vectors is not None:
+        perform_clustering(vectors, n_clusters=args.n_clusters, sweep=args.sweep)
+        build_cluster_search_index()
 
+    #OPTIONAL - Print and save to file all speeches of a specified cluster
+    #print_speeches_by_cluster(target_cluster_id=27, save_to_file=True)
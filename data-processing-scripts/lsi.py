@@ -1,72 +1,199 @@
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import TruncatedSVD
+import numpy as np
+import joblib
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.feature_extraction.text import TfidfTransformer
 import os
+import sys
+
+from corpus import (load_corpus, tfidf_vectorizer_from, CORPUS_STATE_DIR, LSI_MODEL_FILE, LSI_COMPONENTS_FILE,
+                    LSI_VECTORS_FILE)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'parliament-search', 'src'))
+from normalized_vectors import build_normalized_vectors, load_normalized_vectors, VECTORS_DIR_NAME
+from ann_index import build_ann_index, ANN_DIR_NAME
+from semantic_index import build_semantic_index, SEMANTIC_DIR_NAME
 
 #STEP 5 of processing
-#Perform LSI analysis
+#Perform LSI analysis on the speech TF-IDF matrix of tfidf.py, with a randomized SVD computed out of core:
+#the matrix is memory-mapped and read in chunks of rows by parallel threads, only (terms x components)
+#matrices are kept in memory. The components and the LSI vectors of the speeches are saved as .npy files
+#The LSI vectors are also saved normalized for the API (see normalized_vectors.py), and over these get an
+#approximate nearest-neighbour index (see ann_index.py) for /speech/{id}/similar and, with the vectorizer
+#and projection of the fit, a semantic index (see semantic_index.py) for /search
+
+SPEECH_MATRIX_FILE = 'parliament-search/public/search_models/tfidf_matrix_speech.joblib'
+SPEECH_VECTORIZER_FILE = 'parliament-search/public/search_models/tfidf_vectorizer_speech.joblib'
+NORMALIZED_VECTORS_DIR = f'parliament-search/public/search_models/{VECTORS_DIR_NAME}'
+ANN_INDEX_DIR = f'parliament-search/public/search_models/{ANN_DIR_NAME}'
+SEMANTIC_INDEX_DIR = f'parliament-search/public/search_models/{SEMANTIC_DIR_NAME}'
+
+# Rows of the speech matrix in memory at once, per thread
+CHUNK_ROWS = 20000
+# Extra random directions and power iterations of the randomized SVD (Halko et al.)
+N_OVERSAMPLES = 10
+N_POWER_ITERATIONS = 4
+
+def row_chunks(n_rows, chunk_rows=CHUNK_ROWS):
+    return [(start, min(start + chunk_rows, n_rows)) for start in range(0, n_rows, chunk_rows)]
+
+def map_chunks(executor, fn, chunks, n_jobs):
+    """Results of fn for every chunk, in order, with no more than n_jobs chunks in flight."""
+    for wave in range(0, len(chunks), n_jobs):
+        yield from executor.map(fn, chunks[wave:wave + n_jobs])
+
+def randomized_svd_out_of_core(matrix, n_components, n_jobs=None, seed=42):
+    """
+    Top n_components right singular vectors (components x terms) and singular values of a (rows x terms)
+    sparse matrix. Subspace iteration on A^T A, whose product with a (terms x k) block is summed over
+    chunks of rows, then the small projected Gram matrix is diagonalized. Signs as in TruncatedSVD.
+    """
+    n_rows, n_terms = matrix.shape
+    n_random = min(n_components + N_OVERSAMPLES, n_terms)
+    n_jobs = n_jobs or os.cpu_count() or 1
+    chunks = row_chunks(n_rows)
+    rng = np.random.default_rng(seed)
+
+    def gram_product(basis):
+        # A^T (A basis), one chunk of rows of A at a time
+        def chunk_product(bounds):
+            block = matrix[bounds[0]:bounds[1]]
+            return block.T @ (block @ basis)
+        return sum(map_chunks(executor, chunk_product, chunks, n_jobs))
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        basis, _ = np.linalg.qr(rng.standard_normal((n_terms, n_random)))
+        for _ in range(N_POWER_ITERATIONS):
+            basis, _ = np.linalg.qr(gram_product(basis))
+
+        # basis^T A^T A basis = W diag(s^2) W^T, so the right singular vectors are basis W
+        eigenvalues, eigenvectors = np.linalg.eigh(basis.T @ gram_product(basis))
 
-def perform_lsi_analysis(csv_path, n_topics=10):
+    order = np.argsort(eigenvalues)[::-1][:n_components]
+    singular_values = np.sqrt(np.clip(eigenvalues[order], 0, None))
+    components = (basis @ eigenvectors[:, order]).T
+
+    # The largest entry of every component is positive (sklearn's svd_flip on the components)
+    signs = np.sign(components[np.arange(len(components)), np.argmax(np.abs(components), axis=1)])
+    signs[signs == 0] = 1
+    return components * signs[:, None], singular_values
+
+def project_out_of_core(matrix, components, output_file, n_jobs=None):
+    """LSI vectors (rows x components, float32) of every row, written chunk by chunk to an .npy file."""
+    n_jobs = n_jobs or os.cpu_count() or 1
+    chunks = row_chunks(matrix.shape[0])
+    tmp_file = f"{output_file}.tmp.npy"
+    vectors = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=np.float32,
+                                        shape=(matrix.shape[0], len(components)))
+
+    def project_chunk(bounds):
+        vectors[bounds[0]:bounds[1]] = matrix[bounds[0]:bounds[1]] @ components.T
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        for _ in map_chunks(executor, project_chunk, chunks, n_jobs):
+            pass
+    vectors.flush()
+    del vectors
+    os.replace(tmp_file, output_file)
+    return np.load(output_file, mmap_mode='r')
+
+def perform_lsi_analysis(corpus, n_topics=100):
     print(f"\nΈναρξη LSI Analysis (Θέματα: {n_topics})")
-    
-    try:
-        df = pd.read_csv(csv_path)
-        print("Το αρχείο φορτώθηκε επιτυχώς.")
-    except FileNotFoundError:
-        print(f"Σφάλμα: Το αρχείο {csv_path} δεν βρέθηκε.")
-        return
 
-    if 'speech' not in df.columns:
-        print("Σφάλμα: Δεν βρέθηκε στήλη 'speech'.")
-        return
+    df = corpus.df
 
-    df = df.dropna(subset=['speech'])
-    df['speech'] = df['speech'].astype(str)
-    
     if df.empty:
         print("Δεν έμειναν δεδομένα προς ανάλυση.")
         return
 
-    print("Υπολογισμός TF-IDF...")
-    tfidf = TfidfVectorizer(min_df=5) 
-    tfidf_matrix = tfidf.fit_transform(df['speech'])
+    # The speech model of tfidf.py, memory-mapped: rows are read from disk chunk by chunk
+    print(f"Φόρτωση του πίνακα TF-IDF από το {SPEECH_MATRIX_FILE}...")
+    tfidf_matrix = joblib.load(SPEECH_MATRIX_FILE, mmap_mode='r')
+    tfidf = joblib.load(SPEECH_VECTORIZER_FILE)
     feature_names = tfidf.get_feature_names_out()
 
+    if tfidf_matrix.shape[0] != len(df):
+        print(f"Σφάλμα: {tfidf_matrix.shape[0]} γραμμές στον πίνακα TF-IDF, {len(df)} ομιλίες.")
+        return
+
+    n_topics = min(n_topics, *tfidf_matrix.shape)
+
     # LSI
     print(f"Εκτέλεση LSI για εντοπισμό {n_topics} θεματικών ενοτήτων...")
-    
-    lsi_model = TruncatedSVD(n_components=n_topics, random_state=42)
-    lsi_matrix = lsi_model.fit_transform(tfidf_matrix)
+    components, singular_values = randomized_svd_out_of_core(tfidf_matrix, n_topics)
+
+    # Kept so that the incremental mode can fold new speeches into this topic space
+    os.makedirs(CORPUS_STATE_DIR, exist_ok=True)
+    joblib.dump({'terms': feature_names, 'idf': tfidf.idf_, 'singular_values': singular_values}, LSI_MODEL_FILE)
+    np.save(LSI_COMPONENTS_FILE, components)
+    lsi_matrix = project_out_of_core(tfidf_matrix, components, LSI_VECTORS_FILE)
 
     # Print most important keywords for each topic
-    print("\nΟι Σημαντικότερες Λέξεις ανά Θεματική Ενότητα (Topic)")
-    topic_keywords = []
-    
-    for i, component in enumerate(lsi_model.components_):
-        zipped = zip(feature_names, component)
-        top_terms = sorted(zipped, key=lambda t: t[1], reverse=True)[:15] # Top 15 words
-        
-        keywords = ", ".join([term for term, weight in top_terms])
-        print(f"Topic {i+1}: {keywords}")
-        topic_keywords.append(keywords)
-
-    # Save results
-    print("\nΑποθήκευση διανυσμάτων σε CSV...")
-    
-    topic_cols = [f'Topic_{i+1}' for i in range(n_topics)]
-    lsi_df = pd.DataFrame(lsi_matrix, columns=topic_cols)
-    df_reset = df.reset_index(drop=True)
-    final_df = pd.concat([df_reset, lsi_df], axis=1)
-    
-
-    output_path = 'parliament-search/public/lsi_results/speech_vectors_lsi.csv'
-    
-    final_df.to_csv(output_path, index=False, encoding='utf-8-sig')
-    print(f"Επιτυχία! Το αρχείο αποθηκεύτηκε στο: {output_path}")
-    
-    return lsi_matrix, lsi_model
-
-
-input_file = 'parliament-search/public/clean.csv' 
-    
-vectors, model = perform_lsi_analysis(input_file, n_topics=10)
\ No newline at end of file
+    print("\nΟι Σημαντικότερες Λέξεις ανά Θεματική Ενότητα (Topic), τα 10 πρώτα")
+
+    for i, component in enumerate(components[:10]):
+        top_terms = feature_names[np.argsort(-component, kind='stable')[:15]] # Top 15 words
+        print(f"Topic {i+1}: {', '.join(top_terms)}")
+
+    print(f"Επιτυχία! Τα διανύσματα αποθηκεύτηκαν στο: {LSI_VECTORS_FILE} και οι άξονες στο: {LSI_COMPONENTS_FILE}")
+
+    return lsi_matrix, {'components': components, 'singular_values': singular_values}
+
+
+def fold_in_speeches(terms, new_counts):
+    """
+    LSI vectors of speeches added after the last fit, in the topic space of that fit (same vocabulary,
+    idf and components, no refit). new_counts: (new speeches x terms) counts over the sorted terms.
+    The rows are appended to the saved vectors. Returns the (new speeches x topics) float32 vectors.
+    """
+    model = joblib.load(LSI_MODEL_FILE)
+    components = np.load(LSI_COMPONENTS_FILE)
+    print(f"\nΠροβολή {new_counts.shape[0]} νέων ομιλιών στα {len(components)} υπάρχοντα θέματα LSI...")
+
+    # The vocabulary only grows, every term of the fit is still there
+    columns = np.searchsorted(terms, model['terms'])
+    transformer = TfidfTransformer()
+    transformer.idf_ = model['idf']
+    lsi_matrix = (transformer.transform(new_counts[:, columns]) @ components.T).astype(np.float32)
+
+    # A new file: the previous vectors are copied chunk by chunk, never loaded all at once
+    vectors = np.load(LSI_VECTORS_FILE, mmap_mode='r')
+    tmp_file = f"{LSI_VECTORS_FILE}.tmp.npy"
+    appended = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=np.float32,
+                                         shape=(len(vectors) + len(lsi_matrix), len(components)))
+    for start, end in row_chunks(len(vectors)):
+        appended[start:end] = vectors[start:end]
+    appended[len(vectors):] = lsi_matrix
+    appended.flush()
+    del appended, vectors
+    os.replace(tmp_file, LSI_VECTORS_FILE)
+
+    print(f"Προστέθηκαν στο: {LSI_VECTORS_FILE}")
+    return lsi_matrix
+
+
+def build_lsi_normalized_vectors():
+    # Rows of the saved vectors are the speech ids of the speech store, fold-ins included
+    print("\nΚανονικοποίηση των διανυσμάτων LSI για το API...")
+    build_normalized_vectors(np.load(LSI_VECTORS_FILE, mmap_mode='r'), NORMALIZED_VECTORS_DIR)
+
+
+def build_lsi_ann_index():
+    print("\nΚατασκευή ANN index πάνω στα διανύσματα LSI...")
+    build_ann_index(load_normalized_vectors(NORMALIZED_VECTORS_DIR), ANN_INDEX_DIR)
+
+
+def build_lsi_semantic_index():
+    # Queries are weighted with the vocabulary and idf of the LSI fit, the one the components are over
+    print("\nΚατασκευή semantic index πάνω στα διανύσματα LSI...")
+    model = joblib.load(LSI_MODEL_FILE)
+    vectorizer = tfidf_vectorizer_from({term: i for i, term in enumerate(model['terms'])}, model['idf'])
+    build_semantic_index(vectorizer, np.load(LSI_COMPONENTS_FILE), SEMANTIC_INDEX_DIR)
+
+
+if __name__ == "__main__":
+    corpus = load_corpus()
+    if corpus is not None:
+        vectors, model = perform_lsi_analysis(corpus, n_topics=100)
+        build_lsi_normalized_vectors()
+        build_lsi_ann_index()
+        build_lsi_semantic_index()
@@ -0,0 +1,276 @@
+import os
+import sys
+import time
+import threading
+import joblib
+import numpy as np
+import json
+
+from corpus import (load_corpus, save_corpus_state, load_corpus_state,
+                    TOKENS_DIR, PENDING_FILE, FINGERPRINTS_FILE, LSI_MODEL_FILE, STATE_FILE,
+                    LSI_COMPONENTS_FILE, LSI_VECTORS_FILE, KMEANS_MODEL_FILE, CLUSTERS_FILE, SENTIMENTS_FILE)
+from tfidf import run_tfidf, TFIDF_GROUPS, INDEX_DIR_NAME, TRENDS_DIR_NAME
+from similarities import (find_top_k_similar_members, find_near_duplicate_speeches, member_names_of,
+                          SIMILARITY_FILE, NEAR_DUPLICATES_FILE, NEAR_DUPLICATE_SIMILARITY)
+from lsi import (perform_lsi_analysis, fold_in_speeches, build_lsi_normalized_vectors, build_lsi_ann_index,
+                 build_lsi_semantic_index, SPEECH_MATRIX_FILE, SPEECH_VECTORIZER_FILE, NORMALIZED_VECTORS_DIR,
+                 ANN_INDEX_DIR, SEMANTIC_INDEX_DIR)
+from kmeans import (perform_clustering, assign_to_existing_clusters, build_cluster_search_index,
+                    CLUSTERS_OUTPUT_FILE, CLUSTER_ANALYSIS_FILE, CLUSTER_INDEX_DIR)
+from sentiments import sentiment_by_year, SPEECH_STORE_DIR, SENTIMENT_FILE
+from stage_graph import Stage, StageGraph
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'parliament-search', 'src'))
+from generations import API_ARTIFACTS, OPTIONAL_API_ARTIFACTS, GENERATIONS_DIR_NAME, CURRENT_FILE_NAME
+from text_normalization import STEM_TABLE_FILE_NAME
+
+#Every step of processing, as a graph of stages (see stage_graph.py). run_pipeline.sh runs this script.
+#Every stage declares its code, inputs, parameters and outputs; a stage is skipped when none of them
+#changed since its last run, and stages that do not depend on each other run in parallel.
+#STEPS 3 to 6 run in this process: the term counts are built once from the token ids of preprocess.py
+#(see corpus.py), and every step works on this shared corpus, or on the results of the previous step,
+#instead of reading its csv again. The step scripts can still be run on their own.
+#
+#With --incremental preprocess.py only processes the new rows of the input and appends their token ids:
+#TF-IDF/IDF and the group models are derived again from the counts of all the speeches, and the new
+#speeches are folded into the existing LSI space and k-means centroids.
+#A full run is done instead when there is no saved state or the drift is above DRIFT_THRESHOLD
+
+PUBLIC_DIR = 'parliament-search/public'
+SCRIPTS_DIR = 'data-processing-scripts'
+SHARED_SRC_DIR = 'parliament-search/src'
+INPUT_FILE = 'data/random_sample.csv'
+FULL_SPEECHES_FILE = f'{PUBLIC_DIR}/clean_full_speeches.csv'
+STOPWORDS_FILE = f'{PUBLIC_DIR}/dictionary/stopwords_stemmed.txt'
+STEM_TABLE_FILE = f'{PUBLIC_DIR}/dictionary/{STEM_TABLE_FILE_NAME}'
+SEARCH_MODELS_DIR = f'{PUBLIC_DIR}/search_models'
+# The files of tfidf.py only: later stages write their own indexes in search_models/ too
+TFIDF_OUTPUTS = ([f'{SEARCH_MODELS_DIR}/tfidf_{kind}_{group}.joblib'
+                  for group in TFIDF_GROUPS for kind in ('vectorizer', 'matrix')] +
+                 [f'{SEARCH_MODELS_DIR}/{INDEX_DIR_NAME}', f'{SEARCH_MODELS_DIR}/{TRENDS_DIR_NAME}',
+                  f'{PUBLIC_DIR}/search_models_csv'])
+
+# STEPS 3 to 7. stem and preprocess run before them, publish after them
+ANALYSIS_STAGES = ['tfidf', 'similarities', 'near_duplicates', 'lsi', 'lsi_vectors', 'ann_index', 'semantic_index',
+                   'kmeans', 'cluster_index', 'sentiments', 'corpus_state']
+N_TOPICS = 100
+N_CLUSTERS = 100
+# Candidate numbers of clusters, e.g. [50, 100, 200]: the best silhouette on a sample replaces N_CLUSTERS
+N_CLUSTERS_SWEEP = None
+
+# Drift of the LSI/k-means models since their last full fit: the larger of the growth of the corpus
+# and the mean relative change of the idf of the LSI vocabulary
+DRIFT_THRESHOLD = 0.2
+
+def timed(name, step, *args, **kwargs):
+    started = time.perf_counter()
+    result = step(*args, **kwargs)
+    print(f"[pipeline] {name}: {time.perf_counter() - started:.1f}s")
+    return result
+
+
+class SharedResults:
+    """The corpus, loaded by the first stage that needs it, and the results stages pass to the next ones."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._corpus = None
+        self.models = None
+
+    @property
+    def corpus(self):
+        with self._lock:
+            if self._corpus is None:
+                self._corpus = timed("load corpus", load_corpus)
+                if self._corpus is None:
+                    raise RuntimeError(f"{TOKENS_DIR} could not be loaded")
+        return self._corpus
+
+
+def script(name):
+    return os.path.join(SCRIPTS_DIR, name)
+
+
+def shared_src(name):
+    return os.path.join(SHARED_SRC_DIR, name)
+
+
+def build_stages(incremental=False):
+    shared = SharedResults()
+
+    def run_tfidf_stage():
+        # STEP 3: speech, party, year and member models
+        shared.models = run_tfidf(shared.corpus)
+
+    def run_similarities_stage():
+        # STEP 4: member similarity, rows of the member model in the order of its grouped names
+        if shared.models is not None:
+            _, member_matrix, member_df = shared.models['member_name']
+            member_names = member_df['member_name'].tolist()
+        else:
+            member_matrix = joblib.load(f'{SEARCH_MODELS_DIR}/tfidf_matrix_member_name.joblib')
+            member_names = member_names_of(shared.corpus)
+        find_top_k_similar_members(member_matrix, member_names, k=10)
+
+    def run_near_duplicates_stage():
+        # STEP 4: pairs of speeches with almost the same terms, on the rows of the speech model
+        if shared.models is not None:
+            speech_matrix = shared.models['speech'][1]
+        else:
+            speech_matrix = joblib.load(f'{SEARCH_MODELS_DIR}/tfidf_matrix_speech.joblib')
+        find_near_duplicate_speeches(speech_matrix, shared.corpus.df)
+
+    def run_lsi_stage():
+        # STEP 5: LSI, on the speech matrix that the tfidf stage saved
+        perform_lsi_analysis(shared.corpus, n_topics=N_TOPICS)
+
+    def run_kmeans_stage():
+        # STEP 6: clustering of the LSI vectors that lsi.py saved, memory-mapped
+        perform_clustering(np.load(LSI_VECTORS_FILE, mmap_mode='r'), n_clusters=N_CLUSTERS, sweep=N_CLUSTERS_SWEEP)
+
+    def run_corpus_state_stage():
+        # Bookkeeping for the next --incremental run
+        corpus = shared.corpus
+        save_corpus_state({'lsi_fit_docs': len(corpus)}, len(corpus))
+
+    return [
+        # STEP 1
+        Stage('stem', [script('stem.py')], inputs=[], outputs=[STOPWORDS_FILE],
+              script=script('stem.py')),
+        # STEP 2. Both modes write the same files, the incremental one only tokenizes the new rows
+        Stage('preprocess',
+              [script('preprocess.py'), script('corpus.py'), shared_src('text_normalization.py'),
+               shared_src('speech_store.py')],
+              inputs=[INPUT_FILE, STOPWORDS_FILE],
+              # The stem table only saves work, the stems of a surface form never change
+              outputs=[TOKENS_DIR, FULL_SPEECHES_FILE, SPEECH_STORE_DIR, FINGERPRINTS_FILE, STEM_TABLE_FILE],
+              script=script('preprocess.py'), args=['--incremental'] if incremental else []),
+        Stage('tfidf',
+              [script('tfidf.py'), script('corpus.py'), shared_src('inverted_index.py'), shared_src('term_trends.py')],
+              inputs=[TOKENS_DIR, SPEECH_STORE_DIR],
+              outputs=TFIDF_OUTPUTS,
+              run=run_tfidf_stage),
+        Stage('similarities', [script('similarities.py')],
+              inputs=[SPEECH_STORE_DIR, f'{SEARCH_MODELS_DIR}/tfidf_matrix_member_name.joblib'],
+              outputs=[SIMILARITY_FILE], params={'k': 10},
+              run=run_similarities_stage),
+        Stage('near_duplicates', [script('similarities.py')],
+              inputs=[SPEECH_STORE_DIR, f'{SEARCH_MODELS_DIR}/tfidf_matrix_speech.joblib'],
+              outputs=[NEAR_DUPLICATES_FILE], params={'min_similarity': NEAR_DUPLICATE_SIMILARITY},
+              run=run_near_duplicates_stage),
+        Stage('lsi', [script('lsi.py'), script('corpus.py')],
+              inputs=[SPEECH_MATRIX_FILE, SPEECH_VECTORIZER_FILE, SPEECH_STORE_DIR],
+              outputs=[LSI_MODEL_FILE, LSI_COMPONENTS_FILE, LSI_VECTORS_FILE], params={'n_topics': N_TOPICS},
+              run=run_lsi_stage),
+        # One normalized copy of the vectors, shared by the two indexes below
+        Stage('lsi_vectors', [script('lsi.py'), shared_src('normalized_vectors.py')],
+              inputs=[LSI_VECTORS_FILE], outputs=[NORMALIZED_VECTORS_DIR],
+              run=build_lsi_normalized_vectors),
+        Stage('ann_index', [script('lsi.py'), shared_src('ann_index.py'), shared_src('inverted_index.py')],
+              inputs=[NORMALIZED_VECTORS_DIR], outputs=[ANN_INDEX_DIR],
+              run=build_lsi_ann_index),
+        Stage('semantic_index', [script('lsi.py'), script('corpus.py'), shared_src('semantic_index.py')],
+              inputs=[LSI_MODEL_FILE, LSI_COMPONENTS_FILE], outputs=[SEMANTIC_INDEX_DIR],
+              run=build_lsi_semantic_index),
+        Stage('kmeans', [script('kmeans.py')], inputs=[LSI_VECTORS_FILE],
+              outputs=[CLUSTERS_OUTPUT_FILE, CLUSTER_ANALYSIS_FILE, KMEANS_MODEL_FILE, CLUSTERS_FILE],
+              params={'n_clusters': N_CLUSTERS, 'sweep': N_CLUSTERS_SWEEP},
+              run=run_kmeans_stage),
+        Stage('cluster_index', [script('kmeans.py'), shared_src('cluster_index.py')],
+              inputs=[SPEECH_MATRIX_FILE, KMEANS_MODEL_FILE, CLUSTERS_FILE], outputs=[CLUSTER_INDEX_DIR],
+              run=build_cluster_search_index),
+        # STEP 7: a process of its own, it does not need the term counts and runs next to the stages above
+        Stage('sentiments', [script('sentiments.py'), shared_src('speech_store.py')],
+              inputs=[SPEECH_STORE_DIR], outputs=[SENTIMENT_FILE, SENTIMENTS_FILE],
+              script=script('sentiments.py')),
+        Stage('corpus_state', [script('corpus.py')], inputs=[TOKENS_DIR], outputs=[STATE_FILE],
+              run=run_corpus_state_stage),
+        # STEP 8
+        Stage('publish', [script('publish.py'), shared_src('generations.py')],
+              inputs=[os.path.join(PUBLIC_DIR, path) for path in API_ARTIFACTS + OPTIONAL_API_ARTIFACTS],
+              outputs=[os.path.join(PUBLIC_DIR, GENERATIONS_DIR_NAME, CURRENT_FILE_NAME)],
+              script=script('publish.py')),
+    ]
+
+
+def lsi_drift(terms, counts, lsi_fit_docs):
+    model = joblib.load(LSI_MODEL_FILE)
+    columns = np.searchsorted(terms, model['terms'])
+    n_docs = counts.shape[0]
+    document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])[columns]
+    # Smoothed idf, as TfidfTransformer computes it
+    idf = np.log((1 + n_docs) / (1 + document_frequency)) + 1
+    idf_shift = float(np.mean(np.abs(idf - model['idf']) / model['idf'])) if len(idf) else 0.0
+    growth = (n_docs - lsi_fit_docs) / max(lsi_fit_docs, 1)
+    return max(growth, idf_shift), growth, idf_shift
+
+
+def run_incremental():
+    """Returns False when a full run is needed instead."""
+    info = load_corpus_state()
+    if info is None or not os.path.exists(PENDING_FILE) or not os.path.exists(LSI_MODEL_FILE):
+        print("Δεν υπάρχει αποθηκευμένη κατάσταση ή νέες ομιλίες από το preprocess.py --incremental.")
+        return False
+    with open(PENDING_FILE, 'r', encoding='utf-8') as f:
+        pending = json.load(f)
+
+    corpus = load_corpus()
+    if corpus is None:
+        return False
+    n_old = pending['first_doc']
+    if n_old != info.get('n_docs') or len(corpus) != n_old + pending['n_docs']:
+        print(f"Ασυμφωνία: {len(corpus)} ομιλίες στο corpus, {info.get('n_docs')} + {pending['n_docs']} στην κατάσταση.")
+        return False
+
+    print(f"{pending['n_docs']} νέες ομιλίες, {n_old} υπάρχουσες.")
+    # Counts of all the speeches straight from the token ids, nothing is tokenized again
+    terms, counts = timed("count terms", corpus.term_counts)
+
+    drift, growth, idf_shift = lsi_drift(terms, counts, info['lsi_fit_docs'])
+    print(f"Drift LSI/k-means: {drift:.3f} (αύξηση {growth:.3f}, μεταβολή idf {idf_shift:.3f}, όριο {DRIFT_THRESHOLD})")
+    if drift > DRIFT_THRESHOLD:
+        print("Το drift ξεπέρασε το όριο, πλήρης επανεκπαίδευση.")
+        return False
+
+    # STEP 3: every TF-IDF model from all the counts, the idf changes with every new speech
+    models = timed("tfidf", run_tfidf, corpus)
+
+    # STEP 4
+    _, member_matrix, member_df = models['member_name']
+    timed("similarities", find_top_k_similar_members, member_matrix, member_df['member_name'].tolist(), k=10)
+    timed("near duplicates", find_near_duplicate_speeches, models['speech'][1], corpus.df)
+
+    # STEPS 5 and 6: new speeches only, in the existing topic space and clusters
+    if pending['n_docs']:
+        timed("lsi fold-in", fold_in_speeches, terms, counts[n_old:])
+        timed("kmeans assign", assign_to_existing_clusters, n_old)
+        # Built again over all the vectors, the lists and codebooks follow the new speeches
+        timed("lsi vectors", build_lsi_normalized_vectors)
+        timed("ann index", build_lsi_ann_index)
+        timed("semantic index", build_lsi_semantic_index)
+
+    # The speech matrix changed with the idf, the clusters keep their old speeches
+    timed("cluster index", build_cluster_search_index)
+
+    # STEP 7: only the new speeches are scored
+    timed("sentiments", sentiment_by_year, reuse_saved=True)
+
+    save_corpus_state(info, len(corpus))
+    os.remove(PENDING_FILE)
+    return True
+
+
+if __name__ == "__main__":
+    incremental = '--incremental' in sys.argv
+    graph = StageGraph(build_stages(incremental), max_parallel=max(2, os.cpu_count() or 1))
+
+    graph.run(['stem', 'preprocess'])
+    if incremental and timed("incremental", run_incremental):
+        print("[pipeline] incremental run complete")
+    else:
+        graph.run(ANALYSIS_STAGES)
+        if os.path.exists(PENDING_FILE):
+            os.remove(PENDING_FILE)
+    graph.run(['publish'])
+
+    graph.print_report()
@@ -1,34 +1,58 @@
-import re  
+import io
 import csv
 import sys
-import string
+import json
 import random
-from greek_stemmer import stemmer
-from functools import lru_cache
+import shutil
+import time
+import hashlib
+import mmap
+import re
+import numpy as np
 from multiprocessing import Pool, cpu_count
 import os
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'parliament-search', 'src'))
+from speech_store import SpeechStoreWriter, STORE_DIR_NAME
+from text_normalization import TextNormalizer, load_stopwords, load_stem_table, save_stem_table, stem_word, STEM_TABLE_FILE_NAME
+from generations import read_current_generation, generation_dir
+from corpus import (TokenCorpusWriter, load_token_vocabulary, save_token_vocabulary,
+                    CORPUS_STATE_DIR, PENDING_FILE, FINGERPRINTS_FILE, TOKENS_DIR, TOKEN_PATTERN)
+
 
 #STEP 2 of processing
-#Process the speeches while removing the ones that are too short and create a csv file of processed version
-#and a csv file of unprocessed version
+#Process the speeches while removing the ones that are too short and write the processed version as
+#token ids (corpus/tokens/, see corpus.py) and a csv file and speech store of the unprocessed version
+#With --incremental only the rows that are not in the previous run are processed and appended
+#Every worker reads byte ranges of the input itself and writes its rows to shard files, which are
+#appended to the outputs in input order; rows and speeches never travel through the pool.
+#Stemming works on the vocabulary: the distinct surface forms of the speeches are collected first,
+#every form missing from the stem table (dictionary/stem_table.tsv, also used by the API) is stemmed
+#once, and then the speeches are mapped through the table and the stems to their token ids
 
 INPUT_FILE = "data/random_sample.csv" 
-CLEAN_FILE = "parliament-search/public/clean.csv"
 FULL_SPEECHES_FILE = "parliament-search/public/clean_full_speeches.csv"
+SPEECH_STORE_DIR = f"parliament-search/public/{STORE_DIR_NAME}"
 SAMPLE_FILE = "data/random_sample.csv"
+PUBLIC_DIR = "parliament-search/public"
 STOPWORDS_FILE = 'parliament-search/public/dictionary/stopwords_stemmed.txt'
+STEM_TABLE_FILE = f'parliament-search/public/dictionary/{STEM_TABLE_FILE_NAME}'
 
 CHARACTER_LIMIT = 50
 
-translator = str.maketrans(string.punctuation + '΄‘’“”«»…–', ' ' * (len(string.punctuation) + 9))
-
-digit_punct_cleaner = re.compile(r'(?<=\d)[\.,](?=\d)')
-
 csv.field_size_limit(sys.maxsize)
 
-# Global variable for the worker processes
-worker_stopwords = None
+# Target size of the byte range of the input a worker processes at once
+CHUNK_BYTES = 16 * 1024 * 1024
+# Bytes that end an unquoted csv field (see chunk_ranges)
+FIELD_END = re.compile(rb'[,\r\n]')
+QUOTE = ord('"')
+SHARDS_DIR = os.path.join(CORPUS_STATE_DIR, 'shards')
+
+# Global variables for the worker processes
+worker_normalizer = None
+worker_input_file = None
+worker_vocabulary = None
 
 
 def create_directory_structure():
@@ -44,10 +68,11 @@ def create_directory_structure():
     public_subdirs = [
         "clustering_results",
         "dictionary",
-        "lsi_results",
         "search_models",
         "search_models_csv",
-        "similarity"
+        "similarity",
+        "corpus",
+        STORE_DIR_NAME
     ]
     
     print("--- Starting directory creation ---")
@@ -75,15 +100,13 @@ def create_directory_structure():
 
 
 
-@lru_cache(maxsize=100000)
-def cached_stem(word):
-    # No .upper() needed here anymore, input is already Upper
-    return stemmer.stem_word(word, 'VBG')
-
-def init_worker(stopwords_list):
-    """Initialize worker with stopwords to avoid pickling overhead."""
-    global worker_stopwords
-    worker_stopwords = stopwords_list
+def init_worker(input_file, stopwords_file, stem_table_file, tokens_dir=None):
+    """Every worker loads the stopwords, the known stems and the token ids itself, nothing large is pickled."""
+    global worker_normalizer, worker_input_file, worker_vocabulary
+    worker_input_file = input_file
+    worker_normalizer = TextNormalizer(load_stopwords(stopwords_file), stem_table=load_stem_table(stem_table_file))
+    if tokens_dir is not None:
+        worker_vocabulary = {token: i for i, token in enumerate(load_token_vocabulary(tokens_dir))}
 
 def create_random_sample(INPUT_FILE, output_file, sample_size):
 
@@ -120,52 +143,6 @@ def create_random_sample(INPUT_FILE, output_file, sample_size):
 
     print(f"Success! Sample saved to: {output_file}")
 
-def load_stopwords(filepath):
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            # OPTIMIZATION: Load stopwords as UPPERCASE directly
-            return set(line.strip().upper() for line in f if line.strip())
-    except FileNotFoundError:
-        print(f"Warning: {filepath} not found.")
-        return set()
-
-def process_text_optimized(text, stopwords_list):
-  
-    # 1. Uppercase entire text ONCE (matches Stemmer requirement)
-    # Remove number formatting 
-    text = digit_punct_cleaner.sub('', text.upper())
-    
-    # 2. Remove Punctuation 
-    text = text.translate(translator)
-    
-    words = text.split()
-    
-    cleaned_words = []
-    
-    # Optimization: Bind methods to local variables for faster lookup inside loop
-    append_word = cleaned_words.append
-    
-    for word in words:
-    # 4. Skip stopwords (checking against UPPERCASE set)
-        if word in stopwords_list:
-            continue
-            
-    # 5. Stem (word is already UPPER, no conversion needed)
-        stemmed_upper = cached_stem(word)
-        
-        # 6. Post-stemming checks
-        # Logic check: If stem became lower, stemmer rejected it or it's invalid
-        if stemmed_upper.islower():
-            continue 
-            
-        if stemmed_upper in stopwords_list:
-            continue
-            
-        # Only convert to lower at the very end for output
-        append_word(stemmed_upper.lower())
-
-    return ' '.join(cleaned_words)
-
 def process_row_wrapper(row):
     if not row: return None
     
@@ -176,7 +153,8 @@ def process_row_wrapper(row):
         # Return tuple: (type, data)
         return ('empty', row)
             
-    processed_text = process_text_optimized(original_speech, worker_stopwords)
+    # Same normalization the API applies to queries (text_normalization.py)
+    processed_text = worker_normalizer.normalize(original_speech)
     
     #Skip speech if it is too short
     if len(processed_text) >= CHARACTER_LIMIT:
@@ -190,58 +168,314 @@ def process_row_wrapper(row):
     
     return None
 
-def create_clean_csv(file_path, clean_file_path, clean_full_speeches_file_path, STOPWORDS_FILE):
+def row_digest(row):
+    return hashlib.blake2b('\x1f'.join(row).encode('utf-8'), digest_size=8).digest()
+
+def row_fingerprint(digest, seen):
+    """64-bit fingerprint of a raw input row from its digest. Repeated identical rows get distinct fingerprints."""
+    occurrence = seen.get(digest, 0)
+    seen[digest] = occurrence + 1
+    if occurrence:
+        digest = hashlib.blake2b(digest + occurrence.to_bytes(8, 'little'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+def read_header(file_path):
+    """Columns of the input and the byte offset of its first row. The header is a single line."""
+    with open(file_path, 'rb') as f:
+        first_line = f.readline()
+    header = next(csv.reader([first_line.decode('utf-8', errors='ignore')]), None)
+    return header, len(first_line)
+
+def chunk_ranges(file_path, start, chunk_bytes=CHUNK_BYTES):
+    """
+    Byte ranges of whole csv records from start to the end of the file, about chunk_bytes each.
+    A range ends after a newline that ends a record. The scan follows the states of the csv module:
+    a field is quoted only when it starts with '"' ('""' inside it is an escaped quote), a '"' anywhere
+    else in a field is an ordinary character.
+    """
+    ranges = []
+    size = os.path.getsize(file_path)
+    if start >= size:
+        return ranges
+
+    range_start = position = start
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        # position is always at the start of a field
+        while position < size:
+            if data[position] == QUOTE:
+                # Quoted field: only the closing quote matters, newlines and commas are part of the field
+                position += 1
+                while True:
+                    quote = data.find(b'"', position)
+                    if quote < 0:
+                        position = size
+                        break
+                    position = quote + 1
+                    if data[position:position + 1] != b'"':
+                        break
+                    position += 1
+            # Up to the end of the field. After a closing quote the csv module keeps any other characters
+            field_end = FIELD_END.search(data, position)
+            if field_end is None:
+                break
+            position = field_end.end()
+            if field_end.group() == b',':
+                continue
+
+            if field_end.group() == b'\r' and data[position:position + 1] == b'\n':
+                position += 1
+            if position - range_start >= chunk_bytes:
+                ranges.append((range_start, position))
+                range_start = position
+
+    if range_start < size:
+        ranges.append((range_start, size))
+    return ranges
+
+def read_chunk(start, end):
+    """csv rows of a byte range of the input, in a worker process."""
+    with open(worker_input_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # Same decoding and newline handling as reading the input in text mode
+    return csv.reader(io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', errors='ignore'))
+
+def chunk_digests(byte_range):
+    return [row_digest(row) for row in read_chunk(*byte_range)]
+
+def shard_paths(index):
+    return {kind: os.path.join(SHARDS_DIR, f'{index:05d}.{kind}') for kind in ('ids', 'full', 'text')}
+
+def process_chunk(task):
+    """
+    Processes the rows of a byte range of the input (only the positions set in keep, when given).
+    Token ids of the processed speeches, full rows and the full speeches for the speech store go to the
+    shard files of the chunk. Returns the digests of all its rows, the number of rows processed, the number
+    of token ids of every speech and the byte lengths and metadata of the stored speeches.
+    """
+    index, start, end, keep = task
+    digests, n_ids, lengths, metadata = [], [], [], []
+    count = 0
+    paths = shard_paths(index)
+
+    with open(paths['ids'], 'wb') as outfile_ids, \
+         open(paths['full'], 'w', newline='', encoding='utf-8') as outfile_full, \
+         open(paths['text'], 'wb') as outfile_text:
+        writer_clean_full_speeches = csv.writer(outfile_full)
+
+        for position, row in enumerate(read_chunk(start, end)):
+            digests.append(row_digest(row))
+            if keep is not None and not keep[position]:
+                continue
+
+            result = process_row_wrapper(row)
+            if result is None:
+                continue
+
+            result_type, data = result
+            if result_type == 'valid':
+                clean_row, full_row = data
+                # The terms CountVectorizer would find in the processed text, as ids
+                ids = [worker_vocabulary[token] for token in TOKEN_PATTERN.findall(clean_row[-1].lower())]
+                outfile_ids.write(np.array(ids, dtype=np.uint32).tobytes())
+                n_ids.append(len(ids))
+                writer_clean_full_speeches.writerow(full_row)
+                # Same rows and order as the token ids and the speech TF-IDF matrix, served by the API
+                encoded = full_row[-1].encode('utf-8')
+                outfile_text.write(encoded)
+                lengths.append(len(encoded))
+                metadata.append(full_row[:-1])
+            count += 1
+
+    return digests, count, n_ids, lengths, metadata
+
+def chunk_vocabulary(task):
+    """Number of tokens and distinct surface forms not in the stem table, of the rows of a chunk to process."""
+    start, end, keep = task
+    n_tokens = 0
+    forms = set()
+    for position, row in enumerate(read_chunk(start, end)):
+        if not row or not row[-1] or (keep is not None and not keep[position]):
+            continue
+        tokens = worker_normalizer.tokens(row[-1])
+        n_tokens += len(tokens)
+        forms.update(tokens)
+
+    stem_table = worker_normalizer.stem_table
+    return n_tokens, {form for form in forms if form not in stem_table}
 
-    stopwords = load_stopwords(STOPWORDS_FILE)
+def stem_words(words):
+    return [stem_word(word) for word in words]
+
+def update_stem_table(pool, ranges, keep):
+    """
+    Phases 1 and 2 of stemming: the workers collect the distinct surface forms of the rows to process,
+    then every form not in the stem table yet is stemmed exactly once and the table is saved.
+    The cost of stemming grows with the vocabulary, not with the number of tokens. Returns the table.
+    """
+    started = time.perf_counter()
+    n_tokens = 0
+    new_forms = set()
+    tasks = [(start, end, keep[index]) for index, (start, end) in enumerate(ranges)]
+    for chunk_tokens, chunk_forms in pool.imap_unordered(chunk_vocabulary, tasks):
+        n_tokens += chunk_tokens
+        new_forms |= chunk_forms
+    print(f"Λεξιλόγιο: {n_tokens} λέξεις, {len(new_forms)} νέες διακριτές μορφές ({time.perf_counter() - started:.1f}s)")
+
+    stem_table = load_stem_table(STEM_TABLE_FILE)
+    if not new_forms:
+        return stem_table
+
+    started = time.perf_counter()
+    new_forms = sorted(new_forms)
+    # Interleaved slices, so every worker gets forms of every length
+    n_pieces = cpu_count() * 4
+    pieces = [new_forms[i::n_pieces] for i in range(n_pieces)]
+    for piece, stems in zip(pieces, pool.map(stem_words, pieces)):
+        stem_table.update(zip(piece, stems))
+    save_stem_table(STEM_TABLE_FILE, stem_table)
+
+    elapsed = time.perf_counter() - started
+    print(f"Stemming: {len(new_forms)} μορφές σε {elapsed:.1f}s ({1e6 * elapsed / len(new_forms):.0f}µs ανά μορφή), "
+          f"{len(stem_table)} συνολικά στο {STEM_TABLE_FILE}")
+    return stem_table
+
+def update_token_vocabulary(stem_table, stopwords, append):
+    """
+    Gives every term the processed speeches can contain a token id and saves the vocabulary: the terms
+    of the stems normalize() keeps. With append=True the ids of the previous run are kept and new terms
+    are added after them.
+    """
+    vocabulary = load_token_vocabulary(TOKENS_DIR) if append else []
+    known = set(vocabulary)
+    new_terms = set()
+    for stem in set(stem_table.values()):
+        if stem.islower() or stem in stopwords:
+            continue
+        new_terms.update(term for term in TOKEN_PATTERN.findall(stem.lower()) if term not in known)
+    vocabulary.extend(sorted(new_terms))
+    save_token_vocabulary(vocabulary, TOKENS_DIR)
+    print(f"Λεξιλόγιο όρων: {len(vocabulary)} ({len(new_terms)} νέοι) στο {TOKENS_DIR}")
+
+def csv_line(row):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(row)
+    return buffer.getvalue().encode('utf-8')
+
+def append_file(path, outfile):
+    with open(path, 'rb') as f:
+        shutil.copyfileobj(f, outfile, 1 << 20)
+
+def prepare_incremental_run(fingerprints, speech_store_dir):
+    """
+    Fingerprints of the rows already processed, or None when a full run is needed: no previous run,
+    or rows of the previous run changed or removed from the input (fingerprints: every input row).
+    """
+    if not os.path.exists(FINGERPRINTS_FILE) or not os.path.exists(os.path.join(TOKENS_DIR, 'offsets.npy')):
+        print("Δεν υπάρχει προηγούμενη εκτέλεση, πλήρης επεξεργασία.")
+        return None
+
+    known = np.load(FINGERPRINTS_FILE)
+    if not np.isin(known, fingerprints).all():
+        print("Γραμμές της προηγούμενης εκτέλεσης άλλαξαν ή αφαιρέθηκαν, πλήρης επεξεργασία.")
+        return None
+
+    # Trees published before hard-linked generations have the speech store only in the served generation
+    if not os.path.exists(os.path.join(speech_store_dir, 'offsets.npy')):
+        generation_id = read_current_generation(PUBLIC_DIR)
+        source = os.path.join(generation_dir(PUBLIC_DIR, generation_id), STORE_DIR_NAME) if generation_id else None
+        if source is None or not os.path.exists(os.path.join(source, 'offsets.npy')):
+            print("Δεν βρέθηκε το speech store της προηγούμενης εκτέλεσης, πλήρης επεξεργασία.")
+            return None
+        shutil.rmtree(speech_store_dir, ignore_errors=True)
+        shutil.copytree(source, speech_store_dir)
+
+    return known
+
+def create_clean_corpus(file_path, clean_full_speeches_file_path, STOPWORDS_FILE, speech_store_dir=SPEECH_STORE_DIR, incremental=False):
+
+    # Range of the new speeches for pipeline.py --incremental. Without it pipeline.py does a full run
+    if os.path.exists(PENDING_FILE):
+        os.remove(PENDING_FILE)
 
-    print(f"Ξεκινάει ο καθαρισμός του αρχείου {file_path}...")
-    
     try:
-        with open(file_path, mode='r', encoding='utf-8', errors='ignore') as infile, \
-             open(clean_file_path, 'w', newline='', encoding='utf-8') as outfile_clean, \
-             open(clean_full_speeches_file_path, 'w', newline='', encoding='utf-8') as outfile_full:
-
-            reader = csv.reader(infile)
-            writer_clean = csv.writer(outfile_clean)
-            writer_clean_full_speeches = csv.writer(outfile_full)
-
-            try:
-                header = next(reader)
-                writer_clean.writerow(header)
-                writer_clean_full_speeches.writerow(header)
-            except StopIteration:
-                return
-
-            count = 0
-            
-            # Create a pool of workers to process rows in parallel
-            with Pool(processes=cpu_count(), initializer=init_worker, initargs=(stopwords,)) as pool:
-                
-                # imap allows processing the file as a stream without loading everything into RAM
-                for result in pool.imap(process_row_wrapper, reader, chunksize=100):
-                    if result is None:
-                        continue
-                        
-                    result_type, data = result
-                    
-                    if result_type == 'empty':
-                        writer_clean.writerow(data)
-                    elif result_type == 'valid':
-                        clean_row, full_row = data
-                        writer_clean.writerow(clean_row)
-                        writer_clean_full_speeches.writerow(full_row)
-                    
-                    count += 1
-                    if count % 1000 == 0:
-                        print(f"Επεξεργάστηκαν {count} γραμμές...", end='\r')
-        
-        print(f"\nΟλοκληρώθηκε! Αποθηκεύτηκαν στο {clean_file_path} και στο {clean_full_speeches_file_path}")
-                    
+        header, data_start = read_header(file_path)
     except FileNotFoundError:
         print(f"Σφάλμα: Το αρχείο {file_path} δεν βρέθηκε.")
+        return
+    if header is None:
+        return
+
+    ranges = chunk_ranges(file_path, data_start)
+    print(f"Ξεκινάει ο καθαρισμός του αρχείου {file_path} ({len(ranges)} τμήματα, {cpu_count()} workers)...")
+    shutil.rmtree(SHARDS_DIR, ignore_errors=True)
+    os.makedirs(SHARDS_DIR)
+
+    worker_args = (file_path, STOPWORDS_FILE, STEM_TABLE_FILE)
+    with Pool(processes=cpu_count(), initializer=init_worker, initargs=worker_args) as pool:
+
+        # Incremental mode: fingerprints of every input row first, then only the unknown rows are processed
+        known = None
+        keep = [None] * len(ranges)
+        if incremental:
+            seen = {}
+            chunk_fingerprints = [np.array([row_fingerprint(d, seen) for d in digests], dtype=np.uint64)
+                                  for digests in pool.imap(chunk_digests, ranges)]
+            all_fingerprints = np.concatenate(chunk_fingerprints) if ranges else np.array([], dtype=np.uint64)
+            known = prepare_incremental_run(all_fingerprints, speech_store_dir)
+            if known is not None:
+                print(f"{len(known)} γραμμές υπάρχουν ήδη, επεξεργάζονται μόνο οι νέες.")
+                keep = [~np.isin(fingerprints, known) for fingerprints in chunk_fingerprints]
+
+        stem_table = update_stem_table(pool, ranges, keep)
+
+    update_token_vocabulary(stem_table, load_stopwords(STOPWORDS_FILE), append=known is not None)
+
+    # Phase 3, in new workers that load the complete stem table and vocabulary: every surface form is a lookup
+    with Pool(processes=cpu_count(), initializer=init_worker, initargs=worker_args + (TOKENS_DIR,)) as pool:
+        fingerprints = []
+        seen = {}
+        count = 0
+
+        with open(clean_full_speeches_file_path, 'wb' if known is None else 'ab') as outfile_full:
+
+            if known is None:
+                outfile_full.write(csv_line(header))
+
+            # Columnar copy of the full speeches for the API: every column but the speech is metadata
+            store_writer = SpeechStoreWriter(speech_store_dir, header[:-1], append=known is not None)
+            tokens_writer = TokenCorpusWriter(TOKENS_DIR, append=known is not None)
+            first_doc = len(tokens_writer)
+
+            with store_writer, tokens_writer:
+                tasks = [(index, start, end, keep[index]) for index, (start, end) in enumerate(ranges)]
+                # imap returns the chunks in input order, so the shards are appended in that order
+                for index, (digests, chunk_count, n_ids, lengths, metadata) in enumerate(pool.imap(process_chunk, tasks)):
+                    fingerprints.extend(row_fingerprint(digest, seen) for digest in digests)
+
+                    paths = shard_paths(index)
+                    tokens_writer.append_shard(paths['ids'], n_ids)
+                    append_file(paths['full'], outfile_full)
+                    store_writer.append_shard(paths['text'], lengths, metadata)
+                    for path in paths.values():
+                        os.remove(path)
+
+                    count += chunk_count
+                    print(f"Επεξεργάστηκαν {count} γραμμές...", end='\r')
+
+    shutil.rmtree(SHARDS_DIR, ignore_errors=True)
+
+    # Every input row seen by this run, for the next incremental run
+    np.save(FINGERPRINTS_FILE, np.array(fingerprints, dtype=np.uint64))
+    if known is not None:
+        with open(PENDING_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'first_doc': first_doc, 'n_docs': len(tokens_writer) - first_doc}, f)
+
+    print(f"\nΟλοκληρώθηκε! Αποθηκεύτηκαν στο {TOKENS_DIR}, στο {clean_full_speeches_file_path} και στο {speech_store_dir}")
 
 #OPTIONAL: Create another random sample of the original file
 #create_random_sample(INPUT_FILE, SAMPLE_FILE, 10000)
 
-create_directory_structure()
-create_clean_csv(INPUT_FILE, CLEAN_FILE, FULL_SPEECHES_FILE, STOPWORDS_FILE)
\ No newline at end of file
+if __name__ == "__main__":
+    create_directory_structure()
+    create_clean_corpus(INPUT_FILE, FULL_SPEECHES_FILE, STOPWORDS_FILE, incremental='--incremental' in sys.argv)
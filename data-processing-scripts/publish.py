@@ -0,0 +1,14 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'parliament-search', 'src'))
+from generations import publish_generation
+
+#STEP 8 of processing
+#Publish the artifacts served by the API as a new generation. The running API loads it in the
+#background and swaps it in, no restart needed (see parliament-search/src/generations.py)
+
+public_dir = 'parliament-search/public'
+
+generation_id = publish_generation(public_dir, keep=2)
+print(f"Published generation {generation_id}")
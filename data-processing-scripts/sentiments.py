@@ -1,6 +1,24 @@
 import pandas as pd
+import numpy as np
 import re
-from datetime import datetime
+import os
+import sys
+from itertools import repeat
+from multiprocessing import Pool, cpu_count
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'parliament-search', 'src'))
+from speech_store import SpeechStore, STORE_DIR_NAME, year_of
+from corpus import CORPUS_STATE_DIR, SENTIMENTS_FILE
+
+#STEP 7 of processing
+#Average sentiment of the speeches per year
+#The speeches are scored in chunks by a pool of processes: every word is mapped to a lexicon code once,
+#then the negations and the sums per speech are array operations over the words of the whole chunk
+
+SPEECH_STORE_DIR = f'parliament-search/public/{STORE_DIR_NAME}'
+SENTIMENT_FILE = 'parliament-search/public/sentiment_results.json'
+# Speeches scored per task of the process pool
+CHUNK_DOCS = 10000
 
 # --- 1. ΛΕΞΙΚΟ ΣΥΝΑΙΣΘΗΜΑΤΟΣ ---
 POSITIVE_WORDS = {
@@ -51,31 +69,117 @@ def calculate_sentiment(text):
     
     return score / total_significant_words
 
-# --- 2. ΦΟΡΤΩΣΗ ---
-print("Φόρτωση δεδομένων...")
-# Προσοχή στο path του αρχείου σου
-df = pd.read_csv('parliament-search/public/clean_full_speeches.csv', 
-                 usecols=['sitting_date', 'speech']) 
+WORD_PATTERN = re.compile(r'\w+')
+
+# Lexicon code of a word (0 for any other word) and the value of every code
+POSITIVE, NEGATIVE, NEGATION = 1, 2, 3
+WORD_CODES = {**{word: POSITIVE for word in POSITIVE_WORDS}, **{word: NEGATIVE for word in NEGATIVE_WORDS},
+              **{word: NEGATION for word in NEGATIONS}}
+CODE_VALUES = np.array([0, 1, -1, 0], dtype=np.int8)
+
+def calculate_sentiments(texts):
+    """Same score as calculate_sentiment for every text, without a Python loop over the words."""
+    tokens = []
+    lengths = np.zeros(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        if isinstance(text, str):
+            words = WORD_PATTERN.findall(text.lower())
+            tokens.extend(words)
+            lengths[i] = len(words)
+
+    codes = np.fromiter(map(WORD_CODES.get, tokens, repeat(0)), dtype=np.int8, count=len(tokens))
+    values = CODE_VALUES[codes]
+    negation = codes == NEGATION
+
+    # Position of every word in its own speech: the look-back never crosses into the previous speech
+    starts = np.cumsum(lengths) - lengths
+    position = np.arange(len(codes)) - np.repeat(starts, lengths)
+    negated = np.zeros(len(codes), dtype=bool)
+    negated[1:] |= negation[:-1] & (position[1:] >= 1)
+    negated[2:] |= negation[:-2] & (position[2:] >= 2)
+
+    significant = values != 0
+    doc_of_word = np.repeat(np.arange(len(texts)), lengths)[significant]
+    signed = np.where(negated, -values, values)[significant].astype(np.float64)
+    score = np.bincount(doc_of_word, weights=signed, minlength=len(texts))
+    total_significant_words = np.bincount(doc_of_word, minlength=len(texts))
+
+    sentiments = np.zeros(len(texts))
+    np.divide(score, total_significant_words, out=sentiments, where=total_significant_words > 0)
+    return sentiments
+
+def init_worker(store_dir):
+    # Every worker maps the speech store itself, only speech ids and scores are pickled
+    global worker_store
+    worker_store = SpeechStore(store_dir)
+
+def score_chunk(doc_ids):
+    return calculate_sentiments([worker_store.text(i) for i in doc_ids])
+
+def speech_years(store):
+    """Year of every speech, 0 when unknown. A store without year.npy gets them from its sitting_date column, if any."""
+    if store.year is not None:
+        return np.asarray(store.year)
+    if 'sitting_date' not in store.columns:
+        return np.zeros(len(store), dtype=np.int16)
+    year_by_code = np.array([year_of(d) for d in store.dictionaries['sitting_date']], dtype=np.int16)
+    return year_by_code[np.asarray(store.codes['sitting_date'])]
+
+def sentiment_by_year(store_dir=SPEECH_STORE_DIR, output_file=SENTIMENT_FILE, reuse_saved=False):
+    """
+    With reuse_saved (incremental mode) the per-speech sentiments of the previous run are kept and
+    only the speeches added since then are scored.
+    """
+    # --- 2. ΦΟΡΤΩΣΗ ---
+    # Full speeches and years from the speech store of preprocess.py, no csv to parse.
+    # Year 0 marks a sitting_date that could not be parsed, these speeches are left out as before
+    print("Φόρτωση δεδομένων...")
+    store = SpeechStore(store_dir)
+    years = speech_years(store)
+    valid = years > 0
+
+    sentiments = np.full(len(store), np.nan)
+    start = 0
+    if reuse_saved and os.path.exists(SENTIMENTS_FILE):
+        saved = np.load(SENTIMENTS_FILE)
+        if len(saved) <= len(store):
+            sentiments[:len(saved)] = saved
+            start = len(saved)
+
+    # --- 3. ΥΠΟΛΟΓΙΣΜΟΣ ---
+    doc_ids = np.flatnonzero(valid[start:]) + start
+    chunks = [doc_ids[i:i + CHUNK_DOCS] for i in range(0, len(doc_ids), CHUNK_DOCS)]
+    n_workers = min(cpu_count(), len(chunks))
+    print(f"Υπολογισμός συναισθήματος για {len(doc_ids)} ομιλίες ({len(chunks)} τμήματα, {n_workers} workers)...")
+    if chunks:
+        with Pool(processes=n_workers, initializer=init_worker, initargs=(store_dir,)) as pool:
+            # imap returns the scores in the order of the chunks
+            for chunk, scores in zip(chunks, pool.imap(score_chunk, chunks)):
+                sentiments[chunk] = scores
+
+    os.makedirs(CORPUS_STATE_DIR, exist_ok=True)
+    np.save(SENTIMENTS_FILE, sentiments)
 
-df['sitting_date'] = pd.to_datetime(df['sitting_date'], format='%d/%m/%Y', errors='coerce')
-df = df.dropna(subset=['sitting_date', 'speech'])
+    doc_ids = np.flatnonzero(valid)
+    df = pd.DataFrame({
+        'year': years[doc_ids].astype(int),
+        'sentiment': sentiments[doc_ids],
+    })
 
-# --- 3. ΥΠΟΛΟΓΙΣΜΟΣ ---
-print("Υπολογισμός συναισθήματος ανά ομιλία...")
-df['sentiment'] = df['speech'].apply(calculate_sentiment)
+    # --- 4. ΟΜΑΔΟΠΟΙΗΣΗ (ΜΟΝΟ ΣΥΝΟΛΙΚΑ) ---
+    print("Ομαδοποίηση ανά έτος...")
+    # Υπολογίζουμε τον μέσο όρο του 'sentiment' για κάθε έτος
+    final_result = df.groupby('year')['sentiment'].mean().reset_index()
 
-# --- 4. ΟΜΑΔΟΠΟΙΗΣΗ (ΜΟΝΟ ΣΥΝΟΛΙΚΑ) ---
-print("Ομαδοποίηση ανά έτος...")
-df['year'] = df['sitting_date'].dt.year
+    # Προαιρετικό: Στρογγυλοποίηση για μικρότερο αρχείο
+    final_result['sentiment'] = final_result['sentiment'].round(4)
 
-# Υπολογίζουμε τον μέσο όρο του 'sentiment' για κάθε έτος
-final_result = df.groupby('year')['sentiment'].mean().reset_index()
+    # --- 5. EXPORT ---
+    final_result.to_json(output_file, orient='records')
+    print(f"Έτοιμο! Αποθηκεύτηκε στο {output_file}")
+    # Θα παράγει κάτι σαν: [{"year":1989, "sentiment":0.05}, {"year":1990, "sentiment":-0.02}, ...]
+    return final_result
 
-# Προαιρετικό: Στρογγυλοποίηση για μικρότερο αρχείο
-final_result['sentiment'] = final_result['sentiment'].round(4)
 
-# --- 5. EXPORT ---
-output_file = 'parliament-search/public/sentiment_results.json'
-final_result.to_json(output_file, orient='records')
-print(f"Έτοιμο! Αποθηκεύτηκε στο {output_file}")
-# Θα παράγει κάτι σαν: [{"year":1989, "sentiment":0.05}, {"year":1990, "sentiment":-0.02}, ...]
\ No newline at end of file
+if __name__ == "__main__":
+    sentiment_by_year()
@@ -1,62 +1,148 @@
+import os
+import heapq
 import pandas as pd
 import joblib
-from sklearn.metrics.pairwise import cosine_similarity
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.preprocessing import normalize
+from scipy.sparse import csr_matrix
 import numpy as np
+import sys
+
+from corpus import load_corpus
 
 #STEP 4 of processing
-#Find the pairs of parliament members with the largest similarity
+#Find the pairs of parliament members with the largest similarity, and the near-duplicate speeches
+#The pairs come from a blocked sparse product: blocks of rows of the normalized matrix times blocks of its
+#transpose, above the diagonal only, so the full rows x rows similarity matrix never exists, not even for the speeches
 
-def find_top_k_similar_members(clean_csv_path, k=10):
-    print(f"--- Εύρεση Top-{k} Ζευγών Ομοιότητας Μελών ---")
-    try:
-        tfidf_matrix = joblib.load('parliament-search/public/search_models/tfidf_matrix_member_name.joblib')
-        print("Ο πίνακας TF-IDF φορτώθηκε επιτυχώς.")
-    except FileNotFoundError:
-        print("Σφάλμα: Δεν βρέθηκε το μοντέλο. Τρέξε πρώτα το analyze_group_keywords για 'member_name'.")
-        return
+SIMILARITY_FILE = 'parliament-search/public/similarity/top_similar_members.csv'
+NEAR_DUPLICATES_FILE = 'parliament-search/public/similarity/near_duplicate_speeches.csv'
 
-    print("Ανάκτηση ονομάτων μελών...")
-    df = pd.read_csv(clean_csv_path)
-    df = df.dropna(subset=['speech'])
-    df['speech'] = df['speech'].astype(str)
-    
-    grouped_df = df.groupby('member_name')['speech'].apply(lambda x: ' '.join(x)).reset_index()
-    member_names = grouped_df['member_name'].tolist()
+# Rows x columns of one block product: memory is about BLOCK_ROWS x BLOCK_COLS similarities per thread
+BLOCK_ROWS = 1024
+BLOCK_COLS = 16384
+NEAR_DUPLICATE_SIMILARITY = 0.9
+MAX_NEAR_DUPLICATES = 100000
+
+def _keep_best(scores, rows, cols, n_pairs):
+    if len(scores) > n_pairs:
+        # Everything tied with the n_pairs-th score is kept, the heap decides between equal scores
+        cutoff = -np.partition(-scores, n_pairs - 1)[n_pairs - 1]
+        keep = scores >= cutoff
+        scores, rows, cols = scores[keep], rows[keep], cols[keep]
+    return scores, rows, cols
+
+def _block_pairs(normalized, start, end, n_pairs, min_similarity, block_cols=BLOCK_COLS):
+    """
+    Pairs (i < j) of rows start..end with similarity above min_similarity, at most about n_pairs of them.
+    Only the columns from start on are multiplied (the pairs below the diagonal are found by earlier
+    blocks), block_cols columns at a time, and every block product is filtered before the next one.
+    """
+    rows_block = normalized[start:end]
+    scores = np.empty(0, dtype=np.float64)
+    rows = cols = np.empty(0, dtype=np.int64)
+
+    for col_start in range(start, normalized.shape[0], block_cols):
+        block = (rows_block @ normalized[col_start:col_start + block_cols].T).tocoo()
+        pair_rows = block.row.astype(np.int64) + start
+        pair_cols = block.col.astype(np.int64) + col_start
+        keep = (pair_cols > pair_rows) & (block.data > min_similarity)
+        scores, rows, cols = _keep_best(np.concatenate((scores, block.data[keep])),
+                                        np.concatenate((rows, pair_rows[keep])),
+                                        np.concatenate((cols, pair_cols[keep])), n_pairs)
+    return scores, rows, cols
+
+def top_similar_pairs(matrix, n_pairs, min_similarity=0.0, block_rows=BLOCK_ROWS, n_jobs=None):
+    """
+    The n_pairs most similar pairs of rows (i < j) by cosine similarity, above min_similarity, as a list
+    of (similarity, i, j) by descending similarity, equal ones by (i, j). Same scores as cosine_similarity.
+    Blocks run in threads (the sparse product releases the GIL) and are merged in a heap of n_pairs.
+    """
+    # cosine_similarity normalizes the rows again as well, even if TF-IDF rows already have unit length
+    normalized = normalize(csr_matrix(matrix))
+    n_rows = normalized.shape[0]
+    n_jobs = n_jobs or os.cpu_count() or 1
+    starts = list(range(0, n_rows, block_rows))
+
+    # Min-heap of the best pairs so far: a larger (similarity, -i, -j) is a better pair
+    heap = []
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        # n_jobs blocks at a time, so no more than n_jobs block products are in memory
+        for wave in range(0, len(starts), n_jobs):
+            blocks = [(start, min(start + block_rows, n_rows)) for start in starts[wave:wave + n_jobs]]
+            for scores, rows, cols in executor.map(
+                    lambda bounds: _block_pairs(normalized, *bounds, n_pairs, min_similarity), blocks):
+                for item in zip(scores.tolist(), (-rows).tolist(), (-cols).tolist()):
+                    if len(heap) < n_pairs:
+                        heapq.heappush(heap, item)
+                    elif item > heap[0]:
+                        heapq.heapreplace(heap, item)
+
+    return [(score, -i, -j) for score, i, j in sorted(heap, reverse=True)]
+
+def member_names_of(corpus):
+    # Same order as the rows of the member_name model (groupby sorts the names, speeches without a name are left out)
+    return sorted(corpus.df['member_name'].dropna().unique().tolist())
+
+def find_top_k_similar_members(tfidf_matrix, member_names, k=10):
+    print(f"--- Εύρεση Top-{k} Ζευγών Ομοιότητας Μελών ---")
     
     if len(member_names) != tfidf_matrix.shape[0]:
         print(f"Προσοχή! Ασυμφωνία μεγέθους: {len(member_names)} ονόματα vs {tfidf_matrix.shape[0]} γραμμές πίνακα.")
         return
 
-    # Cosine Similarity
-    print("Υπολογισμός πίνακα ομοιότητας...")
-    sim_matrix = cosine_similarity(tfidf_matrix)
+    print(f"Υπολογισμός ζευγών ομοιότητας για {len(member_names)} μέλη...")
+    #Only keep pairs with a similarity > 0.1. Σώζουμε τα top 100
+    pairs = [(score, member_names[i], member_names[j])
+             for score, i, j in top_similar_pairs(tfidf_matrix, n_pairs=100, min_similarity=0.1)]
 
-    # Top-K Pairs
-    pairs = []
-    num_members = len(member_names)
-    
-    print(f"Σάρωση {num_members} μελών για ζεύγη...")
-    
-    rows, cols = np.triu_indices(num_members, k=1)
-    
-    for i, j in zip(rows, cols):
-        score = sim_matrix[i, j]
-        #Only keep pairs with a similarity > 0.1
-        if score > 0.1: 
-            pairs.append((score, member_names[i], member_names[j]))
-
-    pairs.sort(key=lambda x: x[0], reverse=True)
-    
     print(f"\nTop {k} Ζεύγη με τη Μεγαλύτερη Ομοιότητα")
     for i in range(min(k, len(pairs))):
         score, name1, name2 = pairs[i]
         print(f"{i+1}. {name1} <--> {name2} : {score:.4f}")
 
     # Save to CSV
-    df_pairs = pd.DataFrame(pairs[:100], columns=['Similarity', 'Member A', 'Member B']) # Σώζουμε τα top 100
-    df_pairs.to_csv('parliament-search/public/similarity/top_similar_members.csv', index=False, encoding='utf-8-sig')
+    df_pairs = pd.DataFrame(pairs, columns=['Similarity', 'Member A', 'Member B'])
+    df_pairs.to_csv(SIMILARITY_FILE, index=False, encoding='utf-8-sig')
     print("\nΤα top-100 ζεύγη αποθηκεύτηκαν στο 'top_similar_members.csv'")
 
 
-input_file = "parliament-search/public/clean.csv"  
-find_top_k_similar_members(input_file, k=10) #k=10 is the number pairs printed in the terminal
\ No newline at end of file
+def find_near_duplicate_speeches(speech_matrix, df, min_similarity=NEAR_DUPLICATE_SIMILARITY):
+    """Pairs of speeches with (almost) the same terms. df: metadata of the rows of speech_matrix, in store order."""
+    print(f"--- Εύρεση σχεδόν ίδιων ομιλιών (ομοιότητα > {min_similarity}) ---")
+
+    if len(df) != speech_matrix.shape[0]:
+        print(f"Προσοχή! Ασυμφωνία μεγέθους: {len(df)} ομιλίες vs {speech_matrix.shape[0]} γραμμές πίνακα.")
+        return
+
+    pairs = top_similar_pairs(speech_matrix, n_pairs=MAX_NEAR_DUPLICATES, min_similarity=min_similarity)
+    ids_a = np.array([i for _, i, _ in pairs], dtype=np.int64)
+    ids_b = np.array([j for _, _, j in pairs], dtype=np.int64)
+
+    # Speech ids are the ids of the speech store, the ones the API serves
+    df_pairs = pd.DataFrame({
+        'Similarity': [score for score, _, _ in pairs],
+        'Speech A': ids_a,
+        'Speech B': ids_b,
+        'Member A': df['member_name'].to_numpy()[ids_a],
+        'Member B': df['member_name'].to_numpy()[ids_b],
+        'Date A': df['sitting_date'].to_numpy()[ids_a],
+        'Date B': df['sitting_date'].to_numpy()[ids_b],
+    })
+    df_pairs.to_csv(NEAR_DUPLICATES_FILE, index=False, encoding='utf-8-sig')
+    print(f"{len(df_pairs)} ζεύγη σχεδόν ίδιων ομιλιών αποθηκεύτηκαν στο '{NEAR_DUPLICATES_FILE}'")
+
+
+if __name__ == "__main__":
+    try:
+        tfidf_matrix = joblib.load('parliament-search/public/search_models/tfidf_matrix_member_name.joblib')
+        print("Ο πίνακας TF-IDF φορτώθηκε επιτυχώς.")
+    except FileNotFoundError:
+        print("Σφάλμα: Δεν βρέθηκε το μοντέλο. Τρέξε πρώτα το analyze_group_keywords για 'member_name'.")
+        sys.exit(1)
+
+    corpus = load_corpus()
+    if corpus is not None:
+        find_top_k_similar_members(tfidf_matrix, member_names_of(corpus), k=10) #k=10 is the number pairs printed in the terminal
+        speech_matrix = joblib.load('parliament-search/public/search_models/tfidf_matrix_speech.joblib')
+        find_near_duplicate_speeches(speech_matrix, corpus.df)
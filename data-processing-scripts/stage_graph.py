@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+#Content-addressed stage cache for the pipeline.
+#Every stage declares its code, inputs, parameters and outputs. Its key is a hash of all of them;
+#a stage whose key matches the last successful run and whose outputs are unchanged is skipped.
+#Stages that do not depend on each other (through their inputs and outputs) run in parallel
+
+CACHE_DIR = "parliament-search/public/corpus"
+CACHE_FILE = os.path.join(CACHE_DIR, 'stage_cache.json')
+FILE_HASHES_FILE = os.path.join(CACHE_DIR, 'file_hashes.json')
+
+
+def _within(path, root):
+    path, root = os.path.normpath(path), os.path.normpath(root)
+    return path == root or path.startswith(root + os.sep)
+
+
+class FileHasher:
+    """Content hashes of files and directories. A file is hashed again only when its size or mtime changed."""
+
+    def __init__(self, cache_file=FILE_HASHES_FILE):
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                self._known = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._known = {}
+
+    def _file_hash(self, path):
+        stat = os.stat(path)
+        with self._lock:
+            known = self._known.get(path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        with self._lock:
+            self._known[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def hash(self, path):
+        """Hash of a file, of every file under a directory, or None when the path does not exist."""
+        if os.path.isfile(path):
+            return self._file_hash(path)
+        if not os.path.isdir(path):
+            return None
+
+        digest = hashlib.blake2b(digest_size=16)
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(f"{os.path.relpath(file_path, path)}:{self._file_hash(file_path)};".encode('utf-8'))
+        return digest.hexdigest()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with self._lock:
+            with open(self.cache_file, 'w', encoding='utf-8') as f:
+                json.dump(self._known, f)
+
+
+class Stage:
+
+    def __init__(self, name, code, inputs, outputs, params=None, script=None, args=(), run=None):
+        """
+        A stage runs either a script in its own process (script, args) or a function in this process
+        (run, called with no arguments). code: source files whose changes invalidate the stage.
+        """
+        self.name = name
+        self.code = list(code)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.script = script
+        self.args = list(args)
+        self.run = run
+
+    def key(self, hasher):
+        content = {
+            'code': {path: hasher.hash(path) for path in self.code},
+            'inputs': {path: hasher.hash(path) for path in self.inputs},
+            'params': self.params,
+            # The same script in another mode (e.g. preprocess.py --incremental) is another stage
+            'args': self.args,
+        }
+        return hashlib.blake2b(json.dumps(content, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+    def execute(self):
+        if self.script:
+            subprocess.run([sys.executable, self.script, *self.args], check=True)
+        else:
+            self.run()
+
+
+class StageGraph:
+
+    def __init__(self, stages, max_parallel=2):
+        self.stages = {stage.name: stage for stage in stages}
+        self.max_parallel = max_parallel
+        self.hasher = FileHasher()
+        try:
+            with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+                self.cache = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.cache = {}
+        self.report = []
+
+    def dependencies(self, stage, selected):
+        """Stages among selected that write one of the inputs of stage (or a directory holding it)."""
+        return {
+            other.name for other in (self.stages[name] for name in selected)
+            if other is not stage and any(_within(path, output) for path in stage.inputs for output in other.outputs)
+        }
+
+    def is_cached(self, stage, key):
+        entry = self.cache.get(stage.name)
+        if not entry or entry['key'] != key:
+            return False
+        # Outputs removed or modified since the stage wrote them invalidate it as well
+        return all(self.hasher.hash(path) == digest for path, digest in entry['outputs'].items())
+
+    def _run_stage(self, stage):
+        key = stage.key(self.hasher)
+        if self.is_cached(stage, key):
+            print(f"[stage] {stage.name}: cached", flush=True)
+            return 'cached', 0.0
+
+        print(f"[stage] {stage.name}: running", flush=True)
+        started = time.perf_counter()
+        stage.execute()
+        elapsed = time.perf_counter() - started
+
+        self.cache[stage.name] = {'key': key, 'outputs': {path: self.hasher.hash(path) for path in stage.outputs}}
+        return 'ran', elapsed
+
+    def run(self, names=None):
+        """Runs the selected stages (all by default), each one after the stages it depends on."""
+        selected = list(names or self.stages)
+        pending = {name: self.dependencies(self.stages[name], selected) for name in selected}
+        done = set()
+        failed = None
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            running = {}
+            while (pending or running) and failed is None:
+                for name in [n for n, deps in pending.items() if deps <= done]:
+                    running[executor.submit(self._run_stage, self.stages[name])] = name
+                    del pending[name]
+
+                if not running:
+                    raise RuntimeError(f"Circular dependencies between stages: {sorted(pending)}")
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        status, elapsed = future.result()
+                    except Exception as e:
+                        failed = (name, e)
+                        continue
+                    self.report.append((name, status, elapsed))
+                    done.add(name)
+
+            # Let the stages already started finish before saving what they did
+            for future in running:
+                try:
+                    self.report.append((running[future], *future.result()))
+                except Exception:
+                    pass
+
+        self.save()
+        if failed:
+            raise RuntimeError(f"Stage {failed[0]} failed: {failed[1]}")
+
+    def save(self):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(self.cache, f, indent=2)
+        self.hasher.save()
+
+    def print_report(self):
+        print("\n[stage] Χρόνοι ανά στάδιο:")
+        for name, status, elapsed in self.report:
+            print(f"[stage]   {name:<16} {status:<7} {elapsed:8.1f}s")
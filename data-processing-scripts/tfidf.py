@@ -1,15 +1,23 @@
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
+import numpy as np
 import joblib
 import os
 import sys
 import csv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'parliament-search', 'src'))
+from inverted_index import build_inverted_index, INDEX_DIR_NAME
+from term_trends import build_term_year_trends, TRENDS_DIR_NAME
+from speech_store import STORE_DIR_NAME
+from corpus import load_corpus
+
 #STEP 3 of processing
 #Create tfidf matrices for each speech, parliament party, parliament member and year
+#Run through pipeline.py, which loads the token ids of the speeches once for every step (see corpus.py)
 
-clean_file = "parliament-search/public/clean.csv"
 stopwords_file = 'parliament-search/public/dictionary/stopwords_stemmed.txt'
+# One model per speech and per group of speeches, saved as tfidf_vectorizer_<group>/tfidf_matrix_<group>
+TFIDF_GROUPS = ['speech', 'political_party', 'year', 'member_name']
 csv.field_size_limit(sys.maxsize)
 
 def save_model_files(vectorizer, matrix, name_suffix):
@@ -22,48 +30,33 @@ def save_model_files(vectorizer, matrix, name_suffix):
     joblib.dump(matrix, f'{model_dir}/tfidf_matrix_{name_suffix}.joblib')
     print(f"Models saved in '{model_dir}' with suffix: _{name_suffix}")
 
-def analyze_group_keywords(csv_path, group_col, entity_name=None, top_n=20):
+def analyze_group_keywords(corpus, group_col, entity_name=None, top_n=20):
  
     print(f"\n--- Analysis: Keywords by {group_col} ---")
     
-    try:
-        df = pd.read_csv(csv_path)
-    except FileNotFoundError:
-        print(f"Error: File {csv_path} not found.")
-        return
-
-    # Basic Cleaning
-    if 'speech' not in df.columns:
-        print("Error: Column 'speech' not found.")
-        return
-
-    df = df.dropna(subset=['speech'])
-    df['speech'] = df['speech'].astype(str)
-
-    # Date Processing for grouping by year
-    if 'sitting_date' in df.columns:
-        df['sitting_date'] = pd.to_datetime(df['sitting_date'], dayfirst=True, errors='coerce')
-        # Only drop if date is missing AND we are grouping by year
-        if group_col == 'year':
-            df = df.dropna(subset=['sitting_date'])
-            df['year'] = df['sitting_date'].dt.year.astype(int)
+    df = corpus.df
 
     # Grouping
     print(f"Grouping texts by {group_col}...")
+    print("Calculating TF-IDF...")
     
     if group_col != 'speech':
-        # Group by column and join speeches
-        grouped_df = df.groupby(group_col)['speech'].apply(lambda x: ' '.join(x)).reset_index()
+        if group_col == 'year':
+            # Date Processing for grouping by year. Speeches without a valid date are left out
+            sitting_date = pd.to_datetime(df['sitting_date'], dayfirst=True, errors='coerce')
+            keys = sitting_date.dt.year.astype('Int64')
+        else:
+            keys = df[group_col]
+
+        # Summed term counts of the speeches of every group, no concatenated texts (see corpus.py)
+        tfidf, tfidf_matrix, group_keys = corpus.group_tfidf(keys)
+        grouped_df = pd.DataFrame({group_col: np.asarray(group_keys)})
         print(f"Created {len(grouped_df)} unique groups.")
     else:
-        # If grouping by speech, use the dataframe as is
-        grouped_df = df.reset_index(drop=True)
+        # If grouping by speech, use the dataframe as is. The model comes from the shared term counts
+        grouped_df = df
+        tfidf, tfidf_matrix = corpus.speech_tfidf()
 
-    # TF-IDF Calculation
-    print("Calculating TF-IDF...")
-
-    tfidf = TfidfVectorizer() 
-    tfidf_matrix = tfidf.fit_transform(grouped_df['speech'])
     feature_names = tfidf.get_feature_names_out()
 
     # Save the Model (Vectorizer + Matrix)
@@ -72,60 +65,97 @@ def analyze_group_keywords(csv_path, group_col, entity_name=None, top_n=20):
     # Extract Keywords & Save Results to CSV
     print("Extracting keywords and saving report...")
     
-    results_data = [] 
-    
     # Ensure output directory exists
     csv_dir = 'parliament-search/public/search_models_csv'
     if not os.path.exists(csv_dir):
         os.makedirs(csv_dir)
 
-    counter = 0
-    
-    for i in range(tfidf_matrix.shape[0]):
-        
-        if group_col == 'speech':
-            entity = i 
-        else:
-            entity = grouped_df.iloc[i][group_col]
-
-        row = tfidf_matrix[i]
-        
-        indices = row.indices
-        data = row.data
-        
-        sorted_items = sorted(zip(indices, data), key=lambda x: x[1], reverse=True)[:top_n]
-        
-        top_words = [feature_names[idx] for idx, score in sorted_items]
-        top_words_str = ", ".join(top_words)
-
-        results_data.append({
-            group_col: entity,
-            'top_keywords': top_words_str
-        })
-
-        # Print logic for terminal feedback
-        if entity_name and str(entity) == str(entity_name):
-            print(f"\n>> Top keywords for {entity}:")
-            print(top_words_str)
-        elif not entity_name and counter < 5: 
-            print(f"\n>> Top keywords for {group_col} {entity}:")
-            print(top_words_str)
-            counter += 1
-        
-        if i % 1000 == 0 and i > 0:
-            print(f"Processed {i} items...", end='\r')
-
-    # Create DataFrame and Save
-    results_df = pd.DataFrame(results_data)
-    
+    if group_col == 'speech':
+        entities = np.arange(tfidf_matrix.shape[0])
+    else:
+        entities = grouped_df[group_col].to_numpy()
+
     output_filename = f"{csv_dir}/results_keywords_by_{group_col}.csv"
-    results_df.to_csv(output_filename, index=False, encoding='utf-8-sig')
+    counter = 0
+
+    # The report is written chunk by chunk, the BOM of utf-8-sig only once at the start of the file
+    with open(output_filename, 'w', encoding='utf-8-sig', newline='') as f:
+        for start, keywords in top_keywords_by_row(tfidf_matrix, feature_names, top_n):
+            chunk = pd.DataFrame({group_col: entities[start:start + len(keywords)], 'top_keywords': keywords})
+            chunk.to_csv(f, index=False, header=(start == 0))
+
+            # Print logic for terminal feedback
+            for entity, top_words_str in zip(chunk[group_col], keywords):
+                if entity_name and str(entity) == str(entity_name):
+                    print(f"\n>> Top keywords for {entity}:")
+                    print(top_words_str)
+                elif not entity_name and counter < 5: 
+                    print(f"\n>> Top keywords for {group_col} {entity}:")
+                    print(top_words_str)
+                    counter += 1
+
+            print(f"Processed {start + len(keywords)} items...", end='\r')
     
     print(f"\nSuccess! Results saved to '{output_filename}'")
-    return tfidf_matrix
+    return tfidf, tfidf_matrix, grouped_df
+
+def top_keywords_by_row(matrix, feature_names, top_n, rows_per_chunk=20000):
+    """
+    Yields (first row, list of "w1, w2, ..." strings) for consecutive chunks of rows of a CSR matrix:
+    the top_n terms of every row by score. Works on indptr/indices/data directly, one sort per chunk.
+    Equal scores keep the order their row is stored in: the order of CountVectorizer for the speech rows
+    (see TokenCorpus.term_counts), term order for the group rows (see Corpus.group_tfidf).
+    """
+    indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+
+    for start in range(0, matrix.shape[0], rows_per_chunk):
+        end = min(start + rows_per_chunk, matrix.shape[0])
+        lo, hi = indptr[start], indptr[end]
+        row_lengths = np.diff(indptr[start:end + 1])
+        rows = np.repeat(np.arange(end - start), row_lengths)
+
+        # By row, then by descending score, then by position in the row
+        order = np.lexsort((np.arange(hi - lo), -data[lo:hi], rows))
+
+        # Keep the first top_n entries of every row segment
+        kept = np.minimum(row_lengths, top_n)
+        row_starts = indptr[start:end] - lo
+        rank_in_row = np.arange(kept.sum()) - np.repeat(np.cumsum(kept) - kept, kept)
+        selected = order[np.repeat(row_starts, kept) + rank_in_row]
+
+        words = feature_names[indices[lo:hi][selected]]
+        bounds = np.concatenate(([0], np.cumsum(kept)))
+        yield start, [", ".join(words[bounds[i]:bounds[i + 1]]) for i in range(end - start)]
+
+def build_speech_trends(corpus, speech_matrix, output_dir):
+    # Years come from the speech store, so they match the speech ids the API serves
+    years = np.load(f'parliament-search/public/{STORE_DIR_NAME}/year.npy')
+    if len(years) != speech_matrix.shape[0]:
+        print(f"Warning: {len(years)} years vs {speech_matrix.shape[0]} speeches, skipping trends.")
+        return
+
+    # Same vocabulary as the speech model, the counts were already computed for it
+    _, counts = corpus.term_counts()
+    build_term_year_trends(speech_matrix, counts, years, output_dir)
+
+def run_tfidf(corpus):
+    """Speech model with its index and trends, then the party, year and member models. Returns the results by group."""
+    results = {}
+
+    speech_results = analyze_group_keywords(corpus, 'speech')
+    results['speech'] = speech_results
+    speech_vectorizer, speech_matrix, speech_df = speech_results
+    # Posting lists for /search and yearly sums for /trend, built from the same speech matrix
+    build_inverted_index(speech_matrix, f'parliament-search/public/search_models/{INDEX_DIR_NAME}')
+    build_speech_trends(corpus, speech_matrix, f'parliament-search/public/search_models/{TRENDS_DIR_NAME}')
+
+    for group_col in TFIDF_GROUPS[1:]:
+        results[group_col] = analyze_group_keywords(corpus, group_col)
+
+    return results
+
 
-# Run analyses
-analyze_group_keywords(clean_file, 'speech')
-analyze_group_keywords(clean_file, 'political_party')
-analyze_group_keywords(clean_file, 'year')
-analyze_group_keywords(clean_file, 'member_name')
\ No newline at end of file
+if __name__ == "__main__":
+    corpus = load_corpus()
+    if corpus is not None:
+        run_tfidf(corpus)
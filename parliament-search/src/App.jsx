@@ -16,11 +16,14 @@ const SearchTab = () => {
   // STATE για Modal
   const [selectedSpeech, setSelectedSpeech] = useState(null);
 
-  // STATE για Pagination (πόσα αποτελέσματα ζητάμε)
-  const [currentTopK, setCurrentTopK] = useState(20);
+  // STATE για Pagination: το cursor της επόμενης σελίδας που επιστρέφει το API
+  const [nextCursor, setNextCursor] = useState(null);
+
+  const PAGE_SIZE = 20;
 
   // Κοινή συνάρτηση που καλεί το API
-  const fetchResults = async (query, kValue) => {
+  // Χωρίς cursor γίνεται νέα αναζήτηση, με cursor ζητάμε μόνο την επόμενη σελίδα
+  const fetchResults = async (query, cursor = null) => {
     setLoading(true);
     setError(null);
     
@@ -32,7 +35,9 @@ const SearchTab = () => {
         },
         body: JSON.stringify({ 
           query: query, 
-          top_k: kValue // Στέλνουμε δυναμικά το πόσα θέλουμε
+          top_k: PAGE_SIZE,
+          cursor: cursor,
+          slim: true // Χωρίς full_speech, το κείμενο φορτώνεται όταν ανοίξει το modal
         }),
       });
 
@@ -41,7 +46,9 @@ const SearchTab = () => {
       }
 
       const data = await response.json();
-      setResults(data.results);
+      // Οι επόμενες σελίδες προστίθενται στα ήδη φορτωμένα αποτελέσματα
+      setResults(prev => cursor ? [...prev, ...data.results] : data.results);
+      setNextCursor(data.next_cursor);
       setHasSearched(true);
 
     } catch (err) {
@@ -57,21 +64,34 @@ const SearchTab = () => {
     e.preventDefault();
     if (!searchTerm.trim()) return;
 
-    // Reset στα 20 αποτελέσματα και καθαρισμός παλιών
-    setCurrentTopK(20);
+    // Καθαρισμός παλιών αποτελεσμάτων
+    setNextCursor(null);
     setResults([]); 
     
     // Κλήση API
-    fetchResults(searchTerm, 20);
+    fetchResults(searchTerm);
   };
 
   // Όταν πατάμε "Φόρτωση περισσότερων"
   const handleLoadMore = () => {
-    const nextK = currentTopK + 20; // Αυξάνουμε κατά 20
-    setCurrentTopK(nextK);
-    // Ξανακαλούμε το API με το νέο όριο (π.χ. 40)
-    // Σημείωση: Στέλνουμε το ίδιο searchTerm
-    fetchResults(searchTerm, nextK);
+    // Ζητάμε μόνο τα επόμενα 20 με το cursor της προηγούμενης απάντησης
+    fetchResults(searchTerm, nextCursor);
+  };
+
+  // Φόρτωση ολόκληρης της ομιλίας μόνο όταν τη ζητήσει ο χρήστης
+  const openSpeech = async (speechId) => {
+    setSelectedSpeech('Φόρτωση...');
+    try {
+      const response = await fetch(`http://127.0.0.1:8000/speech/${speechId}`);
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      const data = await response.json();
+      setSelectedSpeech(data.speech);
+    } catch (err) {
+      console.error("Σφάλμα φόρτωσης ομιλίας:", err);
+      setSelectedSpeech('Δεν ήταν δυνατή η φόρτωση της ομιλίας.');
+    }
   };
 
   const closeModal = () => setSelectedSpeech(null);
@@ -106,14 +126,14 @@ const SearchTab = () => {
       {/* --- RESULTS GRID --- */}
       <div className="results-grid">
         {results.map((item, index) => (
-          <div key={index} className="card">
+          <div key={item.speech_id ?? index} className="card">
             <h3>{item.member_name} <span className="party-tag">{item.political_party}</span></h3>
             <small>{item.sitting_date} | Relevance Score: {item.score}</small>
             <hr/>
             <p style={{fontStyle: 'italic'}}>"{item.speech_snippet}"</p>
             
             <button 
-                onClick={() => setSelectedSpeech(item.full_speech)}
+                onClick={() => openSpeech(item.speech_id)}
                 style={{marginTop: '10px', fontSize: '0.8rem', cursor: 'pointer', backgroundColor: '#007bff', color: 'white', border: 'none', padding: '5px 10px', borderRadius: '4px'}}
             >
                 Διαβάστε όλη την ομιλία
@@ -124,7 +144,7 @@ const SearchTab = () => {
 
       {/* --- LOAD MORE BUTTON --- */}
       {/* Εμφανίζεται μόνο αν έχουμε αποτελέσματα και δεν φορτώνουμε αυτή τη στιγμή */}
-      {results.length > 0 && results.length >= currentTopK && (
+      {results.length > 0 && nextCursor && (
         <div style={{textAlign: 'center', margin: '30px 0'}}>
           <button 
             onClick={handleLoadMore}
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import numpy as np
+from inverted_index import top_k_indices
+from artifact_dirs import fresh_output_dir
+
+#Approximate nearest-neighbour index (IVF-PQ, NumPy only) over the LSI vectors of the speeches.
+#The normalized vectors are split into inverted lists by a coarse k-means, and the residual of every
+#vector from its list centroid is product-quantized to one byte per subspace. A query scans only the
+#nprobe closest lists through one lookup table per subspace, then re-ranks the best candidates with
+#the exact vectors, the normalized ones shared with the semantic index (see normalized_vectors.py).
+#Built at pipeline time by lsi.py and queried by api.py for /speech/{id}/similar
+
+ANN_DIR_NAME = 'ann_lsi'
+DEFAULT_NPROBE = 8
+# Candidates of the quantized scan re-ranked with the exact vectors, per requested result
+RERANK_FACTOR = 8
+# Bytes per vector: every subspace is one table lookup per scanned vector
+MAX_SUBSPACES = 64
+# Sample sizes for training the coarse quantizer and the codebooks of the subspaces
+MAX_TRAINING_VECTORS = 100000
+MAX_PQ_TRAINING_VECTORS = 20000
+
+
+def _assign(vectors, centroids, chunk_rows=65536):
+    """Nearest centroid (L2) of every vector, a chunk of rows at a time."""
+    half_norms = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_rows):
+        block = vectors[start:start + chunk_rows]
+        scores = block @ centroids.T
+        scores -= half_norms
+        labels[start:start + len(block)] = np.argmax(scores, axis=1)
+    return labels
+
+
+def _kmeans(vectors, k, n_iter, rng):
+    """Lloyd's k-means from k distinct random vectors. An empty cluster keeps its previous centroid."""
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _assign(vectors, centroids)
+        sizes = np.bincount(labels, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=vectors[:, j], minlength=k)
+                         for j in range(vectors.shape[1])], axis=1)
+        filled = sizes > 0
+        centroids[filled] = (sums[filled] / sizes[filled, None]).astype(np.float32)
+    return centroids
+
+
+def build_ann_index(vectors, output_dir, n_lists=None, n_subspaces=None, seed=42):
+    """
+    Builds the index of the (speeches x topics) normalized vectors, row i being speech id i, and saves it
+    as .npy files so the API can memory-map them. Then measures its recall against brute force (see evaluate).
+    The vectors themselves are not saved again.
+    """
+    fresh_output_dir(output_dir)
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n_docs, dim = vectors.shape
+    if n_docs == 0:
+        print("No vectors, the ANN index is not built.")
+        return
+
+    rng = np.random.default_rng(seed)
+    n_lists = min(n_lists or max(1, int(round(np.sqrt(n_docs)))), n_docs)
+    n_subspaces = min(n_subspaces or (dim + 1) // 2, MAX_SUBSPACES, dim)
+    sub_dim = -(-dim // n_subspaces)
+    n_codes = min(256, n_docs)
+    training = vectors[rng.choice(n_docs, min(n_docs, MAX_TRAINING_VECTORS), replace=False)]
+
+    # Coarse quantizer: the inverted lists
+    centroids = _kmeans(training, n_lists, 20, rng)
+    labels = _assign(vectors, centroids)
+
+    # Product quantizer of the residuals, zero-padded to n_subspaces x sub_dim dimensions
+    def residuals(rows, row_labels):
+        padded = np.zeros((len(rows), n_subspaces * sub_dim), dtype=np.float32)
+        padded[:, :dim] = rows - centroids[row_labels]
+        return padded.reshape(len(rows), n_subspaces, sub_dim)
+
+    pq_training = training[:MAX_PQ_TRAINING_VECTORS]
+    training_residuals = residuals(pq_training, _assign(pq_training, centroids))
+    all_residuals = residuals(vectors, labels)
+    codebooks = np.empty((n_subspaces, n_codes, sub_dim), dtype=np.float32)
+    codes = np.empty((n_docs, n_subspaces), dtype=np.uint8)
+    for s in range(n_subspaces):
+        codebooks[s] = _kmeans(np.ascontiguousarray(training_residuals[:, s]), n_codes, 15, rng)
+        codes[:, s] = _assign(np.ascontiguousarray(all_residuals[:, s]), codebooks[s])
+
+    # Speeches grouped by list, so a list is one contiguous slice
+    order = np.argsort(labels, kind='stable')
+    list_offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=n_lists)))).astype(np.int64)
+
+    np.save(os.path.join(output_dir, 'centroids.npy'), centroids)
+    np.save(os.path.join(output_dir, 'codebooks.npy'), codebooks)
+    np.save(os.path.join(output_dir, 'list_offsets.npy'), list_offsets)
+    np.save(os.path.join(output_dir, 'list_doc_ids.npy'), order.astype(np.int32))
+    np.save(os.path.join(output_dir, 'codes.npy'), codes[order])
+
+    meta = {'n_docs': int(n_docs), 'dim': int(dim), 'n_lists': int(n_lists),
+            'n_subspaces': int(n_subspaces), 'n_codes': int(n_codes)}
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+    # Speed against accuracy for a few nprobe values, kept in meta.json for /stats/ann
+    index = AnnIndex(output_dir, vectors)
+    meta['recall'] = []
+    print(f"ANN index: {n_docs} vectors, {n_lists} lists, {n_subspaces} bytes per vector")
+    print(f"{'nprobe':>7} {'recall@10':>10} {'ann ms':>8} {'exact ms':>9}")
+    for nprobe in sorted({p for p in (1, 2, 4, DEFAULT_NPROBE, 16, 32) if p <= n_lists} | {n_lists}):
+        report = index.evaluate(nprobe=nprobe)
+        meta['recall'].append(report)
+        print(f"{nprobe:>7} {report['recall_at_k']:>10.3f} {report['ann_ms']:>8.3f} {report['exact_ms']:>9.3f}")
+
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    print(f"ANN index saved in '{output_dir}'")
+
+
+class AnnIndex:
+
+    def __init__(self, index_dir, vectors=None, mmap_mode='r'):
+        """vectors: the normalized LSI vectors of the speeches (see normalized_vectors.py)."""
+        load = lambda name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+        # Generations published before the shared vectors have a copy of their own
+        self.vectors = load('vectors') if vectors is None else vectors
+        self.list_offsets = load('list_offsets')
+        self.list_doc_ids = load('list_doc_ids')
+        self.codes = load('codes')
+        # Small, kept in memory
+        self.centroids = np.load(os.path.join(index_dir, 'centroids.npy'))
+        self.codebooks = np.load(os.path.join(index_dir, 'codebooks.npy'))
+
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.n_docs = self.meta['n_docs']
+        self.n_lists = self.meta['n_lists']
+        self._centroid_half_norms = 0.5 * np.einsum('ij,ij->i', self.centroids, self.centroids)
+        # Position of the table of every subspace in the flattened (subspaces x codes) lookup table
+        self._table_offsets = np.arange(self.codebooks.shape[0], dtype=np.intp) * self.codebooks.shape[1]
+
+    def __len__(self):
+        return self.n_docs
+
+    def search(self, query, k, nprobe=DEFAULT_NPROBE, exclude=None):
+        """
+        The k speeches closest to a normalized query vector by cosine, best first, scanning the nprobe
+        closest lists. Returns (doc_ids, cosine similarities). exclude: a speech id left out (the query's own).
+        """
+        n_subspaces, n_codes, sub_dim = self.codebooks.shape
+        nprobe = max(1, min(nprobe, self.n_lists))
+        probed = top_k_indices(self.centroids @ query - self._centroid_half_norms, nprobe)
+
+        # Every list is a contiguous slice of the arrays
+        starts, ends = self.list_offsets[probed], self.list_offsets[probed + 1]
+        codes = np.concatenate([self.codes[s:e] for s, e in zip(starts, ends)])
+        doc_ids = np.concatenate([self.list_doc_ids[s:e] for s, e in zip(starts, ends)])
+        if len(doc_ids) == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        # Inner product with centroid + quantized residual: one lookup per subspace in a flat table
+        padded = np.zeros(n_subspaces * sub_dim, dtype=np.float32)
+        padded[:len(query)] = query
+        table = (self.codebooks @ padded.reshape(n_subspaces, sub_dim, 1)).ravel()
+        approximate = np.take(table, codes + self._table_offsets).sum(axis=1)
+        approximate += np.repeat(self.centroids[probed] @ query, ends - starts)
+
+        if exclude is not None:
+            keep = doc_ids != exclude
+            doc_ids, approximate = doc_ids[keep], approximate[keep]
+
+        # Sorted ids read the memory-mapped vectors in file order
+        candidates = np.sort(doc_ids[top_k_indices(approximate, k * RERANK_FACTOR)])
+        exact = (self.vectors[candidates] @ query).astype(np.float64)
+        best = top_k_indices(exact, k)
+        return candidates[best], exact[best]
+
+    def similar(self, doc_id, k, nprobe=DEFAULT_NPROBE):
+        return self.search(np.asarray(self.vectors[doc_id]), k, nprobe, exclude=doc_id)
+
+    def exact_similar(self, doc_id, k):
+        """Brute force: the query against every vector."""
+        scores = self.vectors @ np.asarray(self.vectors[doc_id])
+        scores[doc_id] = -np.inf
+        best = top_k_indices(scores, k)
+        return best, scores[best]
+
+    def evaluate(self, nprobe=DEFAULT_NPROBE, k=10, n_queries=200, seed=0):
+        """recall@k of similar() against exact_similar() and the mean time of both, on random speeches."""
+        rng = np.random.default_rng(seed)
+        queries = rng.choice(self.n_docs, min(n_queries, self.n_docs), replace=False)
+        found = expected = 0
+        ann_seconds = exact_seconds = 0.0
+
+        for doc_id in queries:
+            started = time.perf_counter()
+            approximate, _ = self.similar(doc_id, k, nprobe)
+            ann_seconds += time.perf_counter() - started
+
+            started = time.perf_counter()
+            exact, _ = self.exact_similar(doc_id, k)
+            exact_seconds += time.perf_counter() - started
+
+            found += len(np.intersect1d(approximate, exact))
+            expected += len(exact)
+
+        return {
+            'nprobe': int(nprobe),
+            'k': int(k),
+            'queries': int(len(queries)),
+            'recall_at_k': round(found / max(expected, 1), 4),
+            'ann_ms': round(1000 * ann_seconds / max(len(queries), 1), 4),
+            'exact_ms': round(1000 * exact_seconds / max(len(queries), 1), 4),
+        }
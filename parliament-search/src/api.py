@@ -1,16 +1,21 @@
 import os
-import re
-import string
-import joblib
-import pandas as pd
+import time
+import asyncio
 import numpy as np
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Header
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
-from sklearn.metrics.pairwise import cosine_similarity
-from greek_stemmer import stemmer
+from generations import GenerationManager
+from ranking_cache import LRUTTLCache, new_ranking_id, encode_cursor, decode_cursor
+from serving import run_scoring, run_in_pool, Overloaded, limiter, scoring_pool, latency_stats, SCORING_THREADS
+from query_batcher import QueryBatcher
+from query_cache import QueryCache
+from ann_index import DEFAULT_NPROBE
+from cluster_index import DEFAULT_CLUSTER_NPROBE
 
-#Python API for the web application. Implements /search and /trend
+#Python API for the web application. Implements /search (lexical, semantic, hybrid or cluster-pruned), /trend
+#and /speech/{id}/similar
 
 app = FastAPI()
 
@@ -30,139 +35,481 @@ print(f"DEBUG: Base Directory is {BASE_DIR}")
 print(f"DEBUG: Public Directory is {PUBLIC_DIR}")
 
 
-def load_stopwords(filepath):
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return set(line.strip().lower() for line in f if line.strip())
-    except FileNotFoundError:
-        print(f"Warning: {filepath} not found.")
-        return set()
-
-STOPWORDS_FILE = os.path.join(PUBLIC_DIR, 'dictionary', 'stopwords_stemmed.txt')
-stopwords = load_stopwords(STOPWORDS_FILE)
-
-translator = str.maketrans(string.punctuation + '΄‘’“”«»…–', ' ' * (len(string.punctuation) + 9))
-digit_punct_cleaner = re.compile(r'(?<=\d)[\.,](?=\d)')
-
-# Apply to querry the same processing as in preprocess.py 
-def preprocess_query(text):
-    if not text: return ""
+# The models are loaded as one generation (see generations.py). A new pipeline run is picked up
+# by the watcher below or by POST /admin/reload, without restarting the API
+generations = GenerationManager(PUBLIC_DIR)
+RELOAD_CHECK_SECONDS = float(os.environ.get('RELOAD_CHECK_SECONDS', 10))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
 
-    text = digit_punct_cleaner.sub('', text.lower())
-    text = text.translate(translator)
-    words = text.split()
-    
-    cleaned_words = []
-    
-    for word in words:
-        if word in stopwords or len(word) < 2:
-            continue
-            
-        stemmed_upper = stemmer.stem_word(word.upper(), 'VBG')
-        
-        if stemmed_upper.islower():
-            continue 
-            
-        stemmed_lower = stemmed_upper.lower()
-        
-        if stemmed_lower in stopwords:
-            continue
-            
-        cleaned_words.append(stemmed_lower)
-
-    return ' '.join(cleaned_words)
-
-#Load tfidf models and datafile with unprocessed speeches
+#Load the current generation at startup. Later ones are swapped in by reload(), the running requests keep theirs
 try:
     print("Loading models...")
-    
-    vec_path = os.path.join(PUBLIC_DIR, 'search_models', 'tfidf_vectorizer_speech.joblib')
-    mat_path = os.path.join(PUBLIC_DIR, 'search_models', 'tfidf_matrix_speech.joblib')
-    csv_path = os.path.join(PUBLIC_DIR, 'clean_full_speeches.csv')
-    
-    tfidf_vectorizer = joblib.load(vec_path) 
-    tfidf_matrix = joblib.load(mat_path) 
-    df = pd.read_csv(csv_path).fillna('')
-    
-    print("Processing dates...")
-    df['date_obj'] = pd.to_datetime(df['sitting_date'], format='%d/%m/%Y', errors='coerce')
-    df['year'] = df['date_obj'].dt.year.fillna(0).astype(int)
-    
+    generations.reload()
     print("Models and Data loaded successfully!")
 
 except Exception as e:
     print(f"CRITICAL ERROR loading models: {e}")
-    df = pd.DataFrame()
-    tfidf_matrix = None
-    tfidf_vectorizer = None
+
+def current_generation():
+    gen = generations.current
+    if gen is None:
+        raise HTTPException(status_code=500, detail="Models not loaded properly.")
+    return gen
+
+# Queries get the same normalization as the speeches of preprocess.py (see text_normalization.py)
+def preprocess_query(text, gen):
+    return gen.normalizer.normalize(text)
 
 
+# Rankings kept for "load more". A first search ranks RANKING_DEPTH speeches,
+# follow-up pages with the returned cursor just slice that ranking
+RANKING_DEPTH = 1000
+
 class SearchQuery(BaseModel):
-    query: str
-    top_k: int = 10
+    query: str = ""
+    # A page is at most one whole ranking
+    top_k: int = Field(10, ge=1, le=RANKING_DEPTH)
+    cursor: Optional[str] = None
+    # Slim results carry speech_id and snippet only, the full text comes from /speech/{id}
+    slim: bool = False
+    # lexical: TF-IDF posting lists, semantic: LSI topic space, hybrid: a weighted sum of both,
+    # clustered: exact TF-IDF cosine over the speeches of the nprobe k-means clusters closest to the query
+    mode: str = "lexical"
+    nprobe: int = DEFAULT_CLUSTER_NPROBE
 
 class TrendQuery(BaseModel):
-    word: str
+    word: str = ""
+    words: List[str] = []
+
+class SpeechBatchQuery(BaseModel):
+    ids: List[int]
+
+MAX_BATCH_SPEECHES = 100
+MAX_TREND_WORDS = 20
+MAX_SIMILAR_SPEECHES = 100
+MAX_RECALL_SAMPLES = 1000
+
+SEARCH_MODES = ("lexical", "semantic", "hybrid", "clustered")
+MIN_SEARCH_SCORE = 0.05
+# Share of the lexical cosine in a hybrid score, the rest is the LSI cosine
+HYBRID_LEXICAL_WEIGHT = float(os.environ.get('HYBRID_LEXICAL_WEIGHT', 0.5))
+
+
+# Cache of /search rankings and /trend series. Keys include the generation and the cache is emptied
+# when a new one is served. Set QUERY_CACHE_REDIS_URL to share it between the uvicorn workers
+query_cache = QueryCache(
+    version_fn=lambda: generations.current.id if generations.current else None,
+    max_entries=int(os.environ.get('QUERY_CACHE_SIZE', 2048)),
+    ttl_seconds=int(os.environ.get('QUERY_CACHE_TTL_SECONDS', 900)),
+    shared_url=os.environ.get('QUERY_CACHE_REDIS_URL'),
+)
+
+ranking_cache = LRUTTLCache(max_entries=512, ttl_seconds=600)
+
+def ranking_entry(gen, processed_query, depth, doc_ids, scores, mode="lexical"):
+    return {
+        "generation": gen.id,
+        "query": processed_query,
+        "mode": mode,
+        "doc_ids": doc_ids,
+        "scores": scores,
+        # Fewer hits than requested means nothing is left beyond this ranking
+        "complete": len(doc_ids) < depth,
+    }
+
+def rank_semantic(gen, processed_queries, depths, mode):
+    # The queries in LSI topic space, scored against every speech with one dense product (see semantic_index.py)
+    query_vectors = gen.semantic_index.project(processed_queries)
+    lexical_scores = None
+    if mode == "hybrid":
+        query_vectors *= 1.0 - HYBRID_LEXICAL_WEIGHT
+        query_matrix = gen.tfidf_vectorizer.transform(processed_queries)
+        lexical_scores = (HYBRID_LEXICAL_WEIGHT * gen.search_index.score_many(query_matrix)).T.tocsr()
+    return gen.semantic_index.search_many(query_vectors, depths, min_score=MIN_SEARCH_SCORE,
+                                          extra_scores=lexical_scores)
+
+def rank_clustered(gen, processed_queries, depths, nprobe):
+    # The LSI vector picks the clusters, the TF-IDF vector is scored on their rows (see cluster_index.py)
+    query_matrix = gen.tfidf_vectorizer.transform(processed_queries)
+    query_vectors = gen.semantic_index.project(processed_queries)
+    return [gen.cluster_index.search(query_matrix[i], query_vectors[i], depth, nprobe, min_score=MIN_SEARCH_SCORE)[:2]
+            for i, depth in enumerate(depths)]
+
+def rank_non_lexical(gen, processed_queries, depths, mode, nprobe):
+    if mode == "clustered":
+        return rank_clustered(gen, processed_queries, depths, nprobe)
+    return rank_semantic(gen, processed_queries, depths, mode)
+
+def rank_query(gen, processed_query, depth, mode="lexical", nprobe=None):
+    if mode != "lexical":
+        doc_ids, scores = rank_non_lexical(gen, [processed_query], [depth], mode, nprobe)[0]
+        return ranking_entry(gen, processed_query, depth, doc_ids, scores, mode)
+
+    query_vec = gen.tfidf_vectorizer.transform([processed_query])
+    # Only the posting lists of the query terms are scored (see inverted_index.py)
+    doc_ids, scores = gen.search_index.search(query_vec, depth, min_score=MIN_SEARCH_SCORE)
+    return ranking_entry(gen, processed_query, depth, doc_ids, scores)
+
+def rank_queries(items):
+    # One vectorizer call and one product for every query of the batch with the same mode.
+    # Right after a reload a batch can mix generations, each one is scored with its own models
+    rankings = [None] * len(items)
+    groups = {}
+    for position, (gen, processed_query, depth, mode, nprobe) in enumerate(items):
+        groups.setdefault((gen, mode, nprobe), []).append((position, processed_query, depth))
+
+    for (gen, mode, nprobe), group in groups.items():
+        processed_queries = [q for _, q, _ in group]
+        depths = [d for _, _, d in group]
+        if mode == "lexical":
+            query_matrix = gen.tfidf_vectorizer.transform(processed_queries)
+            hits = gen.search_index.search_many(query_matrix, depths, min_score=MIN_SEARCH_SCORE)
+        else:
+            hits = rank_non_lexical(gen, processed_queries, depths, mode, nprobe)
+        for (position, q, d), (doc_ids, scores) in zip(group, hits):
+            rankings[position] = ranking_entry(gen, q, d, doc_ids, scores, mode)
+    return rankings
+
+# Micro-batching of /search scoring. The window is how long the first query of a batch waits for others
+SEARCH_BATCHING = os.environ.get('SEARCH_BATCHING', '1') == '1'
+SEARCH_BATCH_WINDOW_MS = float(os.environ.get('SEARCH_BATCH_WINDOW_MS', 2))
+SEARCH_BATCH_MAX_SIZE = int(os.environ.get('SEARCH_BATCH_MAX_SIZE', 32))
+
+query_batcher = QueryBatcher(rank_queries, scoring_pool,
+                             window_ms=SEARCH_BATCH_WINDOW_MS, max_batch_size=SEARCH_BATCH_MAX_SIZE)
+
+async def rank(gen, processed_query, depth, mode="lexical", nprobe=None):
+    if SEARCH_BATCHING:
+        return await query_batcher.submit((gen, processed_query, depth, mode, nprobe))
+    return await run_in_pool(rank_query, gen, processed_query, depth, mode, nprobe)
+
+def speech_metadata(speech_store, idx):
+    return {
+        "speech_id": int(idx),
+        "member_name": speech_store.value(idx, 'member_name'),
+        "sitting_date": speech_store.value(idx, 'sitting_date'),
+        "political_party": speech_store.value(idx, 'political_party'),
+    }
+
+def format_results(speech_store, doc_ids, scores, slim=False):
+    results = []
+    for idx, score in zip(doc_ids, scores):
+        item = speech_metadata(speech_store, idx)
+        item["speech_snippet"] = speech_store.snippet(idx, 300) + "..."
+        if not slim:
+            item["full_speech"] = speech_store.text(idx)
+        item["score"] = float(round(score, 4))
+        results.append(item)
+    return results
+
+
+def check_search_mode(gen, mode, nprobe):
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(SEARCH_MODES)}.")
+    if mode != "lexical" and gen.semantic_index is None:
+        raise HTTPException(status_code=503, detail="Semantic search not available.")
+    if mode == "clustered":
+        cluster_index_of(gen)
+        if nprobe is None or nprobe < 1:
+            raise HTTPException(status_code=400, detail="nprobe must be at least 1.")
+
+def cluster_index_of(gen):
+    if gen.cluster_index is None:
+        raise HTTPException(status_code=503, detail="Cluster index not available.")
+    return gen.cluster_index
+
+async def run_search(req, gen):
+    if req.cursor:
+        try:
+            ranking_id, offset, processed_query, mode, nprobe = decode_cursor(req.cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        check_search_mode(gen, mode, nprobe)
+
+        ranking = ranking_cache.get(ranking_id)
+        if ranking is None or ranking["generation"] != gen.id:
+            # Expired, evicted, ranked by another worker or by older models: rank again as deep as this page needs
+            ranking = await rank(gen, processed_query, max(offset + req.top_k, RANKING_DEPTH), mode, nprobe)
+    else:
+        mode = req.mode
+        # Only the clustered mode has an nprobe, the others share their rankings whatever it is set to
+        nprobe = req.nprobe if mode == "clustered" else None
+        check_search_mode(gen, mode, nprobe)
+        processed_query = preprocess_query(req.query, gen)
+
+        if not processed_query:
+            return {"results": [], "count": 0, "next_cursor": None}
+
+        ranking_id, offset = new_ranking_id(), 0
+        depth = max(req.top_k, RANKING_DEPTH)
+
+        # Popular searches are served from the query cache. The key is the bag of stems and the depth actually ranked
+        cache_key = QueryCache.key("search", processed_query.split(), depth, gen.id, mode, nprobe)
+        ranking = query_cache.get(cache_key)
+        if ranking is None:
+            ranking = await rank(gen, processed_query, depth, mode, nprobe)
+            query_cache.put(cache_key, ranking)
+
+    end = offset + req.top_k
+
+    # Paging past a truncated ranking: rank deeper once and keep the longer ranking
+    if end > len(ranking["doc_ids"]) and not ranking["complete"]:
+        ranking = await rank(gen, ranking["query"], max(end, 2 * len(ranking["doc_ids"])), mode, nprobe)
+
+    ranking_cache.put(ranking_id, ranking)
+
+    page_ids = ranking["doc_ids"][offset:end]
+    page_scores = ranking["scores"][offset:end]
+    results = await run_in_pool(format_results, gen.speech_store, page_ids, page_scores, slim=req.slim)
+
+    has_more = end < len(ranking["doc_ids"]) or not ranking["complete"]
+    next_cursor = encode_cursor(ranking_id, end, ranking["query"], mode, nprobe) if has_more and results else None
+
+    return {"results": results, "count": len(results), "next_cursor": next_cursor}
 
+def too_busy():
+    return HTTPException(status_code=503, detail="Server is busy, please retry.", headers={"Retry-After": "1"})
 
 # Implements searching for speeches (1st tab of the website)
 @app.post("/search")
-def search_api(req: SearchQuery):
-    if tfidf_matrix is None:
-        raise HTTPException(status_code=500, detail="Models not loaded properly.")
+async def search_api(req: SearchQuery):
+    # The whole request runs against the generation served when it arrived, even if a reload swaps it meanwhile
+    gen = current_generation()
 
-    processed_query = preprocess_query(req.query)
-    
-    if not processed_query:
-        return {"results": [], "count": 0}
+    # Scoring runs off the event loop, in the bounded pool of serving.py (batched or not)
+    started = time.perf_counter()
+    try:
+        async with limiter.slot():
+            response = await run_search(req, gen)
+    except Overloaded:
+        raise too_busy()
 
-    query_vec = tfidf_vectorizer.transform([processed_query])
-    similarities = cosine_similarity(query_vec, tfidf_matrix).flatten()
-    top_indices = similarities.argsort()[-req.top_k:][::-1]
-    
-    results = []
-    for idx in top_indices:
-        score = similarities[idx]
-        if score > 0.05:
-            row = df.iloc[idx]
-            results.append({
-                "member_name": row['member_name'],
-                "sitting_date": row['sitting_date'],
-                "political_party": row['political_party'],
-                "speech_snippet": row['speech'][:300] + "...",
-                "full_speech": row['speech'],
-                "score": float(round(score, 4))
-            })
-    
-    return {"results": results, "count": len(results)}
+    latency_stats.record("batched" if SEARCH_BATCHING else "unbatched", time.perf_counter() - started)
+    return response
 
-# Implements searching for usage of a specific word through the years
-@app.post("/trend")
-def get_word_trend(req: TrendQuery):
-    if tfidf_matrix is None:
-        raise HTTPException(status_code=500, detail="Models not loaded")
-    
-    processed_word = preprocess_query(req.word)
+def full_speech(speech_store, speech_id):
+    item = speech_metadata(speech_store, speech_id)
+    item["speech"] = speech_store.text(speech_id)
+    return item
+
+# Full text of a single speech, fetched on demand after a slim /search
+@app.get("/speech/{speech_id}")
+def get_speech(speech_id: int):
+    speech_store = current_generation().speech_store
+
+    if not 0 <= speech_id < len(speech_store):
+        raise HTTPException(status_code=404, detail="Speech not found.")
+
+    return full_speech(speech_store, speech_id)
+
+# Batch variant of /speech/{id}. Unknown ids are skipped
+@app.post("/speeches")
+def get_speeches(req: SpeechBatchQuery):
+    speech_store = current_generation().speech_store
+
+    if len(req.ids) > MAX_BATCH_SPEECHES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SPEECHES} ids per request.")
+
+    speeches = [full_speech(speech_store, i) for i in req.ids if 0 <= i < len(speech_store)]
+    return {"speeches": speeches, "count": len(speeches)}
+
+def similar_speeches(gen, speech_id, k, nprobe):
+    doc_ids, scores = gen.ann_index.similar(speech_id, k, nprobe)
+    return format_results(gen.speech_store, doc_ids, scores, slim=True)
+
+def ann_index_of(gen):
+    if gen.ann_index is None:
+        raise HTTPException(status_code=503, detail="Similarity index not available.")
+    return gen.ann_index
+
+# Speeches on the same topics as a speech ("more like this"): nearest LSI vectors from the ANN index.
+# A larger nprobe scans more of the index, slower but closer to brute force (see /stats/ann)
+@app.get("/speech/{speech_id}/similar")
+async def get_similar_speeches(speech_id: int, k: int = 10, nprobe: int = DEFAULT_NPROBE):
+    gen = current_generation()
+    ann_index = ann_index_of(gen)
+
+    if not 0 <= speech_id < len(ann_index):
+        raise HTTPException(status_code=404, detail="Speech not found.")
+    if not 1 <= k <= MAX_SIMILAR_SPEECHES or nprobe < 1:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {MAX_SIMILAR_SPEECHES}, nprobe at least 1.")
+
+    try:
+        results = await run_scoring(similar_speeches, gen, speech_id, k, nprobe)
+    except Overloaded:
+        raise too_busy()
+    return {"speech_id": speech_id, "results": results, "count": len(results)}
+
+def word_trend(word, gen):
+    processed_word = preprocess_query(word, gen)
     
     if not processed_word:
         return {"data": []}
 
     target_token = processed_word.split()[0] if " " in processed_word else processed_word
 
-    if target_token not in tfidf_vectorizer.vocabulary_:
+    if target_token not in gen.tfidf_vectorizer.vocabulary_:
         return {"data": [], "message": "Word not found in vocabulary", "token": target_token}
     
-    word_index = tfidf_vectorizer.vocabulary_[target_token]
-    word_scores = tfidf_matrix[:, word_index].toarray().flatten()
+    cache_key = QueryCache.key("trend", [target_token], gen.id)
+    cached = query_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-    temp_df = pd.DataFrame({
-        'year': df['year'],
-        'score': word_scores
-    })
+    # One row of the precomputed term x year aggregate (see term_trends.py)
+    word_index = gen.tfidf_vectorizer.vocabulary_[target_token]
+    result = {"data": gen.term_trends.trend(word_index), "token": target_token}
+    query_cache.put(cache_key, result)
+    return result
 
-    trend_data = temp_df[temp_df['year'] > 0].groupby('year')['score'].sum().reset_index()
-    trend_data = trend_data.sort_values('year')
+def run_trend(req, gen):
+    if req.words:
+        return {"series": [{"word": w, **word_trend(w, gen)} for w in req.words]}
+    return word_trend(req.word, gen)
 
-    result = trend_data.to_dict(orient='records')
-    
-    return {"data": result, "token": target_token}
\ No newline at end of file
+@app.post("/trend")
+async def get_word_trend(req: TrendQuery):
+    gen = current_generation()
+
+    if len(req.words) > MAX_TREND_WORDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_TREND_WORDS} words per request.")
+
+    try:
+        return await run_scoring(run_trend, req, gen)
+    except Overloaded:
+        raise too_busy()
+
+# Load of the serving pool, for monitoring
+@app.get("/health")
+def health():
+    gen = generations.current
+    return {
+        "models_loaded": gen is not None,
+        "generation": gen.id if gen else None,
+        "scoring_threads": SCORING_THREADS,
+        "max_inflight_requests": limiter.max_inflight,
+        "waiting_requests": limiter.waiting,
+    }
+
+# Watches public/generations/CURRENT and loads a newly published generation in the background.
+# Requests keep being served by the old generation until the new one is fully loaded
+async def watch_generations():
+    while True:
+        await asyncio.sleep(RELOAD_CHECK_SECONDS)
+        try:
+            if generations.available_generation() != getattr(generations.current, 'id', None):
+                await run_in_pool(generations.reload)
+        except Exception as e:
+            print(f"Error loading generation: {e}")
+
+@app.on_event("startup")
+async def start_generation_watcher():
+    if RELOAD_CHECK_SECONDS > 0:
+        asyncio.get_running_loop().create_task(watch_generations())
+
+# Manual reload, e.g. right after a pipeline run. Needs the X-Admin-Token header when ADMIN_TOKEN is set
+@app.post("/admin/reload")
+async def admin_reload(force: bool = False, x_admin_token: Optional[str] = Header(None)):
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden.")
+
+    previous = getattr(generations.current, 'id', None)
+    try:
+        generation_id = await run_in_pool(generations.reload, force)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error loading generation: {e}")
+
+    return {"generation": generation_id, "previous": previous, "reloaded": force or generation_id != previous}
+
+# Hit/miss counters of the query cache
+@app.get("/stats/cache")
+def cache_stats():
+    return query_cache.stats()
+
+# Recall@k of /speech/{id}/similar against brute force: the table measured when the index was built,
+# and a new measurement for the given nprobe on random speeches
+@app.get("/stats/ann")
+async def ann_stats(nprobe: int = DEFAULT_NPROBE, k: int = 10, samples: int = 100):
+    gen = current_generation()
+    ann_index = ann_index_of(gen)
+
+    if not 1 <= k <= MAX_SIMILAR_SPEECHES or not 1 <= samples <= MAX_RECALL_SAMPLES or nprobe < 1:
+        raise HTTPException(status_code=400, detail="Invalid nprobe, k or samples.")
+
+    try:
+        measured = await run_scoring(ann_index.evaluate, nprobe=nprobe, k=k, n_queries=samples)
+    except Overloaded:
+        raise too_busy()
+    return {
+        "n_docs": ann_index.n_docs,
+        "n_lists": ann_index.n_lists,
+        "build": ann_index.meta.get('recall', []),
+        "measured": measured,
+    }
+
+def evaluate_cluster_pruning(gen, nprobe, k, n_queries):
+    """
+    recall@k of mode=clustered against the exhaustive lexical search, their mean time and the share of
+    the speeches scored, on queries made of the top terms of random speeches.
+    """
+    cluster_index = gen.cluster_index
+    terms = gen.tfidf_vectorizer.get_feature_names_out()
+    queries = [" ".join(terms[term_ids]) for term_ids in cluster_index.sample_queries(n_queries)]
+    found = expected = scanned = 0
+    pruned_seconds = exhaustive_seconds = 0.0
+
+    for query in queries:
+        started = time.perf_counter()
+        query_vec = gen.tfidf_vectorizer.transform([query])
+        exact, _ = gen.search_index.search(query_vec, k, min_score=MIN_SEARCH_SCORE)
+        exhaustive_seconds += time.perf_counter() - started
+
+        started = time.perf_counter()
+        query_vector = gen.semantic_index.project([query])[0]
+        approximate, _, n_scored = cluster_index.search(query_vec, query_vector, k, nprobe,
+                                                        min_score=MIN_SEARCH_SCORE)
+        pruned_seconds += time.perf_counter() - started
+
+        found += len(np.intersect1d(approximate, exact))
+        expected += len(exact)
+        scanned += n_scored
+
+    n = max(len(queries), 1)
+    return {
+        'nprobe': int(nprobe),
+        'k': int(k),
+        'queries': len(queries),
+        'recall_at_k': round(found / max(expected, 1), 4),
+        'scanned_fraction': round(scanned / (n * max(len(cluster_index), 1)), 4),
+        'pruned_ms': round(1000 * pruned_seconds / n, 4),
+        'exhaustive_ms': round(1000 * exhaustive_seconds / n, 4),
+    }
+
+# Recall@k of /search mode=clustered against the exhaustive lexical search, for choosing nprobe
+@app.get("/stats/clusters")
+async def cluster_stats(nprobe: int = DEFAULT_CLUSTER_NPROBE, k: int = 10, samples: int = 100):
+    gen = current_generation()
+    check_search_mode(gen, "clustered", nprobe)
+
+    if not 1 <= k <= RANKING_DEPTH or not 1 <= samples <= MAX_RECALL_SAMPLES:
+        raise HTTPException(status_code=400, detail="Invalid nprobe, k or samples.")
+
+    try:
+        measured = await run_scoring(evaluate_cluster_pruning, gen, nprobe, k, samples)
+    except Overloaded:
+        raise too_busy()
+    return {
+        "n_docs": len(gen.cluster_index),
+        "n_clusters": gen.cluster_index.n_clusters,
+        "measured": measured,
+    }
+
+# p50/p99 latency of /search per serving mode (batched or unbatched)
+@app.get("/stats/latency")
+def search_latency():
+    return {
+        "batching": SEARCH_BATCHING,
+        "batch_window_ms": SEARCH_BATCH_WINDOW_MS,
+        "batch_max_size": SEARCH_BATCH_MAX_SIZE,
+        "search": latency_stats.summary(),
+    }
@@ -0,0 +1,13 @@
+import os
+import shutil
+
+#Output directories of the artifacts the API serves (see API_ARTIFACTS in generations.py)
+
+
+def fresh_output_dir(path):
+    """
+    Empties path for a new build: the directory is removed and created again, its files are never
+    overwritten in place, because published generations hard-link the files of the previous build.
+    """
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
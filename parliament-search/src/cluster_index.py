@@ -0,0 +1,119 @@
+import os
+import json
+import numpy as np
+from scipy.sparse import csr_matrix
+from inverted_index import top_k_indices
+from artifact_dirs import fresh_output_dir
+
+#Cluster-pruned search over the speech TF-IDF matrix.
+#The rows of the matrix are stored grouped by their k-means cluster (see kmeans.py), so every cluster is
+#one contiguous CSR slice. A query is first scored against the cluster centroids in LSI space, then the
+#exact TF-IDF cosine is computed only for the speeches of the nprobe best clusters.
+#Built at pipeline time by kmeans.py and queried by api.py for /search with mode=clustered
+
+CLUSTER_INDEX_DIR_NAME = 'cluster_pruned'
+DEFAULT_CLUSTER_NPROBE = 10
+
+
+def build_cluster_index(tfidf_matrix, labels, centroids, output_dir):
+    """
+    Saves the (speeches x terms) CSR matrix with its rows grouped by cluster (labels[i] is the cluster of
+    speech i), the speech id of every stored row, where every cluster starts and the unit-length centroids.
+    """
+    fresh_output_dir(output_dir)
+
+    n_clusters = len(centroids)
+    order = np.argsort(labels, kind='stable')
+    grouped = tfidf_matrix[order].tocsr()
+    grouped.sort_indices()
+    cluster_offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=n_clusters)))).astype(np.int64)
+
+    norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+
+    np.save(os.path.join(output_dir, 'indptr.npy'), grouped.indptr.astype(np.int64))
+    np.save(os.path.join(output_dir, 'indices.npy'), grouped.indices.astype(np.int32))
+    np.save(os.path.join(output_dir, 'data.npy'), grouped.data.astype(np.float64))
+    np.save(os.path.join(output_dir, 'doc_ids.npy'), order.astype(np.int32))
+    np.save(os.path.join(output_dir, 'cluster_offsets.npy'), cluster_offsets)
+    np.save(os.path.join(output_dir, 'centroids.npy'), (centroids / norms).astype(np.float32))
+
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'n_docs': int(tfidf_matrix.shape[0]), 'n_terms': int(tfidf_matrix.shape[1]),
+                   'n_clusters': int(n_clusters)}, f)
+
+    print(f"Cluster index saved in '{output_dir}' ({tfidf_matrix.shape[0]} speeches, {n_clusters} clusters)")
+
+
+class ClusterIndex:
+
+    def __init__(self, index_dir, mmap_mode='r'):
+        load = lambda name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+        self.doc_ids = load('doc_ids')
+        self.cluster_offsets = np.load(os.path.join(index_dir, 'cluster_offsets.npy'))
+        self.centroids = np.load(os.path.join(index_dir, 'centroids.npy'))
+
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.n_docs = meta['n_docs']
+        self.n_clusters = meta['n_clusters']
+        # The grouped rows as a CSR matrix on top of the memory-mapped arrays
+        self.matrix = csr_matrix((load('data'), load('indices'), load('indptr')),
+                                 shape=(meta['n_docs'], meta['n_terms']))
+
+    def __len__(self):
+        return self.n_docs
+
+    def search(self, query_vec, query_vector, top_k, nprobe=DEFAULT_CLUSTER_NPROBE, min_score=0.0):
+        """
+        Cosine ranking of a (1 x terms) TF-IDF query vector against the speeches of the nprobe clusters whose
+        centroids are closest to query_vector, its unit LSI vector. Returns (doc_ids, scores, speeches scored).
+        """
+        query_vec = query_vec.tocsr()
+        norm = np.sqrt(np.dot(query_vec.data, query_vec.data))
+        if norm == 0 or not np.any(query_vector):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64), 0
+
+        probed = np.sort(top_k_indices(self.centroids @ query_vector, max(1, min(nprobe, self.n_clusters))))
+        query_dense = np.zeros(self.matrix.shape[1])
+        query_dense[query_vec.indices] = query_vec.data / norm
+
+        # One sparse matrix-vector product per probed cluster, on a view of its rows (no copy)
+        doc_parts, score_parts = [], []
+        for cluster in probed:
+            start, end = self.cluster_offsets[cluster], self.cluster_offsets[cluster + 1]
+            if start == end:
+                continue
+            indptr = np.asarray(self.matrix.indptr[start:end + 1])
+            rows = csr_matrix((self.matrix.data[indptr[0]:indptr[-1]], self.matrix.indices[indptr[0]:indptr[-1]],
+                               indptr - indptr[0]), shape=(end - start, self.matrix.shape[1]))
+            scores = rows @ query_dense
+            keep = np.flatnonzero(scores > min_score)
+            doc_parts.append(np.asarray(self.doc_ids[start + keep]))
+            score_parts.append(scores[keep])
+
+        n_scored = int(sum(self.cluster_offsets[c + 1] - self.cluster_offsets[c] for c in probed))
+        if not doc_parts:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64), n_scored
+        docs = np.concatenate(doc_parts)
+        scores = np.concatenate(score_parts)
+
+        # In speech id order, so ties are broken as in the exhaustive search
+        by_doc = np.argsort(docs, kind='stable')
+        docs, scores = docs[by_doc], scores[by_doc]
+
+        best = top_k_indices(scores, top_k)
+        return docs[best], scores[best], n_scored
+
+    def sample_queries(self, n_queries, terms_per_query=3, seed=0):
+        """Term ids of test queries: the highest weighted terms of random speeches."""
+        rng = np.random.default_rng(seed)
+        queries = []
+        for row in rng.choice(self.n_docs, min(n_queries, self.n_docs), replace=False):
+            start, end = self.matrix.indptr[row], self.matrix.indptr[row + 1]
+            if start == end:
+                continue
+            weights = np.asarray(self.matrix.data[start:end])
+            top = top_k_indices(weights, terms_per_query)
+            queries.append(np.asarray(self.matrix.indices[start:end])[top])
+        return queries
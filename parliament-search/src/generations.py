@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import shutil
+import secrets
+import threading
+import joblib
+from text_normalization import TextNormalizer, load_stopwords, load_stem_table, STEM_TABLE_FILE_NAME
+from inverted_index import InvertedIndex, INDEX_DIR_NAME
+from speech_store import SpeechStore, STORE_DIR_NAME
+from term_trends import TermYearTrends, TRENDS_DIR_NAME
+from normalized_vectors import load_normalized_vectors, VECTORS_DIR_NAME
+from ann_index import AnnIndex, ANN_DIR_NAME
+from semantic_index import SemanticIndex, SEMANTIC_DIR_NAME
+from cluster_index import ClusterIndex, CLUSTER_INDEX_DIR_NAME
+
+#Versioned generations of the artifacts the API serves.
+#The pipeline publishes every run as public/generations/<id>/ (same layout as public/) with a
+#manifest.json, then points public/generations/CURRENT to it. The API loads a generation as one
+#object and swaps it atomically, so a request always sees a single, consistent set of models
+
+GENERATIONS_DIR_NAME = 'generations'
+CURRENT_FILE_NAME = 'CURRENT'
+MANIFEST_FILE_NAME = 'manifest.json'
+LEGACY_GENERATION_ID = 'legacy'
+
+# Paths relative to public/. Files of directories are hard-linked into the generation, other files are copied.
+# The pipeline replaces these files instead of writing them in place, and its stage cache (see
+# data-processing-scripts/stage_graph.py) still finds them in public/ after publishing
+API_ARTIFACTS = [
+    'search_models/tfidf_vectorizer_speech.joblib',
+    f'search_models/{INDEX_DIR_NAME}',
+    f'search_models/{TRENDS_DIR_NAME}',
+    f'search_models/{VECTORS_DIR_NAME}',
+    f'search_models/{ANN_DIR_NAME}',
+    f'search_models/{SEMANTIC_DIR_NAME}',
+    f'search_models/{CLUSTER_INDEX_DIR_NAME}',
+    STORE_DIR_NAME,
+    'dictionary/stopwords_stemmed.txt',
+]
+OPTIONAL_API_ARTIFACTS = [
+    f'dictionary/{STEM_TABLE_FILE_NAME}',
+]
+
+
+def read_current_generation(public_dir):
+    try:
+        with open(os.path.join(public_dir, GENERATIONS_DIR_NAME, CURRENT_FILE_NAME), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def generation_dir(public_dir, generation_id):
+    if generation_id == LEGACY_GENERATION_ID:
+        return public_dir
+    return os.path.join(public_dir, GENERATIONS_DIR_NAME, generation_id)
+
+
+def _write_atomically(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _artifact_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def _link_tree(source, target):
+    try:
+        shutil.copytree(source, target, copy_function=os.link)
+    except OSError:
+        # No hard links across filesystems (or on some mounts), a copy does the same
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(source, target)
+
+
+def publish_generation(public_dir, keep=2):
+    """
+    Links the API artifacts of the last pipeline run into a new generation directory, writes its
+    manifest and makes it the current one. Older generations beyond `keep` are removed.
+    """
+    generations_root = os.path.join(public_dir, GENERATIONS_DIR_NAME)
+    os.makedirs(generations_root, exist_ok=True)
+
+    generation_id = time.strftime('%Y%m%d-%H%M%S') + '-' + secrets.token_hex(3)
+    staging_dir = os.path.join(generations_root, f".staging-{generation_id}")
+
+    artifacts = {}
+    for rel_path in API_ARTIFACTS + OPTIONAL_API_ARTIFACTS:
+        source = os.path.join(public_dir, rel_path)
+        if not os.path.exists(source):
+            if rel_path in OPTIONAL_API_ARTIFACTS:
+                continue
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise FileNotFoundError(f"Missing artifact for the API: {source}")
+
+        target = os.path.join(staging_dir, rel_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.isdir(source):
+            _link_tree(source, target)
+        else:
+            shutil.copy2(source, target)
+        artifacts[rel_path] = _artifact_size(target)
+
+    with open(os.path.join(staging_dir, MANIFEST_FILE_NAME), 'w', encoding='utf-8') as f:
+        json.dump({'generation': generation_id, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'artifacts': artifacts}, f, indent=2)
+
+    # The generation becomes visible only once it is complete
+    os.rename(staging_dir, os.path.join(generations_root, generation_id))
+    _write_atomically(os.path.join(generations_root, CURRENT_FILE_NAME), generation_id)
+
+    # Generation ids sort by creation time. Files still mapped by a running API stay readable after removal
+    published = sorted(name for name in os.listdir(generations_root)
+                       if os.path.isdir(os.path.join(generations_root, name)) and not name.startswith('.'))
+    for old_id in published[:-keep]:
+        shutil.rmtree(os.path.join(generations_root, old_id), ignore_errors=True)
+
+    return generation_id
+
+
+class Generation:
+    """Every model the API needs, loaded from one generation directory."""
+
+    def __init__(self, generation_id, base_dir):
+        self.id = generation_id
+        self.base_dir = base_dir
+
+        stopwords = load_stopwords(os.path.join(base_dir, 'dictionary', 'stopwords_stemmed.txt'))
+        stem_table = load_stem_table(os.path.join(base_dir, 'dictionary', STEM_TABLE_FILE_NAME))
+        # Same normalizer as preprocess.py. Surface forms already stemmed by the pipeline are a dictionary lookup
+        self.normalizer = TextNormalizer(stopwords, stem_table=stem_table)
+
+        # Every array below is memory-mapped, so uvicorn workers share one copy through the page cache
+        self.tfidf_vectorizer = joblib.load(
+            os.path.join(base_dir, 'search_models', 'tfidf_vectorizer_speech.joblib'), mmap_mode='r')
+        self.search_index = InvertedIndex(os.path.join(base_dir, 'search_models', INDEX_DIR_NAME))
+        self.term_trends = TermYearTrends(os.path.join(base_dir, 'search_models', TRENDS_DIR_NAME))
+        # Speeches and metadata come from the columnar store written by preprocess.py
+        self.speech_store = SpeechStore(os.path.join(base_dir, STORE_DIR_NAME))
+        # Normalized LSI vectors, mapped once for both indexes below (None in older generations)
+        lsi_vectors = load_normalized_vectors(os.path.join(base_dir, 'search_models', VECTORS_DIR_NAME))
+        # "More like this" over the LSI vectors. Generations published before it have no index
+        ann_dir = os.path.join(base_dir, 'search_models', ANN_DIR_NAME)
+        self.ann_index = (AnnIndex(ann_dir, lsi_vectors)
+                          if os.path.exists(os.path.join(ann_dir, 'meta.json')) else None)
+        # /search mode=semantic|hybrid, same for generations published before it
+        semantic_dir = os.path.join(base_dir, 'search_models', SEMANTIC_DIR_NAME)
+        self.semantic_index = (SemanticIndex(semantic_dir, lsi_vectors)
+                               if os.path.exists(os.path.join(semantic_dir, 'meta.json')) else None)
+        # /search mode=clustered, same for generations published before it
+        cluster_dir = os.path.join(base_dir, 'search_models', CLUSTER_INDEX_DIR_NAME)
+        self.cluster_index = (ClusterIndex(cluster_dir)
+                              if os.path.exists(os.path.join(cluster_dir, 'meta.json')) else None)
+
+
+class GenerationManager:
+
+    def __init__(self, public_dir):
+        self.public_dir = public_dir
+        self._current = None
+        self._reload_lock = threading.Lock()
+
+    @property
+    def current(self):
+        """The generation to use for a whole request. Old ones live on until their last request ends."""
+        return self._current
+
+    def available_generation(self):
+        return read_current_generation(self.public_dir) or LEGACY_GENERATION_ID
+
+    def reload(self, force=False):
+        """
+        Loads the published generation if it is not the one being served and swaps it in.
+        Only one load runs at a time, so at most one generation is loading next to the served one.
+        Returns the id of the generation being served.
+        """
+        with self._reload_lock:
+            generation_id = self.available_generation()
+            if not force and self._current is not None and self._current.id == generation_id:
+                return generation_id
+
+            print(f"Loading generation {generation_id}...")
+            generation = Generation(generation_id, generation_dir(self.public_dir, generation_id))
+            self._current = generation
+            print(f"Serving generation {generation_id}")
+            return generation_id
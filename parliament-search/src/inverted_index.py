@@ -0,0 +1,148 @@
+import os
+import json
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+from artifact_dirs import fresh_output_dir
+
+#Posting-list index over the speech TF-IDF matrix.
+#Built at pipeline time by tfidf.py and queried by api.py for /search
+
+INDEX_DIR_NAME = 'inverted_index_speech'
+
+
+def build_inverted_index(tfidf_matrix, output_dir):
+    """
+    Transposes the (speeches x terms) CSR matrix into term -> (doc, weight) posting lists
+    and saves the three arrays as .npy files so the API can memory-map them.
+    """
+    fresh_output_dir(output_dir)
+
+    # CSC of the speech matrix is exactly the posting-list layout: one column (term) per slice
+    postings = tfidf_matrix.tocsc()
+    postings.sort_indices()
+
+    np.save(os.path.join(output_dir, 'indptr.npy'), postings.indptr.astype(np.int64))
+    np.save(os.path.join(output_dir, 'doc_ids.npy'), postings.indices.astype(np.int32))
+    np.save(os.path.join(output_dir, 'weights.npy'), postings.data.astype(np.float64))
+
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'n_docs': int(tfidf_matrix.shape[0]), 'n_terms': int(tfidf_matrix.shape[1]),
+                   'n_postings': int(postings.nnz)}, f)
+
+    print(f"Inverted index saved in '{output_dir}' ({postings.nnz} postings)")
+
+
+def top_k_indices(scores, k):
+    """
+    Positions of the k largest scores, best first. argpartition keeps this O(n) in the
+    number of candidates; ties are resolved towards the larger position, like a stable
+    argsort()[::-1] would.
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if k < n:
+        kth_score = np.partition(scores, n - k)[n - k]
+        candidates = np.flatnonzero(scores >= kth_score)
+    else:
+        candidates = np.arange(n)
+
+    order = np.lexsort((candidates, scores[candidates]))[::-1][:k]
+    return candidates[order]
+
+
+class InvertedIndex:
+
+    def __init__(self, index_dir, mmap_mode='r'):
+        self.indptr = np.load(os.path.join(index_dir, 'indptr.npy'), mmap_mode=mmap_mode)
+        self.doc_ids = np.load(os.path.join(index_dir, 'doc_ids.npy'), mmap_mode=mmap_mode)
+        self.weights = np.load(os.path.join(index_dir, 'weights.npy'), mmap_mode=mmap_mode)
+
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.n_docs = meta['n_docs']
+        self.n_terms = meta['n_terms']
+        self._term_matrix = None
+
+    @property
+    def term_matrix(self):
+        # The posting lists seen as a (terms x speeches) CSR matrix, on top of the same arrays
+        if self._term_matrix is None:
+            self._term_matrix = csr_matrix((self.weights, self.doc_ids, self.indptr),
+                                           shape=(self.n_terms, self.n_docs))
+        return self._term_matrix
+
+    def score(self, term_ids, query_weights):
+        """
+        Term-at-a-time accumulation: only the posting lists of the query terms are read,
+        so the cost depends on their lengths and not on the size of the corpus.
+        Returns (doc_ids, scores) for every document that contains at least one query term.
+        """
+        doc_parts = []
+        score_parts = []
+
+        for term_id, q_weight in zip(term_ids, query_weights):
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            if start == end:
+                continue
+            doc_parts.append(self.doc_ids[start:end])
+            score_parts.append(self.weights[start:end] * q_weight)
+
+        if not doc_parts:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+
+        if len(doc_parts) == 1:
+            return np.array(doc_parts[0]), score_parts[0]
+
+        docs = np.concatenate(doc_parts)
+        unique_docs, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts), minlength=len(unique_docs))
+        return unique_docs, scores
+
+    def search(self, query_vec, top_k, min_score=0.0):
+        """
+        Cosine ranking of a single (1 x terms) TF-IDF query vector against every speech.
+        Speech rows are already L2-normalized by the vectorizer, so the cosine is the dot product.
+        """
+        query_vec = query_vec.tocsr()
+        norm = np.sqrt(np.dot(query_vec.data, query_vec.data))
+        if norm == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+
+        docs, scores = self.score(query_vec.indices, query_vec.data / norm)
+
+        keep = scores > min_score
+        docs, scores = docs[keep], scores[keep]
+
+        best = top_k_indices(scores, top_k)
+        return docs[best], scores[best]
+
+    def score_many(self, query_matrix):
+        """(queries x speeches) sparse cosine scores of (queries x terms) TF-IDF rows, one sparse product."""
+        query_matrix = csr_matrix(query_matrix, dtype=np.float64)
+        norms = np.sqrt(np.asarray(query_matrix.multiply(query_matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        query_matrix = diags(1.0 / norms) @ query_matrix
+        return (query_matrix @ self.term_matrix).tocsr()
+
+    def search_many(self, query_matrix, top_ks, min_score=0.0):
+        """
+        Batched search: all (queries x terms) rows are scored with a single sparse product against
+        the posting lists, then each row keeps its own top-k. Returns one (doc_ids, scores) per query.
+        """
+        scores_matrix = self.score_many(query_matrix)
+        scores_matrix.sort_indices()
+
+        hits = []
+        for row, top_k in enumerate(top_ks):
+            start, end = scores_matrix.indptr[row], scores_matrix.indptr[row + 1]
+            docs = scores_matrix.indices[start:end]
+            scores = scores_matrix.data[start:end]
+
+            keep = scores > min_score
+            docs, scores = docs[keep], scores[keep]
+
+            best = top_k_indices(scores, top_k)
+            hits.append((docs[best], scores[best]))
+        return hits
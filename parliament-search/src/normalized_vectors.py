@@ -0,0 +1,44 @@
+import os
+import json
+import numpy as np
+from artifact_dirs import fresh_output_dir
+
+#The L2-normalized float32 LSI vectors of the speeches, row i being speech id i, in one file.
+#The ANN index (ann_index.py) and the semantic index (semantic_index.py) both score against these
+#vectors: they keep only their own structures and are given this array, memory-mapped once by the API.
+#Built at pipeline time by lsi.py
+
+VECTORS_DIR_NAME = 'lsi_vectors'
+# Rows normalized at once, the input may be memory-mapped
+CHUNK_ROWS = 65536
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def build_normalized_vectors(vectors, output_dir, chunk_rows=CHUNK_ROWS):
+    """Saves the rows of the (speeches x topics) vectors with unit length, as float32, a chunk of rows at a time."""
+    fresh_output_dir(output_dir)
+
+    normalized = np.lib.format.open_memmap(os.path.join(output_dir, 'vectors.npy'), mode='w+',
+                                           dtype=np.float32, shape=vectors.shape)
+    for start in range(0, len(vectors), chunk_rows):
+        normalized[start:start + chunk_rows] = normalize_rows(np.asarray(vectors[start:start + chunk_rows],
+                                                                         dtype=np.float32))
+    normalized.flush()
+    del normalized
+
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'n_docs': int(vectors.shape[0]), 'n_topics': int(vectors.shape[1])}, f)
+
+    print(f"Normalized LSI vectors saved in '{output_dir}' ({vectors.shape[0]} speeches, {vectors.shape[1]} topics)")
+
+
+def load_normalized_vectors(vectors_dir, mmap_mode='r'):
+    """The memory-mapped vectors, None when they were not built."""
+    if not os.path.exists(os.path.join(vectors_dir, 'meta.json')):
+        return None
+    return np.load(os.path.join(vectors_dir, 'vectors.npy'), mmap_mode=mmap_mode)
@@ -0,0 +1,54 @@
+import asyncio
+
+#Micro-batching for /search: queries that arrive within a few milliseconds of each other are
+#scored together by one call of score_batch (a single sparse product in api.py), then every
+#waiting request gets its own result back
+
+
+class QueryBatcher:
+
+    def __init__(self, score_batch, executor, window_ms=2.0, max_batch_size=32):
+        """score_batch takes a list of items and returns one result per item, in the same order."""
+        self.score_batch = score_batch
+        self.executor = executor
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch):
+        items = [item for item, _ in batch]
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.score_batch, items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            # The request may have been cancelled (client went away) while the batch was scored
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,121 @@
+import json
+import time
+import threading
+import numpy as np
+from ranking_cache import LRUTTLCache
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+#Result cache for /search and /trend, keyed by the normalized (stemmed) query, so that
+#"Ανεργία" and "ανεργίας" share an entry. Entries belong to one version of the models and are
+#dropped as soon as the API serves a new generation of them. Optionally backed by Redis so that all
+#uvicorn workers share it
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot cache {type(value)}")
+
+
+class RedisBackend:
+
+    def __init__(self, url, ttl_seconds, prefix='anaktisi:query:'):
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def put(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl_seconds, json.dumps(value, default=_to_json, ensure_ascii=False))
+
+
+class QueryCache:
+
+    def __init__(self, version_fn, max_entries=2048, ttl_seconds=900, shared_url=None, version_check_seconds=5):
+        self.version_fn = version_fn
+        self.version_check_seconds = version_check_seconds
+        self.local = LRUTTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.shared = None
+
+        if shared_url:
+            if redis is None:
+                print("Warning: QUERY_CACHE_REDIS_URL is set but the redis package is not installed, using the local cache only.")
+            else:
+                self.shared = RedisBackend(shared_url, ttl_seconds)
+
+        self._lock = threading.Lock()
+        self._version = version_fn()
+        self._checked_at = time.monotonic()
+        self._stats = {"hits": 0, "shared_hits": 0, "misses": 0, "invalidations": 0, "shared_errors": 0}
+
+    @staticmethod
+    def key(kind, tokens, *params):
+        # Bag of stems: word order does not change a TF-IDF query, repetitions do
+        return "|".join([kind, *map(str, params), " ".join(sorted(tokens))])
+
+    @property
+    def version(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.version_check_seconds:
+            version = self.version_fn()
+            with self._lock:
+                self._checked_at = now
+                if version != self._version:
+                    self._version = version
+                    self._stats["invalidations"] += 1
+                    self.local.clear()
+        return self._version
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        version = self.version
+        value = self.local.get(key)
+        if value is not None:
+            self._count("hits")
+            return value
+
+        if self.shared is not None:
+            try:
+                value = self.shared.get(f"{version}:{key}")
+            except Exception:
+                self._count("shared_errors")
+                value = None
+            if value is not None:
+                self.local.put(key, value)
+                self._count("shared_hits")
+                return value
+
+        self._count("misses")
+        return None
+
+    def put(self, key, value):
+        version = self.version
+        self.local.put(key, value)
+
+        if self.shared is not None:
+            try:
+                self.shared.put(f"{version}:{key}", value)
+            except Exception:
+                self._count("shared_errors")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["shared_hits"]) / lookups, 4) if lookups else 0.0
+        stats["entries"] = len(self.local)
+        stats["version"] = self._version
+        stats["shared_backend"] = "redis" if self.shared is not None else None
+        return stats
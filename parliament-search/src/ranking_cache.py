@@ -0,0 +1,79 @@
+import time
+import json
+import base64
+import secrets
+import threading
+from collections import OrderedDict
+
+#Server-side cache of ranked results, so that "load more" on /search only slices a ranking
+#that was already computed instead of scoring the whole query again
+
+
+class LRUTTLCache:
+    """Thread-safe dictionary with a maximum size (least recently used entries go first) and a time-to-live."""
+
+    def __init__(self, max_entries=512, ttl_seconds=600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def new_ranking_id():
+    return secrets.token_urlsafe(12)
+
+
+def encode_cursor(ranking_id, offset, query, mode="lexical", nprobe=None):
+    # The normalized query and the search mode travel with the cursor, so any worker can rebuild an evicted ranking
+    payload = {"r": ranking_id, "o": offset, "q": query, "m": mode}
+    if nprobe is not None:
+        payload["p"] = nprobe
+    raw = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Returns (ranking_id, offset, query, mode, nprobe). Raises ValueError for anything that was not made by
+    encode_cursor. Cursors made before search modes existed are lexical. nprobe is None unless it was given.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        ranking_id, offset, query = str(payload["r"]), int(payload["o"]), str(payload["q"])
+        mode = str(payload.get("m", "lexical"))
+        nprobe = int(payload["p"]) if "p" in payload else None
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+    if not ranking_id or not query or offset < 0:
+        raise ValueError("Invalid cursor")
+    return ranking_id, offset, query, mode, nprobe
@@ -0,0 +1,90 @@
+import os
+import json
+import joblib
+import numpy as np
+from inverted_index import top_k_indices
+from normalized_vectors import normalize_rows
+from artifact_dirs import fresh_output_dir
+
+#Semantic search over the LSI vectors of the speeches.
+#A query is weighted with the TF-IDF vectorizer of the LSI fit and projected into topic space, then
+#scored against every speech with one dense (speeches x topics) product: the cost depends on the number
+#of speeches and topics, not on how many terms the query has or how long their posting lists are.
+#The vectors of the speeches are the normalized ones shared with the ANN index (see normalized_vectors.py)
+#Built at pipeline time by lsi.py and queried by api.py for /search with mode=semantic|hybrid
+
+SEMANTIC_DIR_NAME = 'lsi_semantic'
+# Rows of the vectors scored at once, bounds the (rows x queries) score block in memory
+CHUNK_ROWS = 65536
+
+
+def build_semantic_index(vectorizer, components, output_dir):
+    """Saves the query side: the vectorizer and the terms x topics projection of the LSI fit."""
+    fresh_output_dir(output_dir)
+
+    joblib.dump(vectorizer, os.path.join(output_dir, 'vectorizer.joblib'))
+    # Terms x topics, so a query only reads the rows of its own terms
+    np.save(os.path.join(output_dir, 'projection.npy'), np.ascontiguousarray(components.T, dtype=np.float32))
+
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'n_topics': int(components.shape[0]), 'n_terms': int(components.shape[1])}, f)
+
+    print(f"Semantic index saved in '{output_dir}' ({components.shape[0]} topics, {components.shape[1]} terms)")
+
+
+class SemanticIndex:
+
+    def __init__(self, index_dir, vectors=None, mmap_mode='r'):
+        """vectors: the normalized LSI vectors of the speeches (see normalized_vectors.py)."""
+        self.vectorizer = joblib.load(os.path.join(index_dir, 'vectorizer.joblib'), mmap_mode=mmap_mode)
+        self.projection = np.load(os.path.join(index_dir, 'projection.npy'), mmap_mode=mmap_mode)
+        if vectors is None:
+            # Generations published before the shared vectors have a copy of their own
+            vectors = np.load(os.path.join(index_dir, 'vectors.npy'), mmap_mode=mmap_mode)
+        self.vectors = vectors
+
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.n_docs = len(vectors)
+        self.n_topics = meta['n_topics']
+
+    def __len__(self):
+        return self.n_docs
+
+    def project(self, processed_queries):
+        """(queries x topics) float32 unit vectors of the processed queries, zero for a query with no LSI term."""
+        query_matrix = self.vectorizer.transform(processed_queries)
+        return normalize_rows(np.asarray(query_matrix @ self.projection, dtype=np.float32))
+
+    def search_many(self, query_vectors, top_ks, min_score=0.0, extra_scores=None, chunk_rows=CHUNK_ROWS):
+        """
+        Cosine ranking of (queries x topics) vectors against every speech, one matrix product per chunk
+        of speeches (a single query is a matrix-vector product). extra_scores: optional (speeches x queries)
+        sparse scores added before ranking, the lexical part of a hybrid search.
+        Returns one (doc_ids, scores) per query, best first.
+        """
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        depth = max(top_ks, default=0)
+        parts = [([], []) for _ in top_ks]
+
+        for start in range(0, self.n_docs, chunk_rows):
+            end = min(start + chunk_rows, self.n_docs)
+            scores = (self.vectors[start:end] @ query_vectors.T).astype(np.float64)
+            if extra_scores is not None:
+                scores += extra_scores[start:end].toarray()
+
+            # The best `depth` speeches of every chunk are enough for the final top-k of every query
+            for q, (doc_parts, score_parts) in enumerate(parts):
+                column = scores[:, q]
+                best = top_k_indices(column, depth)
+                best = best[column[best] > min_score]
+                doc_parts.append(best + start)
+                score_parts.append(column[best])
+
+        hits = []
+        for top_k, (doc_parts, score_parts) in zip(top_ks, parts):
+            docs = np.concatenate(doc_parts) if doc_parts else np.empty(0, dtype=np.int64)
+            scores = np.concatenate(score_parts) if score_parts else np.empty(0, dtype=np.float64)
+            best = top_k_indices(scores, top_k)
+            hits.append((docs[best], scores[best]))
+        return hits
@@ -0,0 +1,92 @@
+import os
+import asyncio
+import threading
+from collections import deque
+from functools import partial
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+#Off-event-loop execution for the CPU-bound handlers of api.py.
+#Scoring runs in a bounded thread pool (NumPy/SciPy release the GIL in their kernels) and a
+#limiter caps the requests in flight, rejecting new ones once too many are already waiting
+
+SCORING_THREADS = int(os.environ.get('SCORING_THREADS', os.cpu_count() or 1))
+MAX_INFLIGHT_REQUESTS = int(os.environ.get('MAX_INFLIGHT_REQUESTS', 2 * SCORING_THREADS))
+MAX_QUEUED_REQUESTS = int(os.environ.get('MAX_QUEUED_REQUESTS', 64))
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+
+    def __init__(self, max_inflight, max_queued):
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self._semaphore = asyncio.Semaphore(max_inflight)
+        self._waiting = 0
+
+    @property
+    def waiting(self):
+        return self._waiting
+
+    @asynccontextmanager
+    async def slot(self):
+        # Backpressure: fail fast instead of letting the queue (and latency) grow without bound
+        if self._semaphore.locked() and self._waiting >= self.max_queued:
+            raise Overloaded()
+
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+class LatencyStats:
+    """Keeps the last latencies of each serving mode and reports their percentiles."""
+
+    def __init__(self, window=10000):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, mode, seconds):
+        with self._lock:
+            self._samples.setdefault(mode, deque(maxlen=self.window)).append(seconds)
+
+    def summary(self):
+        with self._lock:
+            samples = {mode: np.array(values) for mode, values in self._samples.items()}
+
+        return {
+            mode: {
+                "count": len(values),
+                "p50_ms": round(float(np.percentile(values, 50)) * 1000, 3),
+                "p99_ms": round(float(np.percentile(values, 99)) * 1000, 3),
+            }
+            for mode, values in samples.items() if len(values)
+        }
+
+
+scoring_pool = ThreadPoolExecutor(max_workers=SCORING_THREADS, thread_name_prefix='scoring')
+limiter = ConcurrencyLimiter(MAX_INFLIGHT_REQUESTS, MAX_QUEUED_REQUESTS)
+latency_stats = LatencyStats()
+
+
+async def run_in_pool(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(scoring_pool, partial(fn, *args, **kwargs))
+
+
+async def run_scoring(fn, *args, **kwargs):
+    """Runs fn in the scoring pool once a request slot is free. Raises Overloaded when the queue is full."""
+    async with limiter.slot():
+        return await run_in_pool(fn, *args, **kwargs)
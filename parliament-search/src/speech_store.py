@@ -0,0 +1,162 @@
+import os
+import mmap
+import shutil
+import json
+from datetime import datetime
+import numpy as np
+
+#Compact, columnar on-disk store for the full (unprocessed) speeches and their metadata.
+#All texts are concatenated as UTF-8 in text.bin and offsets.npy holds where each one starts.
+#Every metadata column (member_name, political_party, sitting_date, ...) is dictionary-encoded:
+#one int32 code per speech in <column>.codes.npy and the distinct values in columns.json.
+#The API memory-maps everything, so uvicorn workers share the page cache and start instantly
+
+STORE_DIR_NAME = 'speech_store'
+
+
+def year_of(sitting_date):
+    """Year of a dd/mm/YYYY sitting date, 0 when it is missing or malformed."""
+    try:
+        return datetime.strptime(sitting_date, '%d/%m/%Y').year
+    except (TypeError, ValueError):
+        return 0
+
+
+def _detach_files(directory):
+    """Replaces every file of directory with a private copy, so other hard links keep the old content."""
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.stat(path).st_nlink > 1:
+            shutil.copy2(path, f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+
+
+class SpeechStoreWriter:
+    """Streams speeches to disk in document order. Used by preprocess.py."""
+
+    def __init__(self, store_dir, columns, append=False):
+        """With append=True new speeches are added after the ones already in store_dir, their ids do not change."""
+        # Published generations hard-link the files of store_dir, they must never be written in place
+        if append:
+            _detach_files(store_dir)
+        else:
+            shutil.rmtree(store_dir, ignore_errors=True)
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.columns = list(columns)
+
+        if append:
+            existing = SpeechStore(store_dir)
+            if existing.columns != self.columns:
+                raise ValueError(f"Cannot append to {store_dir}: columns {existing.columns} instead of {self.columns}")
+            self._offsets = existing.offsets.tolist()
+            self._codes = {col: existing.codes[col].tolist() for col in self.columns}
+            self._dictionaries = {col: {value: code for code, value in enumerate(existing.dictionaries[col])}
+                                  for col in self.columns}
+            del existing
+        else:
+            self._offsets = [0]
+            self._codes = {col: [] for col in self.columns}
+            self._dictionaries = {col: {} for col in self.columns}
+
+        self._text_file = open(os.path.join(store_dir, 'text.bin'), 'ab' if append else 'wb')
+
+    def append(self, text, metadata):
+        """metadata holds one value per column, in the order given to the constructor."""
+        encoded = text.encode('utf-8')
+        self._text_file.write(encoded)
+        self._offsets.append(self._offsets[-1] + len(encoded))
+        self._append_metadata(metadata)
+
+    def append_shard(self, text_path, lengths, metadata_rows):
+        """
+        Speeches encoded by another process: their UTF-8 texts back to back in text_path,
+        the byte length of every text and its metadata.
+        """
+        with open(text_path, 'rb') as f:
+            shutil.copyfileobj(f, self._text_file, 1 << 20)
+        for length, metadata in zip(lengths, metadata_rows):
+            self._offsets.append(self._offsets[-1] + length)
+            self._append_metadata(metadata)
+
+    def _append_metadata(self, metadata):
+        for col, value in zip(self.columns, metadata):
+            dictionary = self._dictionaries[col]
+            code = dictionary.get(value)
+            if code is None:
+                code = dictionary[value] = len(dictionary)
+            self._codes[col].append(code)
+
+    def close(self):
+        self._text_file.close()
+        np.save(os.path.join(self.store_dir, 'offsets.npy'), np.array(self._offsets, dtype=np.int64))
+
+        for col in self.columns:
+            np.save(os.path.join(self.store_dir, f'{col}.codes.npy'), np.array(self._codes[col], dtype=np.int32))
+
+        # Year is derived once per distinct date instead of once per speech
+        if 'sitting_date' in self._dictionaries:
+            dates = list(self._dictionaries['sitting_date'])
+            year_by_code = np.array([year_of(d) for d in dates], dtype=np.int16)
+            codes = np.array(self._codes['sitting_date'], dtype=np.int32)
+            np.save(os.path.join(self.store_dir, 'year.npy'), year_by_code[codes])
+
+        with open(os.path.join(self.store_dir, 'columns.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'columns': self.columns,
+                'dictionaries': {col: list(self._dictionaries[col]) for col in self.columns},
+            }, f, ensure_ascii=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SpeechStore:
+
+    def __init__(self, store_dir):
+        self.offsets = np.load(os.path.join(store_dir, 'offsets.npy'), mmap_mode='r')
+
+        text_path = os.path.join(store_dir, 'text.bin')
+        if os.path.getsize(text_path) > 0:
+            with open(text_path, 'rb') as f:
+                self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._text = b''
+
+        with open(os.path.join(store_dir, 'columns.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.columns = meta['columns']
+        self.dictionaries = meta['dictionaries']
+        self.codes = {
+            col: np.load(os.path.join(store_dir, f'{col}.codes.npy'), mmap_mode='r')
+            for col in self.columns
+        }
+
+        year_path = os.path.join(store_dir, 'year.npy')
+        self.year = np.load(year_path, mmap_mode='r') if os.path.exists(year_path) else None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def value(self, doc_id, column):
+        return self.dictionaries[column][self.codes[column][doc_id]]
+
+    def metadata(self, doc_id, columns=None):
+        return {col: self.value(doc_id, col) for col in (columns or self.columns)}
+
+    def column_values(self, column):
+        """The value of a metadata column for every speech, in document order."""
+        return np.asarray(self.dictionaries[column], dtype=object)[self.codes[column]]
+
+    def text(self, doc_id):
+        start, end = self.offsets[doc_id], self.offsets[doc_id + 1]
+        return self._text[start:end].decode('utf-8')
+
+    def snippet(self, doc_id, n_chars=300):
+        # A character is at most 4 bytes in UTF-8, so this byte range always holds the first n_chars
+        start, end = self.offsets[doc_id], self.offsets[doc_id + 1]
+        end = min(end, start + 4 * n_chars)
+        return self._text[start:end].decode('utf-8', errors='ignore')[:n_chars]
@@ -0,0 +1,73 @@
+import os
+import numpy as np
+from scipy.sparse import csr_matrix
+from artifact_dirs import fresh_output_dir
+
+#Precomputed term x year aggregate of the speech TF-IDF matrix.
+#Built at pipeline time by tfidf.py, so /trend is a single row lookup in api.py
+
+TRENDS_DIR_NAME = 'term_year_trends'
+
+
+def _save_csr(matrix, output_dir, name):
+    np.save(os.path.join(output_dir, f'{name}.indptr.npy'), matrix.indptr.astype(np.int64))
+    np.save(os.path.join(output_dir, f'{name}.indices.npy'), matrix.indices.astype(np.int32))
+    np.save(os.path.join(output_dir, f'{name}.data.npy'), matrix.data)
+
+
+def build_term_year_trends(tfidf_matrix, count_matrix, years, output_dir):
+    """
+    Sums the TF-IDF weights and the raw counts of every term per year with one sparse product
+    (years x speeches indicator times speeches x terms). Speeches without a valid year (0) are left out.
+    """
+    fresh_output_dir(output_dir)
+
+    years = np.asarray(years)
+    docs = np.flatnonzero(years > 0)
+    year_values, year_rows = np.unique(years[docs], return_inverse=True)
+
+    indicator = csr_matrix(
+        (np.ones(len(docs)), (year_rows, docs)),
+        shape=(len(year_values), tfidf_matrix.shape[0])
+    )
+
+    # Stored transposed (terms x years) so that a term's trend is one CSR row
+    tfidf_by_year = (indicator @ tfidf_matrix).T.tocsr()
+    counts_by_year = (indicator @ count_matrix).T.tocsr().astype(np.int64)
+
+    np.save(os.path.join(output_dir, 'years.npy'), year_values.astype(np.int32))
+    _save_csr(tfidf_by_year, output_dir, 'tfidf')
+    _save_csr(counts_by_year, output_dir, 'counts')
+
+    print(f"Term-year trends saved in '{output_dir}' ({len(year_values)} years)")
+
+
+class TermYearTrends:
+
+    def __init__(self, trends_dir, mmap_mode='r'):
+        self.years = np.load(os.path.join(trends_dir, 'years.npy'))
+        self._tfidf = self._load_csr(trends_dir, 'tfidf', mmap_mode)
+        self._counts = self._load_csr(trends_dir, 'counts', mmap_mode)
+
+    @staticmethod
+    def _load_csr(trends_dir, name, mmap_mode):
+        return tuple(
+            np.load(os.path.join(trends_dir, f'{name}.{part}.npy'), mmap_mode=mmap_mode)
+            for part in ('indptr', 'indices', 'data')
+        )
+
+    def _dense_row(self, matrix, term_id, dtype):
+        indptr, indices, data = matrix
+        row = np.zeros(len(self.years), dtype=dtype)
+        start, end = indptr[term_id], indptr[term_id + 1]
+        row[indices[start:end]] = data[start:end]
+        return row
+
+    def trend(self, term_id):
+        """Summed TF-IDF score and raw count of a term for every year of the corpus, oldest first."""
+        scores = self._dense_row(self._tfidf, term_id, np.float64)
+        counts = self._dense_row(self._counts, term_id, np.int64)
+        return [
+            {"year": int(year), "score": float(score), "count": int(count)}
+            for year, score, count in zip(self.years, scores, counts)
+        ]
@@ -0,0 +1,112 @@
+import os
+import re
+import string
+from functools import lru_cache
+from greek_stemmer import stemmer
+
+#Text normalization shared by the pipeline (preprocess.py) and the API (/search, /trend),
+#so that speeches and queries always go through exactly the same cleaning and stemming
+
+STEM_TABLE_FILE_NAME = 'stem_table.tsv'
+
+translator = str.maketrans(string.punctuation + '΄‘’“”«»…–', ' ' * (len(string.punctuation) + 9))
+
+digit_punct_cleaner = re.compile(r'(?<=\d)[\.,](?=\d)')
+
+
+def load_stopwords(filepath):
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            # Stopwords are kept UPPERCASE, the same case the stemmer works with
+            return set(line.strip().upper() for line in f if line.strip())
+    except FileNotFoundError:
+        print(f"Warning: {filepath} not found.")
+        return set()
+
+
+def load_stem_table(filepath):
+    """Reads a 'SURFACE<TAB>STEM' file. Returns an empty table if the file does not exist."""
+    table = {}
+    if not os.path.exists(filepath):
+        return table
+
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line in f:
+            surface, _, stem = line.rstrip('\n').partition('\t')
+            if surface:
+                table[surface] = stem
+    return table
+
+
+def stem_word(word):
+    """Stem of an UPPERCASE surface form, as the stemmer gives it (no table, no cache)."""
+    return stemmer.stem_word(word, 'VBG')
+
+
+def save_stem_table(filepath, table):
+    """Writes a table readable by load_stem_table, sorted by surface form."""
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for surface in sorted(table):
+            f.write(f"{surface}\t{table[surface]}\n")
+    os.replace(tmp_path, filepath)
+
+
+class TextNormalizer:
+
+    def __init__(self, stopwords, stem_table=None, cache_size=100000):
+        self.stopwords = stopwords
+        # Known surface forms are a plain dictionary lookup, the rest go through a bounded LRU cache
+        self.stem_table = stem_table if stem_table is not None else {}
+        self._cached_stem = lru_cache(maxsize=cache_size)(stem_word)
+
+    def stem(self, word):
+        """Stem of an UPPERCASE word."""
+        stemmed = self.stem_table.get(word)
+        if stemmed is None:
+            stemmed = self._cached_stem(word)
+        return stemmed
+
+    def warm(self, words):
+        """Adds the stems of the given UPPERCASE words to the lookup table."""
+        for word in words:
+            if word not in self.stem_table:
+                self.stem_table[word] = stem_word(word)
+
+    def tokens(self, text):
+        """The UPPERCASE surface forms of text that go to the stemmer: no punctuation, number formatting or stopwords."""
+        # Uppercase entire text ONCE (matches Stemmer requirement) and remove number formatting
+        text = digit_punct_cleaner.sub('', text.upper())
+        stopwords = self.stopwords
+        return [word for word in text.translate(translator).split() if word not in stopwords]
+
+    def normalize(self, text):
+        """
+        Uppercase, strip punctuation and number formatting, drop stopwords, stem and
+        return the lowercase stems joined with spaces.
+        """
+        if not text:
+            return ""
+
+        stopwords = self.stopwords
+        stem = self.stem
+        cleaned_words = []
+        append_word = cleaned_words.append
+
+        for word in self.tokens(text):
+            stemmed_upper = stem(word)
+
+            # If stem became lower, stemmer rejected it or it's invalid
+            if stemmed_upper.islower():
+                continue
+
+            if stemmed_upper in stopwords:
+                continue
+
+            # Only convert to lower at the very end for output
+            append_word(stemmed_upper.lower())
+
+        return ' '.join(cleaned_words)
+
+    def normalize_many(self, texts):
+        return [self.normalize(text) for text in texts]
@@ -6,18 +6,14 @@ if [ ! -f "data/random_sample.csv" ]; then
     exit 1
 fi
 
-python data-processing-scripts/stem.py
-
-python data-processing-scripts/preprocess.py
-
-python data-processing-scripts/tfidf.py
-
-python data-processing-scripts/similarities.py
-
-python data-processing-scripts/lsi.py
-
-python data-processing-scripts/kmeans.py
+# PIPELINE_MODE=incremental processes only the rows added to the input since the last run
+MODE_FLAG=""
+if [ "${PIPELINE_MODE:-full}" = "incremental" ]; then
+    MODE_FLAG="--incremental"
+fi
 
-python data-processing-scripts/sentiments.py
+# Every step, from stemming to publishing. Steps whose code, inputs and parameters did not change
+# since their last run are skipped, independent steps run in parallel (see data-processing-scripts/stage_graph.py)
+python data-processing-scripts/pipeline.py $MODE_FLAG
 
 echo "--- Η ΕΠΕΞΕΡΓΑΣΙΑ ΟΛΟΚΛΗΡΩΘΗΚΕ ΕΠΙΤΥΧΩΣ ---"
\ No newline at end of file
@@ -0,0 +1,7 @@
+import os
+import sys
+
+#The tests import the modules the way the scripts do, with their directories on sys.path
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'parliament-search', 'src'))
+sys.path.append(os.path.join(ROOT, 'data-processing-scripts'))
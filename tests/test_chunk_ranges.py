@@ -0,0 +1,65 @@
+import csv
+
+import pytest
+
+import preprocess
+from preprocess import read_header, chunk_ranges, read_chunk
+
+ROWS = [
+    ['1', 'Πρώτη ομιλία', 'ΚΚΕ'],
+    ['2', 'Ομιλία σε\nπολλές\nγραμμές, με κόμματα', 'ΝΔ'],
+    ['3', 'Με "εισαγωγικά" μέσα\nκαι αλλαγή γραμμής', 'ΠΑΣΟΚ'],
+    ['4', '"\n"\n"', ''],
+    ['5', 'Κενές γραμμές\n\n\nστο μέσο', 'ΣΥΡΙΖΑ'],
+]
+
+
+def write_input(path, rows, line_end='\n', tail=''):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator=line_end)
+        writer.writerow(['id', 'speech', 'political_party'])
+        writer.writerows(rows)
+        f.write(tail)
+
+
+def rows_by_chunks(path, chunk_bytes, monkeypatch):
+    monkeypatch.setattr(preprocess, 'worker_input_file', str(path))
+    _, data_start = read_header(str(path))
+    ranges = chunk_ranges(str(path), data_start, chunk_bytes)
+
+    # Consecutive ranges that cover the whole input after the header
+    assert ranges[0][0] == data_start and ranges[-1][1] == path.stat().st_size
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    return [row for start, end in ranges for row in read_chunk(start, end)]
+
+
+def rows_at_once(path):
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        return list(csv.reader(f))[1:]
+
+
+@pytest.mark.parametrize('line_end', ['\n', '\r\n'])
+@pytest.mark.parametrize('chunk_bytes', [1, 7, 16, 40, 1 << 20])
+def test_quoted_newlines_across_chunk_boundaries(tmp_path, monkeypatch, line_end, chunk_bytes):
+    # Small chunks end inside the quoted fields with newlines, the range has to go on to the end of the record
+    path = tmp_path / 'input.csv'
+    write_input(path, ROWS * 3, line_end)
+    assert rows_by_chunks(path, chunk_bytes, monkeypatch) == rows_at_once(path)
+
+
+@pytest.mark.parametrize('chunk_bytes', [1, 5, 16, 1 << 20])
+def test_quotes_inside_unquoted_fields(tmp_path, monkeypatch, chunk_bytes):
+    # A '"' that does not start a field is an ordinary character: it opens no quoted field, an odd number of them
+    # in a record does not move the record end
+    path = tmp_path / 'input.csv'
+    write_input(path, ROWS, tail='6,Είπε "όχι,ΝΔ\n7,"Μία\nομιλία"ακόμη,ΚΚΕ\n8,τέλος χωρίς αλλαγή γραμμής,ΚΚΕ')
+    rows = rows_by_chunks(path, chunk_bytes, monkeypatch)
+    assert rows == rows_at_once(path)
+    assert [row[0] for row in rows] == ['1', '2', '3', '4', '5', '6', '7', '8']
+
+
+def test_empty_input(tmp_path):
+    path = tmp_path / 'input.csv'
+    write_input(path, [])
+    _, data_start = read_header(str(path))
+    assert chunk_ranges(str(path), data_start, 16) == []
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from corpus import Corpus, TokenCorpus, TokenCorpusWriter, save_token_vocabulary, TOKEN_PATTERN
+
+SPEECHES = [
+    ('ΝΔ', 'φορολογια εισοδημα φορολογια συνταξη'),
+    ('ΚΚΕ', 'συνταξη εργαζομενοι απεργια'),
+    ('ΝΔ', 'εισοδημα αναπτυξη επενδυσεις'),
+    (None, 'μονο εδω εμφανιζεται'),
+    ('ΠΑΣΟΚ', 'υγεια νοσοκομεια υγεια'),
+    ('ΚΚΕ', 'απεργια απεργια συνταξη φορολογια'),
+    ('ΠΑΣΟΚ', ''),
+    ('ΝΔ', 'αναπτυξη'),
+]
+
+
+def make_corpus(tmp_path, speeches):
+    # Token ids as preprocess.py writes them: the vocabulary in order of first occurrence, then the ids of every speech
+    vocabulary = {}
+    ids = [[vocabulary.setdefault(token, len(vocabulary)) for token in TOKEN_PATTERN.findall(text)]
+           for _, text in speeches]
+    tokens_dir = str(tmp_path / 'tokens')
+    save_token_vocabulary(list(vocabulary), tokens_dir)
+
+    ids_path = tmp_path / 'ids.bin'
+    np.array([i for row in ids for i in row], dtype=np.uint32).tofile(ids_path)
+    with TokenCorpusWriter(tokens_dir) as writer:
+        writer.append_shard(str(ids_path), [len(row) for row in ids])
+
+    df = pd.DataFrame({'political_party': [group for group, _ in speeches]})
+    return Corpus(df, TokenCorpus(tokens_dir))
+
+
+def test_group_tfidf_matches_concatenated_texts(tmp_path):
+    corpus = make_corpus(tmp_path, SPEECHES)
+    vectorizer, matrix, group_keys = corpus.group_tfidf(corpus.df['political_party'])
+
+    # The previous way: one document per group with the texts of its speeches, groups sorted, no missing key
+    grouped = pd.DataFrame(SPEECHES, columns=['political_party', 'speech']).groupby('political_party')['speech']
+    texts = grouped.apply(' '.join)
+    expected_vectorizer = TfidfVectorizer()
+    expected = expected_vectorizer.fit_transform(texts)
+
+    assert list(group_keys) == list(texts.index)
+    assert vectorizer.vocabulary_ == expected_vectorizer.vocabulary_
+    assert np.allclose(vectorizer.idf_, expected_vectorizer.idf_)
+    assert np.allclose(matrix.toarray(), expected.toarray())
+    assert matrix.has_sorted_indices
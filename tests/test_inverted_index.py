@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+
+from inverted_index import build_inverted_index, top_k_indices, InvertedIndex
+
+
+def brute_force_ranking(scores, top_k):
+    # Every score compared at once; equal scores go to the larger position, as with a stable argsort()[::-1]
+    return np.argsort(scores, kind='stable')[::-1][:top_k]
+
+
+@pytest.fixture
+def speeches():
+    # Small integer weights: every score below is exact, so equal sums are real ties
+    rng = np.random.default_rng(0)
+    matrix = rng.integers(0, 4, size=(40, 12)).astype(np.float64)
+    matrix[rng.random(matrix.shape) < 0.6] = 0
+    # Copies of rows and empty rows: equal and zero scores for every query
+    matrix[10] = matrix[3]
+    matrix[25] = matrix[3]
+    matrix[31] = matrix[7]
+    matrix[5] = 0
+    return csr_matrix(matrix)
+
+
+@pytest.mark.parametrize('k', [1, 3, 10, 50])
+def test_top_k_indices_matches_sorting(k):
+    rng = np.random.default_rng(k)
+    # Few distinct values, so most of the scores are tied
+    scores = rng.integers(0, 5, size=30).astype(np.float64)
+    assert np.array_equal(top_k_indices(scores, k), brute_force_ranking(scores, k))
+
+
+def test_top_k_indices_empty():
+    assert len(top_k_indices(np.array([1.0, 2.0]), 0)) == 0
+    assert len(top_k_indices(np.empty(0), 5)) == 0
+
+
+@pytest.mark.parametrize('top_k', [1, 5, 40])
+def test_search_matches_brute_force(tmp_path, speeches, top_k):
+    build_inverted_index(speeches, str(tmp_path / 'index'))
+    index = InvertedIndex(str(tmp_path / 'index'))
+
+    # Queries of 1 or 4 equal weights, whose norm is a power of two
+    for term_ids in ([0], [6], [1, 4, 7, 8], [2, 5, 9, 11], [0, 3, 6, 10]):
+        query_vec = csr_matrix((np.full(len(term_ids), 3.0), (np.zeros(len(term_ids), dtype=int), term_ids)),
+                               shape=(1, speeches.shape[1]))
+        docs, scores = index.search(query_vec, top_k)
+
+        expected_scores = (speeches @ query_vec.T).toarray().ravel() / np.sqrt(len(term_ids)) / 3
+        matching = np.flatnonzero(expected_scores > 0)
+        expected = matching[brute_force_ranking(expected_scores[matching], top_k)]
+
+        assert np.array_equal(docs, expected)
+        assert np.allclose(scores, expected_scores[expected])
+
+
+def test_search_empty_query(tmp_path, speeches):
+    build_inverted_index(speeches, str(tmp_path / 'index'))
+    docs, scores = InvertedIndex(str(tmp_path / 'index')).search(csr_matrix((1, speeches.shape[1])), 10)
+    assert len(docs) == 0 and len(scores) == 0
@@ -0,0 +1,41 @@
+import base64
+import json
+
+import pytest
+
+from ranking_cache import encode_cursor, decode_cursor, new_ranking_id
+
+
+def raw_cursor(text):
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+
+@pytest.mark.parametrize('offset', [0, 10, 990])
+def test_cursor_round_trip(offset):
+    ranking_id = new_ranking_id()
+    query = 'συνταξη αγροτ'
+    assert decode_cursor(encode_cursor(ranking_id, offset, query)) == (ranking_id, offset, query, 'lexical', None)
+    assert (decode_cursor(encode_cursor(ranking_id, offset, query, 'clustered', 8))
+            == (ranking_id, offset, query, 'clustered', 8))
+
+
+def test_cursor_without_mode_is_lexical():
+    cursor = raw_cursor(json.dumps({"r": "abc", "o": 10, "q": "συνταξη"}))
+    assert decode_cursor(cursor) == ('abc', 10, 'συνταξη', 'lexical', None)
+
+
+@pytest.mark.parametrize('cursor', [
+    '',
+    'not a cursor',
+    '%%%',
+    raw_cursor('abc:10'),
+    raw_cursor(json.dumps({"r": "abc", "o": 10})),
+    raw_cursor(json.dumps({"r": "abc", "o": "ten", "q": "συνταξη"})),
+    raw_cursor(json.dumps({"r": "", "o": 10, "q": "συνταξη"})),
+    raw_cursor(json.dumps({"r": "abc", "o": -10, "q": "συνταξη"})),
+    raw_cursor(json.dumps({"r": "abc", "o": 10, "q": ""})),
+    raw_cursor(json.dumps({"r": "abc", "o": 10, "q": "συνταξη", "m": "clustered", "p": "all"})),
+])
+def test_bad_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)